@@ -0,0 +1,53 @@
+'''
+Compares the number of environment steps per second of a training A2C agent
+on CartPole, when acting (and storing experiences) one environment step at
+a time, and when stepping N copies of the environment in lockstep, with one
+batched forward pass per step and updates on (n_steps x N) rollouts.
+
+Usage:
+    a2c_synchronous_benchmark.py [options]
+
+Options:
+    --steps=<int>        Approximate number of environment steps per measurement [default: 20000]
+    --n_steps=<int>      Timesteps collected from each environment between updates [default: 5]
+'''
+import time
+
+import gym
+from docopt import docopt
+
+from regym.environments import generate_task
+from regym.rl_algorithms.agents import build_A2C_Agent
+from regym.rl_loops.singleagent_loops.rl_loop import run_episode
+
+
+def a2c_config(n_steps):
+    return {'discount_factor': 0.99, 'n_steps': n_steps, 'samples_before_update': n_steps,
+            'learning_rate': 1.0e-3, 'adam_eps': 1.0e-5}
+
+
+def single_environment_steps_per_second(task, agent, steps):
+    start, total_steps = time.perf_counter(), 0
+    while total_steps < steps: total_steps += len(run_episode(task.env, agent, training=True, render_mode=''))
+    return total_steps / (time.perf_counter() - start)
+
+
+def vectorized_steps_per_second(task, agent, number_of_environments, steps):
+    start, total_steps = time.perf_counter(), 0
+    while total_steps < steps:
+        trajectories = task.run_vectorized_episodes(agent, number_of_environments, episodes=number_of_environments, training=True)
+        total_steps += sum(len(t) for t in trajectories)
+    return total_steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    steps, n_steps = int(args['--steps']), int(args['--n_steps'])
+    task = generate_task('CartPole-v0')
+    print(f'{"Environments":<16}{"steps/s":>10}')
+    rate = single_environment_steps_per_second(task, build_A2C_Agent(task, a2c_config(n_steps), 'A2C'), steps)
+    print(f'{"1 (sequential)":<16}{rate:>10.0f}')
+    for number_of_environments in [4, 16, 64]:
+        agent = build_A2C_Agent(task, a2c_config(n_steps), 'A2C')
+        rate = vectorized_steps_per_second(task, agent, number_of_environments, steps)
+        print(f'{number_of_environments:<16}{rate:>10.0f}')
@@ -0,0 +1,83 @@
+'''
+Measures environment steps per second and gradient steps per second of a
+DQN agent training in Rock Paper Scissors self-play, when training inline
+(DeepQNetworkAgent.handle_experience blocks on every gradient step) and when
+training with the asynchronous learner thread.
+
+Usage:
+    dqn_asynchronous_learner_benchmark.py [options]
+
+Options:
+    --episodes=<int>          Number of timed self-play episodes [default: 200]
+    --batch_size=<int>        Batch size [default: 256]
+    --replay_ratio=<float>    Gradient steps per environment step [default: 1.0]
+    --sync_interval=<int>     Gradient steps between syncs of the inference model [default: 100]
+'''
+import time
+
+from docopt import docopt
+
+import gym_rock_paper_scissors
+from regym.environments import generate_task, EnvType
+from regym.rl_algorithms.agents import build_DQN_Agent
+
+
+def dqn_config(args, asynchronous_training):
+    config = dict()
+    config['learning_rate'] = 1.0e-3
+    config['epsstart'] = 0.4
+    config['epsend'] = 0.01
+    config['epsdecay'] = 5.0e3
+    config['double'] = False
+    config['dueling'] = False
+    config['use_cuda'] = False
+    config['use_PER'] = False
+    config['PER_alpha'] = 0.07
+    config['min_memory'] = args['batch_size']
+    config['memoryCapacity'] = 1.e04
+    config['nbrTrainIteration'] = 1
+    config['batch_size'] = args['batch_size']
+    config['gamma'] = 0.99
+    config['tau'] = 1.0e-2
+    config['asynchronous_training'] = asynchronous_training
+    config['replay_ratio'] = args['replay_ratio']
+    config['inference_sync_interval'] = args['sync_interval']
+    return config
+
+
+def self_play_throughput(task, args, asynchronous_training):
+    agent = build_DQN_Agent(task, dqn_config(args, asynchronous_training), 'DQN')
+    # Warm up, until the agent is ready to train
+    while not agent.algorithm.is_ready_to_train(): task.run_episode([agent, agent], training=True)
+    learner = agent.algorithm.learner
+    if learner is not None:
+        task.run_episode([agent, agent], training=True)  # Starts the learner thread
+        learner.reset_statistics()
+    environment_steps = 0
+    start = time.perf_counter()
+    for _ in range(args['episodes']):
+        environment_steps += len(task.run_episode([agent, agent], training=True))
+    duration = time.perf_counter() - start
+    if learner is None:
+        # Every environment step trained both agents inline
+        gradient_steps = 2 * environment_steps * agent.kwargs['nbrTrainIteration']
+        return {'environment_steps_per_second': environment_steps / duration,
+                'gradient_steps_per_second': gradient_steps / duration}
+    statistics = learner.statistics()
+    learner.close()
+    # The learner counts the experiences of both players
+    statistics['environment_steps_per_second'] = environment_steps / duration
+    return statistics
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    args = {'episodes': int(arguments['--episodes']), 'batch_size': int(arguments['--batch_size']),
+            'replay_ratio': float(arguments['--replay_ratio']), 'sync_interval': int(arguments['--sync_interval'])}
+    task = generate_task('RockPaperScissors-v0', EnvType.MULTIAGENT_SIMULTANEOUS_ACTION)
+
+    print(f'Episodes: {args["episodes"]}. Batch size: {args["batch_size"]}. Replay ratio: {args["replay_ratio"]}')
+    for asynchronous_training in [False, True]:
+        statistics = self_play_throughput(task, args, asynchronous_training)
+        print(f'asynchronous_training={asynchronous_training}: '
+              + ', '.join(f'{k}: {v:.4g}' for k, v in statistics.items()))
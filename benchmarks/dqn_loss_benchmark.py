@@ -0,0 +1,106 @@
+'''
+Compares DQN learner steps per second (sampled batch -> loss -> backward ->
+optimizer step) with the previous implementation of dqn_loss.compute_loss,
+which ran the online model on the next states twice in the Double DQN branch
+and synced every TensorBoard statistic with .item() on every call, and with
+the current single pass implementation.
+
+Usage:
+    dqn_loss_benchmark.py [options]
+
+Options:
+    --batch_size=<int>        Batch size [default: 256]
+    --state_dim=<int>         Dimension of the states [default: 64]
+    --action_dim=<int>        Number of actions [default: 6]
+    --updates=<int>           Number of timed updates [default: 500]
+    --summary_writer          Whether to write TensorBoard summaries (to a temporary directory)
+'''
+import tempfile
+import time
+
+import torch
+import torch.optim as optim
+from docopt import docopt
+from torch.utils.tensorboard import SummaryWriter
+
+from regym.rl_algorithms.DQN import dqn_loss
+from regym.rl_algorithms.networks import CategoricalDQNet, CategoricalDuelingDQNet, FCBody
+
+
+def legacy_compute_loss(states, actions, next_states, rewards, non_terminals, model, target_model,
+                        gamma, use_double, use_dueling, iteration_count, summary_writer):
+    if not use_double:
+        prediction = model(states, action=actions)
+        target_prediction = target_model(next_states)
+        Q_s_a = prediction['Q'].gather(dim=1, index=actions.long().unsqueeze(1))
+        target_Q_succs_a = target_prediction['Q'].detach().max(1)[0]
+        td_target = rewards + non_terminals * (gamma * target_Q_succs_a.view(-1, 1))
+        td_error = td_target.detach() - Q_s_a
+    else:
+        prediction = model(states)
+        succs_prediction = model(next_states)
+        target_prediction = target_model(next_states, action=model(next_states)['a'])
+        Q_s_a = prediction['Q'].gather(dim=1, index=actions.long().unsqueeze(1))
+        target_Q_succs_a = target_prediction['Q'].detach().gather(dim=1, index=succs_prediction['a'].view(-1, 1))
+        td_target = rewards + non_terminals * (gamma * target_Q_succs_a)
+        td_error = td_target.detach() - Q_s_a
+    loss = 0.5 * torch.mean(td_error.pow(2.0))
+    if summary_writer is not None:
+        summary_writer.add_scalar('Training/Mean_q_values', prediction['Q'].cpu().mean().item(), iteration_count)
+        summary_writer.add_scalar('Training/Std_q_values', prediction['Q'].cpu().std().item(), iteration_count)
+        summary_writer.add_scalar('Training/Q_value_loss', loss.cpu().item(), iteration_count)
+        summary_writer.add_scalar('Training/Q_value_entropy', prediction['entropy'].mean().cpu().item(), iteration_count)
+        if use_dueling:
+            summary_writer.add_scalar('Training/Mean_V_value', prediction['V'].cpu().mean().item(), iteration_count)
+            summary_writer.add_scalar('Training/Std_V_value', prediction['V'].cpu().std().item(), iteration_count)
+            summary_writer.add_scalar('Training/Mean_Advantage', prediction['A'].cpu().mean().item(), iteration_count)
+            summary_writer.add_scalar('Training/Std_Advantage', prediction['A'].cpu().std().item(), iteration_count)
+    return loss, td_error.detach()
+
+
+def fused_compute_loss(states, actions, next_states, rewards, non_terminals, model, target_model,
+                       gamma, use_double, use_dueling, iteration_count, summary_writer):
+    dqn_loss.summary_writer = summary_writer
+    return dqn_loss.compute_loss(states=states, actions=actions, next_states=next_states, rewards=rewards,
+                                 non_terminals=non_terminals, model=model, target_model=target_model,
+                                 gamma=gamma, use_double=use_double, use_dueling=use_dueling,
+                                 iteration_count=iteration_count)
+
+
+def learner_steps_per_second(loss_fn, args, use_double, use_dueling, summary_writer):
+    torch.manual_seed(0)
+    B, state_dim, action_dim = args['batch_size'], args['state_dim'], args['action_dim']
+    if use_dueling: model = CategoricalDuelingDQNet(FCBody(state_dim), action_dim)
+    else: model = CategoricalDQNet(FCBody(state_dim), action_dim)
+    target_model = CategoricalDQNet(FCBody(state_dim), action_dim) if not use_dueling \
+                   else CategoricalDuelingDQNet(FCBody(state_dim), action_dim)
+    target_model.load_state_dict(model.state_dict())
+    optimizer = optim.Adam(model.parameters(), lr=1.0e-3)
+    batch = (torch.randn(B, state_dim), torch.randint(action_dim, (B,)), torch.randn(B, state_dim),
+             torch.randn(B, 1), (torch.rand(B, 1) > 0.1).float())
+
+    def update(iteration):
+        optimizer.zero_grad()
+        loss, _ = loss_fn(*batch, model, target_model, gamma=0.99, use_double=use_double,
+                          use_dueling=use_dueling, iteration_count=iteration, summary_writer=summary_writer)
+        loss.backward()
+        optimizer.step()
+
+    for i in range(10): update(i)  # Warm up
+    start = time.perf_counter()
+    for i in range(args['updates']): update(i)
+    return args['updates'] / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    args = {key.strip('-'): int(value) for key, value in arguments.items() if key != '--summary_writer'}
+    summary_writer = SummaryWriter(tempfile.mkdtemp()) if arguments['--summary_writer'] else None
+
+    print(f'Batch size: {args["batch_size"]}. State dim: {args["state_dim"]}. Summaries: {summary_writer is not None}')
+    print(f'{"Variant":<20}{"legacy steps/s":>18}{"fused steps/s":>18}')
+    for use_double, use_dueling in [(False, False), (True, False), (False, True), (True, True)]:
+        name = ('Double ' if use_double else '') + ('Dueling ' if use_dueling else '') + 'DQN'
+        legacy = learner_steps_per_second(legacy_compute_loss, args, use_double, use_dueling, summary_writer)
+        fused = learner_steps_per_second(fused_compute_loss, args, use_double, use_dueling, summary_writer)
+        print(f'{name:<20}{legacy:>18.0f}{fused:>18.0f}')
@@ -0,0 +1,75 @@
+'''
+Measures DQN gradient updates per second with and without the background
+batch prefetcher, and reports the prefetcher counters, which tell whether
+the learner is sample-bound (queue often empty) or compute-bound (queue full).
+
+Usage:
+    dqn_prefetch_benchmark.py [options]
+
+Options:
+    --capacity=<int>          Replay buffer capacity [default: 100000]
+    --batch_size=<int>        Batch size [default: 256]
+    --state_dim=<int>         Dimension of the stored states [default: 64]
+    --updates=<int>           Number of timed gradient updates [default: 500]
+    --prefetch_batches=<int>  Depth of the prefetching queue [default: 4]
+'''
+import time
+
+import torch
+from docopt import docopt
+
+from regym.environments import generate_task
+from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.rl_algorithms.replay_buffers import EXP
+
+
+def dqn_config(capacity, batch_size, prefetch_batches):
+    config = dict()
+    config['learning_rate'] = 1.0e-3
+    config['epsstart'] = 1.0
+    config['epsend'] = 0.1
+    config['epsdecay'] = 1.0e3
+    config['double'] = False
+    config['dueling'] = False
+    config['use_cuda'] = False
+    config['use_PER'] = False
+    config['PER_alpha'] = 0.07
+    config['min_memory'] = batch_size
+    config['memoryCapacity'] = capacity
+    config['nbrTrainIteration'] = 1
+    config['batch_size'] = batch_size
+    config['gamma'] = 0.99
+    config['tau'] = 1.0e-2
+    config['prefetch_batches'] = prefetch_batches
+    return config
+
+
+def updates_per_second(task, args, prefetch_batches):
+    agent = build_DQN_Agent(task, dqn_config(args['capacity'], args['batch_size'], prefetch_batches), 'DQN')
+    algorithm = agent.algorithm
+    for i in range(args['capacity']):
+        algorithm.store_experience(EXP(torch.randn(1, task.observation_dim), torch.LongTensor([i % task.action_dim]),
+                                       torch.randn(1, task.observation_dim), torch.randn(1), i % 10 == 0))
+    algorithm.optimize_model()  # Warm up
+    if algorithm.prefetcher is not None: algorithm.prefetcher.reset_statistics()
+    start = time.perf_counter()
+    for _ in range(args['updates']): algorithm.optimize_model()
+    duration = time.perf_counter() - start
+    statistics = algorithm.prefetcher.statistics() if algorithm.prefetcher is not None else None
+    agent.close()
+    return args['updates'] / duration, statistics
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    args = {key.strip('-'): int(value) for key, value in arguments.items()}
+    task = generate_task('CartPole-v0')
+    # Larger observations make sampling / collation more expensive
+    task.observation_dim = args['state_dim']
+
+    print(f'Capacity: {args["capacity"]}. Batch size: {args["batch_size"]}. State dim: {args["state_dim"]}')
+    for prefetch_batches in [0, args['prefetch_batches']]:
+        rate, statistics = updates_per_second(task, args, prefetch_batches)
+        print(f'prefetch_batches={prefetch_batches}: {rate:.0f} updates/sec')
+        if statistics is not None:
+            print('    ' + ', '.join(f'{k}: {v:.4g}' for k, v in statistics.items()))
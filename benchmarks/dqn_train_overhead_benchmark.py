@@ -0,0 +1,79 @@
+'''
+Measures the per-call overhead of DeepQNetworkAlgorithm.train which is not
+spent in the gradient step itself: regularisation and target network updates.
+
+Compares the previous implementation (an extra zero_grad / backward / Adam step
+on a coupled L2 weight decay loss after every call, and a Python loop over
+parameters for target syncing) against decoupled weight decay applied within
+the AdamW step, and foreach (multi-tensor) hard / soft target updates.
+
+Usage:
+    dqn_train_overhead_benchmark.py [options]
+
+Options:
+    --state_dim=<int>     Dimension of the states [default: 64]
+    --hidden_units=<int>  Number of units in each of the hidden layers [default: 256]
+    --layers=<int>        Number of hidden layers [default: 4]
+    --calls=<int>         Number of timed calls [default: 2000]
+'''
+import time
+
+import torch
+import torch.optim as optim
+from docopt import docopt
+
+from regym.rl_algorithms.networks import CategoricalDQNet, FCBody, hard_update, soft_update
+
+
+def build_model(args):
+    return CategoricalDQNet(FCBody(args['state_dim'], hidden_units=(args['hidden_units'],) * args['layers']), 6)
+
+
+def legacy_weight_decay(model, optimizer):
+    def weight_decay_closure():
+        optimizer.zero_grad()
+        weights_decay_loss = 1e-1 * sum([torch.mean(param * param) for param in model.parameters()])
+        weights_decay_loss.backward()
+        return weights_decay_loss
+    optimizer.step(weight_decay_closure)
+
+
+def legacy_hard_update(fromm, to):
+    for fp, tp in zip(fromm.parameters(), to.parameters()):
+        fp.data.copy_(tp.data)
+
+
+def legacy_soft_update(fromm, to, tau):
+    for fp, tp in zip(fromm.parameters(), to.parameters()):
+        fp.data.copy_(((1.0 - tau) * fp.data) + (tau * tp.data))
+
+
+def time_per_call(fn, calls):
+    for _ in range(10): fn()  # Warm up
+    start = time.perf_counter()
+    for _ in range(calls): fn()
+    return (time.perf_counter() - start) / calls
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    args = {key.strip('-'): int(value) for key, value in arguments.items()}
+    model, target_model = build_model(args), build_model(args)
+    for p in model.parameters(): p.grad = torch.zeros_like(p)
+    adam = optim.Adam(model.parameters(), lr=1.0e-5)
+    adamw = optim.AdamW(model.parameters(), lr=1.0e-5, weight_decay=1.0e-2, foreach=True)
+    adamw_without_decay = optim.AdamW(model.parameters(), lr=1.0e-5, weight_decay=0., foreach=True)
+
+    number_of_parameters = sum(p.numel() for p in model.parameters())
+    print(f'Parameter tensors: {len(list(model.parameters()))}. Parameters: {number_of_parameters}')
+    print(f'{"Operation":<40}{"us/call":>12}')
+    results = [('Legacy weight decay closure', lambda: legacy_weight_decay(model, adam)),
+               # The decoupled weight decay overhead is the difference between both AdamW steps
+               ('AdamW step with weight decay', lambda: adamw.step()),
+               ('AdamW step without weight decay', lambda: adamw_without_decay.step()),
+               ('Legacy hard update', lambda: legacy_hard_update(target_model, model)),
+               ('Foreach hard update', lambda: hard_update(target_model, model)),
+               ('Legacy soft update', lambda: legacy_soft_update(target_model, model, 1.0e-2)),
+               ('Foreach soft update', lambda: soft_update(target_model, model, 1.0e-2))]
+    for name, fn in results:
+        print(f'{name:<40}{time_per_call(fn, args["calls"]) * 1e6:>12.1f}')
@@ -0,0 +1,59 @@
+'''
+Compares the acting throughput (environment steps per second, without training)
+of a DQN agent selecting one action at a time with DeepQNetworkAgent.take_action,
+against selecting the actions of N environment copies at once with
+DeepQNetworkAgent.take_actions, through Task.run_vectorized_episodes.
+
+Usage:
+    dqn_vectorized_acting_benchmark.py [options]
+
+Options:
+    --episodes=<int>          Number of episodes to run [default: 200]
+    --environments=<str>      Comma separated numbers of environment copies [default: 1,4,16,64]
+'''
+import time
+
+from docopt import docopt
+
+from regym.environments import generate_task
+from regym.rl_algorithms.agents import build_DQN_Agent
+
+
+def dqn_config():
+    config = dict()
+    config['learning_rate'] = 1.0e-3
+    config['epsstart'] = 0.1
+    config['epsend'] = 0.1
+    config['epsdecay'] = 1.0e3
+    config['double'] = False
+    config['dueling'] = False
+    config['use_cuda'] = False
+    config['use_PER'] = False
+    config['PER_alpha'] = 0.07
+    config['min_memory'] = 256
+    config['memoryCapacity'] = 1.e04
+    config['nbrTrainIteration'] = 1
+    config['batch_size'] = 256
+    config['gamma'] = 0.99
+    config['tau'] = 1.0e-2
+    return config
+
+
+def steps_per_second(run):
+    start = time.perf_counter()
+    trajectories = run()
+    return sum(map(len, trajectories)) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    episodes = int(args['--episodes'])
+    task = generate_task('CartPole-v0')
+    agent = build_DQN_Agent(task, dqn_config(), 'DQN')
+
+    print(f'Episodes: {episodes}')
+    rate = steps_per_second(lambda: [task.run_episode([agent], training=False) for _ in range(episodes)])
+    print(f'{"take_action":<30}{rate:>10.0f} steps/sec')
+    for n in map(int, args['--environments'].split(',')):
+        rate = steps_per_second(lambda: task.run_vectorized_episodes(agent, n, episodes, training=False))
+        print(f'{f"take_actions, {n} environments":<30}{rate:>10.0f} steps/sec')
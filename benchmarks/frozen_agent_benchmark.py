@@ -0,0 +1,70 @@
+'''
+Compares the number of actions per second taken by agents cloned with
+training=False (eager forward passes, with autograd bookkeeping and the
+construction of every output of the model) against the same agents frozen
+with `agent.freeze()`, which act with a TorchScript, action only, policy
+under torch.inference_mode().
+
+Usage:
+    frozen_agent_benchmark.py [options]
+
+Options:
+    --actions=<int>     Number of timed actions per agent [default: 5000]
+'''
+import time
+
+from docopt import docopt
+
+import gym_rock_paper_scissors
+from regym.environments import generate_task, EnvType
+from regym.rl_algorithms.agents import build_DQN_Agent, build_PPO_Agent, build_A2C_Agent, build_Reinforce_Agent
+
+
+def dqn_config():
+    return {'learning_rate': 1.0e-3, 'epsstart': 0.1, 'epsend': 0.1, 'epsdecay': 1.0e3,
+            'double': False, 'dueling': False, 'use_cuda': False, 'use_PER': False, 'PER_alpha': 0.07,
+            'min_memory': 256, 'memoryCapacity': 1.e03, 'nbrTrainIteration': 1, 'batch_size': 256,
+            'gamma': 0.99, 'tau': 1.0e-2}
+
+
+def ppo_config():
+    return {'discount': 0.99, 'use_gae': False, 'use_cuda': False, 'gae_tau': 0.95, 'entropy_weight': 0.01,
+            'gradient_clip': 5, 'optimization_epochs': 10, 'mini_batch_size': 32, 'ppo_ratio_clip': 0.2,
+            'learning_rate': 3.0e-4, 'adam_eps': 1.0e-5, 'horizon': 128,
+            'phi_arch': 'MLP', 'actor_arch': 'None', 'critic_arch': 'None'}
+
+
+def a2c_config():
+    return {'discount_factor': 0.9, 'n_steps': 5, 'samples_before_update': 30,
+            'learning_rate': 1.0e-3, 'adam_eps': 1.0e-5}
+
+
+def reinforce_config():
+    return {'learning_rate': 5.0e-3, 'episodes_before_update': 50, 'adam_eps': 1.0e-5}
+
+
+def actions_per_second(take_action, observations):
+    for observation in observations[:100]: take_action(observation)  # Warm up
+    start = time.perf_counter()
+    for observation in observations: take_action(observation)
+    return len(observations) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    task = generate_task('RockPaperScissors-v0', EnvType.MULTIAGENT_SIMULTANEOUS_ACTION)
+    observations = [task.env.observation_space.sample()[0] for _ in range(int(args['--actions']))]
+    legal_actions = [0, 1, 2]
+
+    agents = [('DQN', build_DQN_Agent(task, dqn_config(), 'DQN')),
+              ('PPO', build_PPO_Agent(task, ppo_config(), 'PPO')),
+              ('A2C', build_A2C_Agent(task, a2c_config(), 'A2C')),
+              ('REINFORCE', build_Reinforce_Agent(task, reinforce_config(), 'REINFORCE'))]
+    print(f'{"Agent":<12}{"eager actions/s":>18}{"frozen actions/s":>18}')
+    for name, agent in agents:
+        agent.training = False
+        eager = lambda o: agent.take_action(o, legal_actions)
+        frozen_agent = agent.freeze()
+        eager_rate = actions_per_second(eager, observations)
+        frozen_rate = actions_per_second(lambda o: frozen_agent.take_action(o, legal_actions), observations)
+        print(f'{name:<12}{eager_rate:>18.0f}{frozen_rate:>18.0f}')
@@ -0,0 +1,63 @@
+'''
+Compares the total number of actions per second taken by many episode loops
+(threads) running Rock Paper Scissors episodes, when each loop acts with its
+own frozen copy of a DQN policy (size-1 forward passes), and when every loop
+acts through a proxy of a single InferenceServer, which batches their requests.
+
+Usage:
+    inference_server_benchmark.py [options]
+
+Options:
+    --loops=<int>             Number of episode loops (threads) [default: 16]
+    --episodes=<int>          Number of episodes per loop [default: 50]
+    --hidden_units=<int>      Number of units of the hidden layers of the policy [default: 512]
+    --max_latency=<float>     Maximum time (in seconds) a request waits to be batched [default: 0.001]
+'''
+import threading
+import time
+
+from docopt import docopt
+
+import gym_rock_paper_scissors
+from regym.environments import generate_task, EnvType
+from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.rl_algorithms.networks import CategoricalDQNet, FCBody
+from regym.rl_algorithms.inference_server import InferenceServer
+from regym.rl_algorithms import rockAgent
+
+
+def dqn_config():
+    return {'learning_rate': 1.0e-3, 'epsstart': 0.1, 'epsend': 0.1, 'epsdecay': 1.0e3,
+            'double': False, 'dueling': False, 'use_cuda': False, 'use_PER': False, 'PER_alpha': 0.07,
+            'min_memory': 256, 'memoryCapacity': 1.e03, 'nbrTrainIteration': 1, 'batch_size': 256,
+            'gamma': 0.99, 'tau': 1.0e-2}
+
+
+def actions_per_second(task, agents, episodes):
+    trajectories = [[] for _ in agents]
+    def run_episodes(i, task):
+        for _ in range(episodes): trajectories[i].append(task.run_episode([agents[i], rockAgent], training=False))
+    threads = [threading.Thread(target=run_episodes, args=(i, task.clone())) for i in range(len(agents))]
+    start = time.perf_counter()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    duration = time.perf_counter() - start
+    return sum(len(t) for loop_trajectories in trajectories for t in loop_trajectories) / duration
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    loops, episodes, hidden_units = int(args['--loops']), int(args['--episodes']), int(args['--hidden_units'])
+    task = generate_task('RockPaperScissors-v0', EnvType.MULTIAGENT_SIMULTANEOUS_ACTION)
+    agent = build_DQN_Agent(task, dqn_config(), 'DQN')
+    agent.algorithm.model = CategoricalDQNet(FCBody(task.observation_dim, hidden_units=(hidden_units, hidden_units)),
+                                             task.action_dim)
+
+    print(f'Loops: {loops}. Episodes per loop: {episodes}. Hidden units: {hidden_units}')
+    rate = actions_per_second(task, [agent.freeze() for _ in range(loops)], episodes)
+    print(f'{"One frozen agent per loop":<35}{rate:>10.0f} actions/sec')
+    server = InferenceServer.from_agent(agent, max_batch_size=loops, max_latency=float(args['--max_latency']))
+    rate = actions_per_second(task, [server.proxy('DQN') for _ in range(loops)], episodes)
+    server.close()
+    print(f'{"Proxies of one inference server":<35}{rate:>10.0f} actions/sec')
+    print('    ' + ', '.join(f'{k}: {v:.4g}' for k, v in server.statistics().items()))
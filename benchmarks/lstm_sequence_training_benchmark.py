@@ -0,0 +1,65 @@
+'''
+Compares the time of a forward and backward pass of an LSTMBody over a
+minibatch of sequences (as used to train recurrent PPO agents), when the
+sequences are processed timestep by timestep through the LSTMCell layers
+used to act, and when they are packed and processed by fused nn.LSTM calls
+(LSTMBody.forward_sequences).
+
+Usage:
+    lstm_sequence_training_benchmark.py [options]
+
+Options:
+    --sequences=<int>        Number of sequences per minibatch [default: 16]
+    --hidden_units=<int>     Number of units of the (single) LSTM layer [default: 64]
+    --repetitions=<int>      Number of timed forward / backward passes [default: 50]
+'''
+import time
+
+import torch
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_sequence, pad_sequence
+from docopt import docopt
+
+from regym.rl_algorithms.networks import LSTMBody
+
+
+def cell_by_cell(body, sequences, initial_states):
+    # Sequences are padded, and the states of finished sequences are kept with a mask
+    padded = pad_sequence(sequences)
+    lengths = torch.tensor([len(s) for s in sequences])
+    (h,), (c,) = initial_states
+    outputs = []
+    for t in range(padded.size(0)):
+        output, ((nh,), (nc,)) = body((padded[t], ([h], [c])))
+        alive = (t < lengths).unsqueeze(-1)
+        h, c = torch.where(alive, nh, h), torch.where(alive, nc, c)
+        outputs.append(output[alive.squeeze(-1)])
+    return torch.cat(outputs)
+
+
+def fused(body, sequences, initial_states):
+    outputs, _ = body((pack_sequence(sequences, enforce_sorted=False), initial_states))
+    return outputs.data
+
+
+def seconds_per_pass(forward, body, sequences, initial_states, repetitions):
+    for _ in range(5): forward(body, sequences, initial_states).sum().backward()  # Warm up
+    start = time.perf_counter()
+    for _ in range(repetitions): forward(body, sequences, initial_states).sum().backward()
+    return (time.perf_counter() - start) / repetitions
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    number_of_sequences, hidden_units = int(args['--sequences']), int(args['--hidden_units'])
+    body = LSTMBody(30, hidden_units=(hidden_units,), gate=F.leaky_relu)
+    print(f'{"Sequence length":<18}{"cell by cell (ms)":>20}{"fused (ms)":>14}')
+    for sequence_length in [4, 8, 16, 32, 64]:
+        # Sequences end early when episodes do
+        lengths = torch.randint(1, sequence_length + 1, (number_of_sequences,))
+        lengths[0] = sequence_length
+        sequences = [torch.randn(length, 30) for length in lengths.tolist()]
+        initial_states = ([torch.zeros(number_of_sequences, hidden_units)], [torch.zeros(number_of_sequences, hidden_units)])
+        cell_time = seconds_per_pass(cell_by_cell, body, sequences, initial_states, int(args['--repetitions']))
+        fused_time = seconds_per_pass(fused, body, sequences, initial_states, int(args['--repetitions']))
+        print(f'{sequence_length:<18}{cell_time * 1e3:>20.2f}{fused_time * 1e3:>14.2f}')
@@ -0,0 +1,132 @@
+'''
+Measures the number of gradient updates that DQN needs to reach a target
+score on the RandomWalk test environment, for different n-step returns.
+
+The opponent always moves right, so every episode lasts exactly :target:
+steps, and the agent is only rewarded if it also moved right at every step.
+The reward is therefore sparse, and has to be propagated :target: steps back.
+Positions are one-hot encoded, so that the network cannot generalize
+"moving right is good" from the raw positions, and has to propagate the reward.
+
+Usage:
+    n_step_dqn_benchmark.py [options]
+
+Options:
+    --n_steps=<list>          Comma separated n-step values to compare [default: 1,3,6]
+    --target=<int>            Target position of the random walk (episode length) [default: 6]
+    --target_score=<float>    Greedy success rate considered as solving the task [default: 1.0]
+    --evaluation_interval=<int>  Number of training episodes between evaluations [default: 10]
+    --evaluation_episodes=<int>  Number of greedy episodes per evaluation [default: 5]
+    --consecutive_evaluations=<int>  Number of consecutive evaluations which must reach the target score [default: 3]
+    --max_episodes=<int>      Maximum number of training episodes per run [default: 3000]
+    --seeds=<int>             Number of runs (seeds) per n-step value [default: 5]
+'''
+import numpy as np
+import torch
+from docopt import docopt
+from gym.envs.registration import register
+
+from regym.environments import generate_task, EnvType
+from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.tests.rl_algorithms.random_walk_env import RandomWalkEnv
+
+MOVE_RIGHT = 0
+
+
+def dqn_config(n_step):
+    config = dict()
+    config['learning_rate'] = 1.0e-3
+    config['epsstart'] = 0.5
+    config['epsend'] = 0.5
+    config['epsdecay'] = 1.0e3
+    config['double'] = False
+    config['dueling'] = False
+    config['use_cuda'] = False
+    config['use_PER'] = False
+    config['PER_alpha'] = 0.07
+    config['min_memory'] = 64
+    config['memoryCapacity'] = 1.e04
+    config['nbrTrainIteration'] = 1
+    config['batch_size'] = 64
+    config['gamma'] = 0.99
+    config['tau'] = 1.0e-2
+    config['n_step'] = n_step
+    return config
+
+
+def one_hot_observation(observation, target):
+    '''
+    :param observation: positions of both players, within [-target, target]
+    :returns: concatenation of the one-hot encodings of both positions
+    '''
+    one_hot = np.zeros((2, 2 * target + 1), dtype=np.float32)
+    one_hot[[0, 1], observation + target] = 1.
+    return one_hot.reshape(-1)
+
+
+def run_episode(env, agent):
+    '''
+    :returns: reward obtained by the agent (1 if it reached the target together with the opponent)
+    '''
+    observation = one_hot_observation(env.reset()[0], env.target)
+    done = False
+    while not done:
+        action = agent.take_action(observation, legal_actions=[0, 1])
+        succ_observations, rewards, done, _ = env.step([action, MOVE_RIGHT])
+        succ_observation = one_hot_observation(succ_observations[0], env.target)
+        if agent.training:
+            agent.handle_experience(observation, action, rewards[0], succ_observation, done)
+        observation = succ_observation
+    return rewards[0]
+
+
+def evaluate(env, agent, episodes):
+    agent.training = False
+    score = np.mean([run_episode(env, agent) for _ in range(episodes)])
+    agent.training = True
+    return score
+
+
+def updates_to_target_score(task, n_step, seed, args):
+    '''
+    :returns: Number of gradient updates performed before the greedy policy
+              reached (and kept) the target score, or None if it never did.
+    '''
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    env = RandomWalkEnv(target=args['target'])
+    agent = build_DQN_Agent(task, dqn_config(n_step), f'{n_step}_step_DQN')
+    successful_evaluations, first_success_update_count = 0, None
+    for episode in range(1, args['max_episodes'] + 1):
+        run_episode(env, agent)
+        if episode % args['evaluation_interval'] != 0: continue
+        if evaluate(env, agent, args['evaluation_episodes']) >= args['target_score']:
+            if successful_evaluations == 0: first_success_update_count = agent.algorithm.target_update_count
+            successful_evaluations += 1
+            if successful_evaluations == args['consecutive_evaluations']: return first_success_update_count
+        else: successful_evaluations = 0
+    return None
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    args = {'target': int(arguments['--target']),
+            'target_score': float(arguments['--target_score']),
+            'evaluation_interval': int(arguments['--evaluation_interval']),
+            'evaluation_episodes': int(arguments['--evaluation_episodes']),
+            'consecutive_evaluations': int(arguments['--consecutive_evaluations']),
+            'max_episodes': int(arguments['--max_episodes'])}
+    n_steps = [int(n) for n in arguments['--n_steps'].split(',')]
+    seeds = int(arguments['--seeds'])
+
+    register(id='RandomWalk-v0', entry_point='regym.tests.rl_algorithms.random_walk_env:RandomWalkEnv')
+    task = generate_task('RandomWalk-v0', EnvType.MULTIAGENT_SIMULTANEOUS_ACTION)
+    task.observation_dim = 2 * (2 * args['target'] + 1)
+
+    print(f'Target: {args["target"]}. Target score: {args["target_score"]}. Seeds: {seeds}')
+    print(f'{"n_step":<10}{"solved":>10}{"mean updates":>15}{"updates per seed":>30}')
+    for n_step in n_steps:
+        updates = [updates_to_target_score(task, n_step, seed, args) for seed in range(seeds)]
+        solved = [u for u in updates if u is not None]
+        mean_updates = f'{np.mean(solved):.0f}' if solved else '-'
+        print(f'{n_step:<10}{len(solved):>7}/{seeds:<2}{mean_updates:>15}{str(updates):>30}')
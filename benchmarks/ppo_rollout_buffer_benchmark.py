@@ -0,0 +1,121 @@
+'''
+Compares the list based Storage previously used by PPO against the
+preallocated RolloutBuffer, on the storage related work of one PPO update:
+adding :horizon: steps (as done by PPOAgent.handle_experience), computing
+advantages / returns, and retrieving the flattened training tensors.
+Model forward passes and observation preprocessing are excluded.
+
+Allocations are counted as the number of tensors created by (non in-place,
+non view) torch operators.
+
+Usage:
+    ppo_rollout_buffer_benchmark.py [options]
+
+Options:
+    --horizon=<int>       PPO horizon [default: 2048]
+    --state_dim=<int>     Dimension of the observations [default: 32]
+    --repetitions=<int>   Number of timed updates [default: 20]
+    --use_gae             Whether to use Generalized Advantage Estimation
+'''
+import time
+
+import torch
+from docopt import docopt
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from regym.rl_algorithms.replay_buffers import Storage
+from regym.rl_algorithms.networks import CategoricalActorCriticNet, FCBody
+from regym.rl_algorithms.PPO import PPOAlgorithm
+
+
+class AllocationCounter(TorchDispatchMode):
+
+    def __init__(self):
+        super(AllocationCounter, self).__init__()
+        self.allocations = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        output = func(*args, **(kwargs or {}))
+        schema = func._schema
+        if not schema.is_mutable and all(r.alias_info is None for r in schema.returns):
+            self.allocations += sum(isinstance(o, torch.Tensor) for o in tree_flatten(output)[0])
+        return output
+
+
+def generate_rollout(horizon, state_dim):
+    '''
+    :returns: List of (prediction, state, reward, done) tuples,
+              and the prediction on the state following the rollout.
+    '''
+    def prediction():
+        return {'a': torch.randint(3, (1, 1)), 'log_pi_a': torch.randn(1, 1),
+                'ent': torch.rand(1, 1), 'v': torch.randn(1, 1)}
+    steps = [(prediction(), torch.randn(1, state_dim), float(torch.rand(1) > 0.9), bool(torch.rand(1) < 0.05))
+             for _ in range(horizon)]
+    return steps, prediction()
+
+
+def legacy_update(storage, steps, next_prediction, kwargs):
+    for prediction, state, r, done in steps:
+        non_terminal = torch.ones(1) * (1 - int(done))
+        r = torch.ones(1) * r
+        storage.add(prediction)
+        storage.add({'r': r, 'non_terminal': non_terminal, 's': state})
+    storage.add(next_prediction)
+    storage.placeholder()
+
+    advantages = torch.zeros((1, 1))
+    returns = storage.v[-1].detach()
+    for i in reversed(range(kwargs['horizon'])):
+        returns = storage.r[i] + kwargs['discount'] * storage.non_terminal[i] * returns
+        if not kwargs['use_gae']:
+            advantages = returns - storage.v[i].detach()
+        else:
+            td_error = storage.r[i] + kwargs['discount'] * storage.non_terminal[i] * storage.v[i + 1] - storage.v[i]
+            advantages = advantages * kwargs['gae_tau'] * kwargs['discount'] * storage.non_terminal[i] + td_error
+        storage.adv[i] = advantages.detach()
+        storage.ret[i] = returns.detach()
+
+    data = list(map(lambda x: torch.cat(x, dim=0), storage.cat(['s', 'a', 'log_pi_a', 'ret', 'adv'])))
+    storage.reset()
+    return data
+
+
+def rollout_buffer_update(algorithm, steps, next_prediction):
+    for prediction, state, r, done in steps:
+        non_terminal = 1 - int(done)
+        algorithm.storage.add(prediction)
+        algorithm.storage.add({'r': r, 'non_terminal': non_terminal, 's': state})
+    algorithm.storage.add(next_prediction)
+    algorithm.compute_advantages_and_returns()
+    data = algorithm.retrieve_values_from_storage()
+    algorithm.storage.reset()
+    return data
+
+
+def measure(update, repetitions):
+    update()  # Warm up (i.e first allocation of the rollout buffer)
+    counter = AllocationCounter()
+    with counter: update()
+    start = time.perf_counter()
+    for _ in range(repetitions): update()
+    return counter.allocations, (time.perf_counter() - start) / repetitions
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    horizon, state_dim = int(args['--horizon']), int(args['--state_dim'])
+    repetitions = int(args['--repetitions'])
+    kwargs = {'horizon': horizon, 'discount': 0.99, 'use_gae': args['--use_gae'], 'gae_tau': 0.95,
+              'use_cuda': False, 'learning_rate': 3.0e-4, 'adam_eps': 1.0e-5}
+    model = CategoricalActorCriticNet(state_dim, 3, phi_body=FCBody(state_dim, hidden_units=(64, 64)))
+    algorithm = PPOAlgorithm(kwargs, model)
+    steps, next_prediction = generate_rollout(horizon, state_dim)
+
+    print(f'Horizon: {horizon}. GAE: {kwargs["use_gae"]}. Repetitions: {repetitions}')
+    print(f'{"Storage":<20}{"allocations":>15}{"ms/update":>15}')
+    for name, update in [('Storage', lambda: legacy_update(Storage(horizon), steps, next_prediction, kwargs)),
+                         ('RolloutBuffer', lambda: rollout_buffer_update(algorithm, steps, next_prediction))]:
+        allocations, duration = measure(update, repetitions)
+        print(f'{name:<20}{allocations:>15}{duration * 1000:>15.2f}')
@@ -0,0 +1,77 @@
+'''
+Compares sampling and priority update throughput of the recursive
+PrioritizedReplayBuffer against the batched, sum-tree based
+ColumnarPrioritizedReplayBuffer.
+
+Usage:
+    prioritized_replay_buffer_benchmark.py [options]
+
+Options:
+    --capacity=<int>      Replay buffer capacity [default: 1000000]
+    --batch_size=<int>    Batch size used for sampling and updates [default: 256]
+    --iterations=<int>    Number of timed sampling/update calls [default: 200]
+    --state_dim=<int>     Dimension of the stored states [default: 8]
+'''
+import time
+
+import numpy as np
+import torch
+from docopt import docopt
+
+from regym.rl_algorithms.replay_buffers import PrioritizedReplayBuffer, ColumnarPrioritizedReplayBuffer, EXP
+
+
+def fill(replay_buffer, capacity, state_dim):
+    experience = EXP(torch.zeros((1, state_dim)), torch.LongTensor([0]),
+                     torch.zeros((1, state_dim)), torch.zeros(1), False)
+    priorities = np.random.uniform(size=capacity)
+    for priority in priorities:
+        replay_buffer.add(experience, priority)
+
+
+def time_calls(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations): fn()
+    return time.perf_counter() - start
+
+
+def benchmark_recursive_buffer(capacity, batch_size, iterations, state_dim):
+    replay_buffer = PrioritizedReplayBuffer(capacity=capacity)
+    fill(replay_buffer, capacity, state_dim)
+
+    def update():
+        tree_indices = np.random.randint(capacity, size=batch_size) + capacity - 1
+        for idx, priority in zip(tree_indices, np.random.uniform(size=batch_size)):
+            replay_buffer.update(idx, priority)
+
+    sampling_time = time_calls(lambda: replay_buffer.sample(batch_size), iterations)
+    update_time = time_calls(update, iterations)
+    return sampling_time, update_time
+
+
+def benchmark_sum_tree_buffer(capacity, batch_size, iterations, state_dim):
+    replay_buffer = ColumnarPrioritizedReplayBuffer(capacity=capacity)
+    fill(replay_buffer, capacity, state_dim)
+
+    def update():
+        replay_buffer.update(np.random.randint(capacity, size=batch_size),
+                             np.random.uniform(size=batch_size))
+
+    sampling_time = time_calls(lambda: replay_buffer.sample(batch_size), iterations)
+    update_time = time_calls(update, iterations)
+    return sampling_time, update_time
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    capacity, batch_size = int(float(args['--capacity'])), int(args['--batch_size'])
+    iterations, state_dim = int(args['--iterations']), int(args['--state_dim'])
+
+    print(f'Capacity: {capacity}. Batch size: {batch_size}. Iterations: {iterations}')
+    print(f'{"Buffer":<35}{"samples/sec":>15}{"updates/sec":>15}')
+    for name, benchmark in [('PrioritizedReplayBuffer', benchmark_recursive_buffer),
+                            ('ColumnarPrioritizedReplayBuffer', benchmark_sum_tree_buffer)]:
+        sampling_time, update_time = benchmark(capacity, batch_size, iterations, state_dim)
+        samples_per_sec = iterations * batch_size / sampling_time
+        updates_per_sec = iterations * batch_size / update_time
+        print(f'{name:<35}{samples_per_sec:>15.0f}{updates_per_sec:>15.0f}')
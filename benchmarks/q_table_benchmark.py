@@ -0,0 +1,74 @@
+'''
+Compares Q-table backends on Q-learning style updates
+(Q[s, a] += alpha * (r + gamma * max(Q[s', :]) - Q[s, a])) and greedy lookups
+(Q[s, :]) over a subset of visited states of a large state space:
+    - dense:  np.ndarray with a row per state of the state space.
+    - dict:   Python dict mapping visited states to NumPy rows.
+    - hashed: regym.rl_algorithms.TQL.HashedQTable.
+
+Usage:
+    q_table_benchmark.py [options]
+
+Options:
+    --state_space_size=<int>   Number of states of the state space [default: 1000000]
+    --visited_states=<int>     Number of distinct states visited [default: 20000]
+    --operations=<int>         Number of timed updates and lookups [default: 200000]
+    --actions=<int>            Number of actions [default: 3]
+'''
+import sys
+import time
+
+import numpy as np
+from docopt import docopt
+
+from regym.rl_algorithms.TQL import build_q_table
+
+
+class DictQTable():
+
+    def __init__(self, action_space_size):
+        self.rows = {}
+        self.default_row = np.zeros(action_space_size)
+
+    def __getitem__(self, index):
+        s, a = index
+        return self.rows.get(s, self.default_row)[a]
+
+    def __setitem__(self, index, value):
+        s, a = index
+        if s not in self.rows: self.rows[s] = np.zeros(len(self.default_row))
+        self.rows[s][a] = value
+
+    @property
+    def nbytes(self):
+        # Includes the dict itself and the ndarray objects, not only their data
+        return sys.getsizeof(self.rows) + sum(sys.getsizeof(row) for row in self.rows.values())
+
+
+def operations_per_second(q_table, states, actions):
+    start = time.perf_counter()
+    for s, a, succ_s in zip(states[:-1], actions, states[1:]):
+        q_table[s, a] += 0.1 * (1. + 0.9 * max(q_table[succ_s, :]) - q_table[s, a])
+    update_rate = (len(states) - 1) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for s in states: np.argmax(q_table[s, :])
+    return update_rate, len(states) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    state_space_size, number_of_actions = int(args['--state_space_size']), int(args['--actions'])
+    visited_states = np.unique(np.random.randint(state_space_size, size=int(args['--visited_states']), dtype=np.int64))
+    states = np.random.choice(visited_states, size=int(args['--operations'])).tolist()
+    actions = np.random.randint(number_of_actions, size=len(states)).tolist()
+
+    print(f'State space size: {state_space_size}. Visited states: {len(visited_states)}')
+    print(f'{"Backend":<10}{"updates/s":>12}{"lookups/s":>12}{"MB":>10}')
+    for name in ['dense', 'dict', 'hashed']:
+        if name == 'dense' and state_space_size * number_of_actions * 8 > 2**32:
+            print(f'{name:<10}{"(does not fit in memory)":>34}')
+            continue
+        if name == 'dict': q_table = DictQTable(number_of_actions)
+        else: q_table = build_q_table(name, state_space_size, number_of_actions)
+        update_rate, lookup_rate = operations_per_second(q_table, states, actions)
+        print(f'{name:<10}{update_rate:>12.0f}{lookup_rate:>12.0f}{q_table.nbytes / 2**20:>10.2f}')
@@ -0,0 +1,60 @@
+'''
+Compares the menagerie snapshots of a DQN agent stored as clones (training=False),
+as frozen TorchScript policies (`agent.freeze()`) and as int8 dynamically
+quantized frozen policies (`agent.freeze(quantize=True)`), in terms of:
+    - Agreement rate: fraction of observations on which the greedy actions of the
+      quantized policy match those of the float32 policy.
+    - Actions per second of a single snapshot.
+    - Bytes per snapshot, once pickled (as sent between processes / saved to disk).
+
+Usage:
+    quantized_menagerie_benchmark.py [options]
+
+Options:
+    --actions=<int>           Number of timed actions per snapshot [default: 5000]
+    --hidden_units=<int>      Number of units of the hidden layers of the policy [default: 256]
+'''
+import pickle
+import time
+
+import numpy as np
+from docopt import docopt
+
+import gym_rock_paper_scissors
+from regym.environments import generate_task, EnvType
+from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.rl_algorithms.networks import CategoricalDQNet, FCBody
+
+
+def dqn_config():
+    return {'learning_rate': 1.0e-3, 'epsstart': 0.1, 'epsend': 0.1, 'epsdecay': 1.0e3,
+            'double': False, 'dueling': False, 'use_cuda': False, 'use_PER': False, 'PER_alpha': 0.07,
+            'min_memory': 256, 'memoryCapacity': 1.e03, 'nbrTrainIteration': 1, 'batch_size': 256,
+            'gamma': 0.99, 'tau': 1.0e-2}
+
+
+def actions_per_second(take_action, observations):
+    for observation in observations[:100]: take_action(observation)  # Warm up
+    start = time.perf_counter()
+    for observation in observations: take_action(observation)
+    return len(observations) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    hidden_units = int(args['--hidden_units'])
+    task = generate_task('RockPaperScissors-v0', EnvType.MULTIAGENT_SIMULTANEOUS_ACTION)
+    agent = build_DQN_Agent(task, dqn_config(), 'DQN')
+    agent.algorithm.model = CategoricalDQNet(FCBody(task.observation_dim, hidden_units=(hidden_units, hidden_units)),
+                                             task.action_dim)
+    agent.training = False
+    observations = [task.env.observation_space.sample()[0] for _ in range(int(args['--actions']))]
+    legal_actions = [0, 1, 2]
+
+    clone, frozen_agent, quantized_agent = agent.clone(training=False), agent.freeze(), agent.freeze(quantize=True)
+    agreement = np.mean([frozen_agent.take_action(o) == quantized_agent.take_action(o) for o in observations])
+    print(f'Hidden units: {hidden_units}. Greedy action agreement (float32 vs int8): {agreement:.4f}')
+    print(f'{"Snapshot":<20}{"actions/s":>12}{"bytes":>12}')
+    for name, snapshot in [('clone', clone), ('frozen float32', frozen_agent), ('frozen int8', quantized_agent)]:
+        rate = actions_per_second(lambda o: snapshot.take_action(o, legal_actions), observations)
+        print(f'{name:<20}{rate:>12.0f}{len(pickle.dumps(snapshot)):>12}')
@@ -0,0 +1,51 @@
+'''
+Compares REINFORCE agents training on CartPole when the log probability (and
+autograd graph) of every action is kept until the next update, and when only
+observations, actions and rewards are stored, and log probabilities are
+recomputed in a single batched forward pass at update time
+(config['recompute_on_update']). Reports the time spent acting and updating,
+and the time of each update.
+
+Usage:
+    reinforce_update_benchmark.py [options]
+
+Options:
+    --updates=<int>                 Number of timed policy updates [default: 20]
+    --episodes_before_update=<int>  Episodes sampled between updates [default: 50]
+'''
+import time
+
+import gym
+from docopt import docopt
+
+from regym.environments import generate_task
+from regym.rl_algorithms.agents import build_Reinforce_Agent
+
+
+def timings(task, agent, updates, episodes_before_update):
+    train = agent.algorithm.train_on_stored_experiences if agent.algorithm.recompute_on_update else agent.algorithm.train
+    update_time = 0.
+    def timed_train(*args):
+        nonlocal update_time
+        start = time.perf_counter()
+        train(*args)
+        update_time += time.perf_counter() - start
+    if agent.algorithm.recompute_on_update: agent.algorithm.train_on_stored_experiences = timed_train
+    else: agent.algorithm.train = timed_train
+
+    steps, start = 0, time.perf_counter()
+    for _ in range(updates * episodes_before_update): steps += len(task.run_episode([agent], training=True))
+    return steps, time.perf_counter() - start, update_time / updates
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    updates, episodes_before_update = int(args['--updates']), int(args['--episodes_before_update'])
+    task = generate_task('CartPole-v0')
+    print(f'{"Mode":<24}{"steps/s":>10}{"ms per update":>16}')
+    for name, recompute_on_update in [('Stored log probs', False), ('Recompute on update', True)]:
+        config = {'learning_rate': 5.0e-3, 'adam_eps': 1.0e-5, 'episodes_before_update': episodes_before_update,
+                  'recompute_on_update': recompute_on_update}
+        steps, duration, update_duration = timings(task, build_Reinforce_Agent(task, config, 'REINFORCE'),
+                                                   updates, episodes_before_update)
+        print(f'{name:<24}{steps / duration:>10.0f}{update_duration * 1e3:>16.2f}')
@@ -0,0 +1,58 @@
+'''
+Measures the throughput of RepeatedUpdateQLearningAlgorithm updates and
+Boltzman exploratory policies, computed one (s, a, r, s') experience / state
+at a time and in batches (update_q_tables / boltzman_exploratory_policies),
+on a dense Q-table. States are sampled from a small set of states, so that
+batches contain repeated (state, action) pairs.
+
+Usage:
+    ruql_update_benchmark.py [options]
+
+Options:
+    --experiences=<int>       Number of timed updates [default: 100000]
+    --states=<int>            Number of states [default: 1000]
+    --actions=<int>           Number of actions [default: 3]
+    --batch_size=<int>        Number of experiences per batched update [default: 1024]
+'''
+import time
+
+import numpy as np
+from docopt import docopt
+
+from regym.rl_algorithms.TQL import RepeatedUpdateQLearningAlgorithm
+
+
+def per_second(function, batches):
+    start = time.perf_counter()
+    number_of_items = 0
+    for batch in batches: number_of_items += function(*batch)
+    return number_of_items / (time.perf_counter() - start)
+
+
+def single_updates(algorithm, states, actions, rewards, succ_states):
+    for s, a, r, succ_s in zip(states, actions, rewards, succ_states): algorithm.update_q_table(s, a, r, succ_s)
+    return len(states)
+
+
+def single_policies(algorithm, states):
+    for s in states: algorithm.boltzman_exploratory_policy_from_state(s)
+    return len(states)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    number_of_states, number_of_actions = int(args['--states']), int(args['--actions'])
+    experiences, batch_size = int(args['--experiences']), int(args['--batch_size'])
+    algorithm = RepeatedUpdateQLearningAlgorithm(number_of_states, number_of_actions, hashing_function=int,
+                                                 discount_factor=0.99, learning_rate=0.1, temperature=1.)
+    batches = [(np.random.randint(number_of_states, size=batch_size), np.random.randint(number_of_actions, size=batch_size),
+                np.random.normal(size=batch_size), np.random.randint(number_of_states, size=batch_size))
+               for _ in range(experiences // batch_size)]
+
+    print(f'{"":<24}{"single":>14}{"batched":>14}')
+    single_rate = per_second(lambda *batch: single_updates(algorithm, *batch), batches)
+    batched_rate = per_second(lambda *batch: algorithm.update_q_tables(*batch) or len(batch[0]), batches)
+    print(f'{"updates/s":<24}{single_rate:>14.0f}{batched_rate:>14.0f}')
+    single_rate = per_second(lambda states, *_: single_policies(algorithm, states), batches)
+    batched_rate = per_second(lambda states, *_: len(algorithm.boltzman_exploratory_policies(states)), batches)
+    print(f'{"policies/s":<24}{single_rate:>14.0f}{batched_rate:>14.0f}')
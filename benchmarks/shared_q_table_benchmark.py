@@ -0,0 +1,82 @@
+'''
+Measures, for a tabular Q-learning agent on a large dense Q-table:
+    - The time and memory taken by frozen clones (agent.clone(training=False)),
+      as used to add opponents to a menagerie: full deep copies of a 'dense'
+      Q-table against incremental snapshots of a 'shared' one, with 100
+      updates between two clones.
+    - The total number of Q-learning updates per second applied to a single
+      SharedQTable by 1 to --processes processes (Hogwild style, without locks).
+
+Usage:
+    shared_q_table_benchmark.py [options]
+
+Options:
+    --state_space_size=<int>    Number of states [default: 1000000]
+    --clones=<int>              Number of frozen clones [default: 20]
+    --updates=<int>             Number of updates per process [default: 200000]
+    --processes=<int>           Maximum number of updating processes [default: 4]
+'''
+import multiprocessing
+import pickle
+import time
+
+import numpy as np
+from docopt import docopt
+
+from regym.rl_algorithms.agents.tabular_q_learning_agent import TabularQLearningAgent
+from regym.rl_algorithms.TQL import TabularQLearningAlgorithm, QTableSnapshot
+
+
+def build_agent(state_space_size, backend):
+    algorithm = TabularQLearningAlgorithm(state_space_size, 3, hashing_function=int, discount_factor=0.99,
+                                          epsilon_greedy=0.1, learning_rate=0.1, q_table_backend=backend)
+    return TabularQLearningAgent(name='TQL', algorithm=algorithm)
+
+
+def distinct_nbytes(q_tables):
+    # Snapshots share pages with each other: each page is only counted once
+    arrays = {id(array): array for q_table in q_tables
+              for array in (q_table.pages if isinstance(q_table, QTableSnapshot) else [q_table]) if array.base is None}
+    return sum(array.nbytes for array in arrays.values())
+
+
+def apply_updates(pickled_agent, updates, seed):
+    agent = pickle.loads(pickled_agent)
+    random_state = np.random.RandomState(seed)
+    states = random_state.randint(agent.algorithm.Q_table.shape[0], size=updates + 1).tolist()
+    actions = random_state.randint(3, size=updates).tolist()
+    for s, a, succ_s in zip(states[:-1], actions, states[1:]): agent.algorithm.update_q_table(s, a, 1., succ_s)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    state_space_size, number_of_clones = int(args['--state_space_size']), int(args['--clones'])
+    updates = int(args['--updates'])
+
+    print(f'{"Frozen clones of":<24}{"ms per clone":>14}{"MB per clone":>14}')
+    for backend in ['dense', 'shared']:
+        agent = build_agent(state_space_size, backend)
+        clones, duration = [], 0.
+        for _ in range(number_of_clones):
+            # Snapshots only copy the pages written to since the previous snapshot
+            for s in np.random.randint(state_space_size, size=100): agent.algorithm.update_q_table(s, 0, 1., s)
+            start = time.perf_counter()
+            clones.append(agent.clone(training=False))
+            duration += (time.perf_counter() - start) / number_of_clones
+        megabytes = distinct_nbytes([clone.algorithm.Q_table for clone in clones]) / number_of_clones / 2**20
+        print(f'{backend + " Q-table":<24}{duration * 1e3:>14.2f}{megabytes:>14.2f}')
+
+    agent = build_agent(state_space_size, 'shared')
+    # Pickling a SharedQTable copies it: processes are sent a handle attaching to the same table.
+    # The table itself is kept alive, as its segment is unlinked once it is collected
+    shared_q_table = agent.algorithm.Q_table
+    agent.algorithm.Q_table = shared_q_table.handle()
+    context = multiprocessing.get_context('spawn')
+    print(f'{"Processes":<24}{"updates/s":>14}')
+    for number_of_processes in range(1, int(args['--processes']) + 1):
+        processes = [context.Process(target=apply_updates, args=(pickle.dumps(agent), updates, seed))
+                     for seed in range(number_of_processes)]
+        start = time.perf_counter()
+        for process in processes: process.start()
+        for process in processes: process.join()
+        print(f'{number_of_processes:<24}{number_of_processes * updates / (time.perf_counter() - start):>14.0f}')
@@ -4,6 +4,7 @@ from typing import List, Callable, Any, Dict
 from dataclasses import dataclass, field
 
 import gym
+import numpy as np
 
 import regym
 
@@ -104,6 +105,21 @@ class Task:
         if self.env_type == EnvType.MULTIAGENT_SEQUENTIAL_ACTION:
             return regym.rl_loops.multiagent_loops.sequential_action_rl_loop.run_episode(self.env, extended_agent_vector, training, render_mode)
 
+    def run_vectorized_episodes(self, agent, number_of_environments: int, episodes: int, training: bool):
+        '''
+        Runs :param episodes: episodes of the Task's underlying (single-agent) environment,
+        on :param number_of_environments: copies of it stepped in lockstep, with :param agent:
+        choosing the actions of all copies at once (see
+        regym.rl_loops.singleagent_loops.vectorized_rl_loop.run_episodes).
+        Each copy is seeded independently.
+        '''
+        if self.env_type != EnvType.SINGLE_AGENT:
+            raise ValueError('Only SINGLE_AGENT tasks can be run on vectorized environments')
+        envs = [deepcopy(self.env) for _ in range(number_of_environments)]
+        for env in envs: env.seed(int(np.random.randint(2**31)))
+        self.total_episodes_run += episodes
+        return regym.rl_loops.singleagent_loops.vectorized_rl_loop.run_episodes(envs, agent, episodes, training)
+
     def _extend_agent_vector(self, agent_vector: List):
         # This should be much prettier
         agent_index = 0
@@ -3,7 +3,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from regym.rl_algorithms.networks.utils import layer_init
+from regym.rl_algorithms.networks.utils import layer_init, PreprocessFunction
+from regym.rl_algorithms.advantage_estimation import compute_returns
 
 from functools import reduce
 
@@ -11,40 +12,101 @@ from functools import reduce
 class A2CAlgorithm():
 
     def __init__(self, policy_model_input_dim, policy_model_output_dim,
-                 discount_factor, n_steps, learning_rate, adam_eps):
+                 discount_factor, n_steps, learning_rate, adam_eps, normalize_observations=False):
         self.discount_factor = discount_factor
         self.learning_rate = learning_rate
 
         self.n_steps = n_steps
         self.model = FullyConnectedFeedForward(policy_model_input_dim, policy_model_output_dim, hidden_units=(16,))
         self.optimizer = optim.Adam(self.model.parameters(), lr=learning_rate, eps=adam_eps)
+        self.state_preprocessing = PreprocessFunction(policy_model_input_dim, normalize=normalize_observations)
 
-    def train(self, samples, bootstrapped_reward):
-        rewards                  = np.array([reward for (s, a, log_a, reward, state_value, succ_s, done) in samples])
-        q_values                 = self.compute_temporal_differences_targets(rewards, bootstrapped_reward)
-        state_values             = torch.cat([state_value for (s, a, log_a, reward, state_value, succ_s, done) in samples])
-        log_action_probabilities = torch.cat([log_a for (s, a, log_a, reward, state_value, succ_s, done) in samples])
+        self.rollout = None
+        self.rollout_length = 0
+
+    def allocate_rollout(self, length: int, number_of_environments: int):
+        '''
+        (Re)allocates the buffers where experiences are stored until the next update:
+        :param length: timesteps collected from each of :param number_of_environments:
+        environments stepped in lockstep.
+        '''
+        input_dim, action_dim = self.model.layers[0].in_features, self.model.policy_head_layer.out_features
+        self.rollout = {'states': torch.zeros((length, number_of_environments, input_dim), dtype=torch.float32),
+                        'actions': torch.zeros((length, number_of_environments), dtype=torch.long),
+                        'rewards': torch.zeros((length, number_of_environments), dtype=torch.float32),
+                        'non_terminals': torch.zeros((length, number_of_environments), dtype=torch.float32),
+                        'legal_action_masks': torch.ones((length, number_of_environments, action_dim),
+                                                         dtype=torch.bool)}
+        self.rollout_length = 0
+
+    def has_rollout(self, length: int, number_of_environments: int) -> bool:
+        return self.rollout is not None and tuple(self.rollout['actions'].shape) == (length, number_of_environments)
+
+    def is_rollout_full(self) -> bool:
+        return self.rollout_length == self.rollout['actions'].size(0)
+
+    def store_experiences(self, states: torch.Tensor, actions, rewards, dones, legal_action_masks=None):
+        '''
+        Stores one timestep of experiences, one per environment.
+        :param states: Dimension: N x input_dim. Preprocessed observations.
+        :param actions: Dimension: N.
+        :param rewards: Dimension: N.
+        :param dones: Dimension: N.
+        :param legal_action_masks: (optional) Boolean tensor of dimension N x action_dim, True for
+                                   the legal actions at :param states:. All actions are legal if None.
+        '''
+        t = self.rollout_length
+        self.rollout['states'][t] = states
+        self.rollout['legal_action_masks'][t] = (True if legal_action_masks is None
+                                                 else torch.as_tensor(legal_action_masks))
+        self.rollout['actions'][t] = torch.as_tensor(np.asarray(actions), dtype=torch.long)
+        self.rollout['rewards'][t] = torch.as_tensor(np.asarray(rewards), dtype=torch.float32)
+        self.rollout['non_terminals'][t] = torch.as_tensor(1. - np.asarray(dones, dtype=np.float32))
+        self.rollout_length += 1
+
+    def train(self, bootstrap_states: torch.Tensor):
+        '''
+        Updates the model on the stored rollout, and empties it.
+        Action log probabilities and state values are computed for every stored
+        experience at once, in a single forward pass.
+        :param bootstrap_states: Dimension: N x input_dim. Preprocessed observations
+                                 following the last stored timestep.
+        '''
+        length = self.rollout_length
+        states, actions = self.rollout['states'][:length], self.rollout['actions'][:length]
+        legal_action_masks = self.rollout['legal_action_masks'][:length]
+        with torch.no_grad():
+            bootstrap_values = self.model.state_value(bootstrap_states).view(-1)
+        q_values = self.compute_temporal_differences_targets(self.rollout['rewards'][:length],
+                                                             self.rollout['non_terminals'][:length],
+                                                             bootstrap_values).view(-1)
 
         def closure():
             self.optimizer.zero_grad()
+            log_action_probabilities, state_values = self.model.evaluate_actions(
+                states.view(-1, states.size(-1)), actions.reshape(-1),
+                legal_action_masks.view(-1, legal_action_masks.size(-1)))
             policy_loss = -1. * self.compute_policy_utility_gradient(log_action_probabilities, q_values, state_values)
-            value_loss  = nn.MSELoss()(state_values.squeeze(), q_values)
+            value_loss  = nn.MSELoss()(state_values.view(-1), q_values)
             (policy_loss + value_loss).backward()
-            torch.nn.utils.clip_grad_norm(self.model.parameters(), 0.5)
+            torch.nn.utils.clip_grad_norm_(self.model.parameters(), 0.5)
             return (policy_loss + value_loss)
         self.optimizer.step(closure)
+        self.rollout_length = 0
 
     def compute_policy_utility_gradient(self, log_action_probabilities, q_values, state_values):
-        advantages = (q_values - state_values.squeeze()).detach()
-        return torch.mean(log_action_probabilities.squeeze() * advantages)
+        advantages = (q_values - state_values.view(-1)).detach()
+        return torch.mean(log_action_probabilities.view(-1) * advantages)
 
-    def compute_temporal_differences_targets(self, rewards, bootstrapped_reward):
-        discounted_rewards = np.zeros_like(rewards)
-        running_add = bootstrapped_reward
-        for t in reversed(range(0, len(rewards))):
-            running_add = rewards[t] + self.discount_factor * running_add
-            discounted_rewards[t] = running_add
-        return torch.from_numpy(discounted_rewards).type(torch.FloatTensor)
+    def compute_temporal_differences_targets(self, rewards, non_terminals, bootstrap_values):
+        '''
+        :param rewards: Dimension: T x N.
+        :param non_terminals: Dimension: T x N. 0 at steps which finished an episode, 1 otherwise.
+        :param bootstrap_values: Dimension: N. State values of the observations following the last step.
+        :returns: Bootstrapped discounted returns, of dimension T x N.
+        '''
+        return compute_returns(rewards, non_terminals, bootstrap_values=bootstrap_values,
+                               discount=self.discount_factor)
 
 
 class FullyConnectedFeedForward(nn.Module):
@@ -58,20 +120,53 @@ class FullyConnectedFeedForward(nn.Module):
         self.value_head_layer = layer_init(nn.Linear(hidden_units[-1], 1))
         self.gate = gate
 
-    def forward(self, x):
-        x = torch.Tensor(x).unsqueeze(0).type(torch.FloatTensor).cpu()
+    def forward(self, x: torch.Tensor, legal_action_mask: torch.Tensor = None):
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :param legal_action_mask: (optional) Boolean tensor of dimension batch_size x output_dim,
+                                  True for legal actions. All actions are legal if None.
+        '''
         last_layer_output = reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x)
         # Policy head
-        action, log_probability = self.policy_head(self.gate(self.policy_head_layer(last_layer_output)))
+        action, log_probability = self.policy_head(self.gate(self.policy_head_layer(last_layer_output)), legal_action_mask)
         # Value head
         state_value = self.value_head_layer(last_layer_output)
         return {'action': action,
                 'action_log_probability': log_probability,
                 'state_value': state_value}
 
-    def policy_head(self, last_layer_output):
-        action_probabilities = F.softmax(last_layer_output)
-        distribution = torch.distributions.Categorical(probs=action_probabilities)
-        action = distribution.sample(sample_shape=(action_probabilities.size(0),))
-        log_probability = distribution.log_prob(action)
-        return action, log_probability
+    def evaluate_actions(self, x: torch.Tensor, actions: torch.Tensor, legal_action_mask: torch.Tensor = None):
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :param actions: Dimension: batch_size. Actions taken at observations :param x:.
+        :param legal_action_mask: (optional) Boolean tensor of dimension batch_size x output_dim,
+                                  True for the actions which were legal when :param actions: were taken.
+        :returns: Log probabilities of :param actions: and state values, both of dimension batch_size x 1.
+        '''
+        last_layer_output = reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x)
+        logits = self.gate(self.policy_head_layer(last_layer_output))
+        if legal_action_mask is not None: logits = logits.masked_fill(~legal_action_mask, -1.0e9)
+        log_probabilities = F.log_softmax(logits, dim=-1)
+        return log_probabilities.gather(1, actions.view(-1, 1)), self.value_head_layer(last_layer_output)
+
+    def state_value(self, x: torch.Tensor) -> torch.Tensor:
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :returns: State values, of dimension batch_size x 1, without computing the policy head.
+        '''
+        return self.value_head_layer(reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x))
+
+    def policy_logits(self, x: torch.Tensor) -> torch.Tensor:
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :returns: Action logits of the policy head, without computing the value head.
+        '''
+        last_layer_output = reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x)
+        return self.gate(self.policy_head_layer(last_layer_output))
+
+    def policy_head(self, logits, legal_action_mask=None):
+        # One action sampled per row: batch_size x 1
+        if legal_action_mask is not None: logits = logits.masked_fill(~legal_action_mask, -1.0e9)
+        log_probabilities = F.log_softmax(logits, dim=-1)
+        action = torch.multinomial(log_probabilities.exp(), num_samples=1)
+        return action, log_probabilities.gather(1, action)
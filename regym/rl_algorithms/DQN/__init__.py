@@ -1 +1,3 @@
 from .deep_q_network import DeepQNetworkAlgorithm
+from .actor_learner import train_with_actors
+from .asynchronous_learner import AsynchronousLearner
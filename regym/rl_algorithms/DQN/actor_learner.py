@@ -0,0 +1,70 @@
+import copy
+import time
+
+import numpy as np
+import torch
+from torch.multiprocessing import Process
+
+from regym.rl_algorithms.replay_buffers import SharedMemoryReplayBuffer
+
+
+def run_actor(task, actor, episodes: int, seed: int):
+    '''
+    Runs :param episodes: episodes of :param task:, storing the experiences
+    of :param actor: in its (shared) replay buffer.
+    '''
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    # Actors are many small processes, intra-op parallelism would oversubscribe the cores
+    torch.set_num_threads(1)
+    for _ in range(episodes):
+        task.run_episode([actor], training=True)
+
+
+def publish_weights(agent, shared_model: torch.nn.Module):
+    with torch.no_grad():
+        shared_model.load_state_dict(agent.algorithm.model.state_dict())
+
+
+def train_with_actors(task, agent, number_of_actors: int, episodes_per_actor: int,
+                      weight_publishing_interval: int = 100, seed: int = 0):
+    '''
+    Trains :param agent: (the learner) on experiences collected by
+    :param number_of_actors: actor processes, each running :param episodes_per_actor:
+    episodes of :param task:. All actors write into the learner's SharedMemoryReplayBuffer,
+    while the learner samples from it in this process.
+
+    Actors act with a copy of the learner's model living in shared memory,
+    to which the learner publishes its weights every :param weight_publishing_interval:
+    training iterations. Actors never modify it.
+
+    If :param task: is a multiagent task, the other agents must have been
+    fixed via Task.extend_task, as actors run episodes as the only agent.
+
+    :param agent: DeepQNetworkAgent whose algorithm was built with "shared_replay".
+    :returns: Number of training iterations (gradient steps) performed by the learner.
+    '''
+    if not isinstance(agent.algorithm.replayBuffer, SharedMemoryReplayBuffer):
+        raise ValueError('Training with actors requires a DQN agent with a "shared_replay" buffer')
+    # Shared columns must be allocated, from a first experience, before starting the actors
+    while agent.algorithm.replayBuffer.columns is None:
+        task.run_episode([agent], training=True)
+
+    shared_model = copy.deepcopy(agent.algorithm.model)
+    shared_model.share_memory()
+    actors = [agent.actor_clone(shared_model) for _ in range(number_of_actors)]
+    processes = [Process(target=run_actor, args=(task, actor, episodes_per_actor, seed + i))
+                 for i, actor in enumerate(actors)]
+    for process in processes: process.start()
+
+    iterations, iterations_per_call = 0, agent.kwargs['nbrTrainIteration']
+    while any(process.is_alive() for process in processes):
+        if not agent.algorithm.is_ready_to_train():
+            time.sleep(0.01)
+            continue
+        agent.algorithm.train(iterations=iterations_per_call)
+        iterations += iterations_per_call
+        if (iterations - iterations_per_call) // weight_publishing_interval != iterations // weight_publishing_interval:
+            publish_weights(agent, shared_model)
+    for process in processes: process.join()
+    return iterations
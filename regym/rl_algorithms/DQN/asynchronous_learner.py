@@ -0,0 +1,145 @@
+from typing import Dict
+import copy
+import threading
+import time
+
+
+class AsynchronousLearner():
+    '''
+    Background thread training a DeepQNetworkAlgorithm on its replay buffer,
+    so that acting and storing experiences never blocks on a gradient step.
+
+    The learner performs :param replay_ratio: gradient steps (calls to
+    :func: DeepQNetworkAlgorithm.train with a single iteration) per environment
+    step recorded through :func: record_environment_step, counted from the
+    moment the algorithm is ready to train. It waits whenever it is ahead
+    of that target. If the environment runs faster than the learner,
+    the environment is not slowed down and the learner falls behind.
+
+    Actions should be selected with :attr: inference_model, a copy of the
+    model which is replaced by a fresh copy every :param sync_interval: gradient steps,
+    so that acting never reads weights which are being updated.
+    The replay buffer is guarded by :attr: lock (see DeepQNetworkAlgorithm.replay_buffer_lock),
+    and each gradient step is taken while holding :attr: training_lock, which should
+    be held to read the weights of the algorithm consistently (i.e to copy them).
+    '''
+
+    def __init__(self, algorithm, replay_ratio: float, sync_interval: int):
+        self.algorithm = algorithm
+        self.replay_ratio = replay_ratio
+        self.sync_interval = sync_interval
+        self.inference_model = copy.deepcopy(algorithm.model)
+        self._initialize_thread_state()
+        self.reset_statistics()
+
+    def _initialize_thread_state(self):
+        self.lock = threading.Lock()
+        self.training_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.exception = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _is_behind(self) -> bool:
+        return self.gradient_steps < self.replay_ratio * self.environment_steps
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            with self.condition:
+                if not self._is_behind():
+                    self.condition.wait(timeout=0.1)
+                    continue
+            try:
+                with self.training_lock: self.algorithm.train(iterations=1)
+            except Exception as e:
+                self.exception = e
+                return
+            with self.condition:
+                self.gradient_steps += 1
+                if self.gradient_steps % self.sync_interval == 0: self.sync_inference_model()
+                self.condition.notify_all()
+
+    def sync_inference_model(self):
+        '''
+        Replaces :attr: inference_model by a copy of the learner's current model.
+        A new copy is made, instead of loading the weights in place, so that an action
+        being computed with the previous inference model is never affected.
+        '''
+        with self.training_lock: self.inference_model = copy.deepcopy(self.algorithm.model)
+        self.model_syncs += 1
+
+    def record_environment_step(self):
+        '''
+        Records that one experience was handed to the algorithm.
+        Starts the learning thread once the algorithm is ready to train.
+        '''
+        self._raise_if_failed()
+        if self.thread is None:
+            if not self.algorithm.is_ready_to_train(): return
+            self.start()
+        with self.condition:
+            self.environment_steps += 1
+            self.condition.notify_all()
+
+    def synchronize(self, timeout: float = None):
+        '''
+        Waits until the learner has performed all the gradient steps
+        owed for the environment steps recorded so far (or :param timeout: seconds),
+        then syncs :attr: inference_model. Useful before evaluating the agent.
+        '''
+        with self.condition:
+            if self.thread is not None:
+                self.condition.wait_for(lambda: not self._is_behind() or self.exception is not None,
+                                        timeout=timeout)
+            self._raise_if_failed()
+            self.sync_inference_model()
+
+    def _raise_if_failed(self):
+        if self.exception is not None:
+            raise RuntimeError('Asynchronous learner thread failed') from self.exception
+
+    def close(self):
+        if self.thread is None: return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.stop_event.clear()
+
+    def reset_statistics(self):
+        with self.condition:
+            self.environment_steps = 0
+            self.gradient_steps = 0
+            self.model_syncs = 0
+            self.start_time = time.perf_counter()
+
+    def statistics(self) -> Dict[str, float]:
+        '''
+        :returns: Dictionary containing, since the learner started (or since :func: reset_statistics):
+            - 'environment_steps': number of recorded environment steps.
+            - 'gradient_steps': number of gradient steps performed by the learner.
+            - 'environment_steps_per_second': measured environment throughput.
+            - 'gradient_steps_per_second': measured learner throughput.
+            - 'replay_ratio': achieved number of gradient steps per environment step.
+            - 'model_syncs': number of times the inference model was synced.
+        '''
+        duration = max(time.perf_counter() - self.start_time, 1e-9)
+        return {'environment_steps': self.environment_steps,
+                'gradient_steps': self.gradient_steps,
+                'environment_steps_per_second': self.environment_steps / duration,
+                'gradient_steps_per_second': self.gradient_steps / duration,
+                'replay_ratio': self.gradient_steps / max(1, self.environment_steps),
+                'model_syncs': self.model_syncs}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['lock', 'training_lock', 'condition', 'stop_event', 'thread', 'exception']: del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._initialize_thread_state()
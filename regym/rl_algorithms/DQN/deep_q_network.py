@@ -1,14 +1,16 @@
 from typing import Dict
+import contextlib
 import copy
 
 import torch
 import torch.optim as optim
-from torch.autograd import Variable
 
-from regym.rl_algorithms.replay_buffers import ReplayBuffer, PrioritizedReplayBuffer, EXP, EXPPER
-from regym.rl_algorithms.networks.utils import hard_update
-from regym.rl_algorithms.networks.utils import compute_weights_decay_loss
+from regym.rl_algorithms.replay_buffers import ColumnarReplayBuffer, ColumnarPrioritizedReplayBuffer, MemoryMappedReplayBuffer
+from regym.rl_algorithms.replay_buffers import EpisodicReplayBuffer, SharedMemoryReplayBuffer, NStepAccumulator, EXP
+from regym.rl_algorithms.replay_buffers import BatchPrefetcher
+from regym.rl_algorithms.networks.utils import hard_update, soft_update
 from regym.rl_algorithms.DQN.dqn_loss import compute_loss
+from regym.rl_algorithms.DQN.asynchronous_learner import AsynchronousLearner
 
 
 class DeepQNetworkAlgorithm():
@@ -18,15 +20,49 @@ class DeepQNetworkAlgorithm():
         :param kwargs:
             "use_cuda": boolean to specify whether to use CUDA.
             "replay_capacity": int, capacity of the replay buffer to use.
+            "replay_directory": (optional) str, directory where a memory mapped, out-of-core replay buffer is stored.
+                                It is reopened if it already contains a checkpoint. Not compatible with "use_PER".
+            "deduplicate_observations": (optional) boolean, whether to use an episode aware replay buffer which
+                                        stores each observation once. Not compatible with "use_PER". [default: False]
+            "shared_replay": (optional) boolean, whether to use a replay buffer living in shared memory, which several
+                             actor processes can write into (see regym.rl_algorithms.DQN.train_with_actors).
+                             Not compatible with "use_PER". [default: False]
             "min_capacity": int, minimal capacity before starting to learn.
             "batch_size": int, batch size to use [default: batch_size=256].
+            "prefetch_batches": (optional) int, number of batches sampled and collated ahead of time
+                                by a background thread. Disabled if 0. [default: prefetch_batches=0]
+            "prefetch_refresh_fraction": (optional) float, prefetched batches are discarded once this fraction
+                                         of the replay buffer has been written since they were sampled.
+                                         [default: prefetch_refresh_fraction=0.05]
             "use_PER": boolean to specify whether to use a Prioritized Experience Replay buffer.
             "PER_alpha": float, alpha value for the Prioritized Experience Replay buffer.
+            "PER_beta": float, importance sampling exponent for the Prioritized Experience Replay buffer. [default: PER_beta=1.0]
             "lr": float, learning rate.
-            "tau": float, target update rate.
+            "tau": float, target update rate. With hard target updates, the target network
+                   is copied from the model every 1/tau training iterations. With soft target updates,
+                   it is moved towards the model by Polyak averaging with coefficient tau after every iteration.
+            "target_update": (optional) str, either 'hard' or 'soft'. [default: 'hard']
+            "weight_decay": (optional) float, coefficient of the decoupled weight decay (AdamW)
+                            applied within each optimizer step. [default: weight_decay=1e-2]
+                            NOTE: this replaces the extra Adam step taken after every call to train
+                            on the coupled L2 loss 1e-1 * sum(mean(param^2)). As Adam normalises the
+                            gradient of that loss, it has no equivalent coefficient, hence
+                            existing configs are regularised differently. Set to 0 to disable.
             "gamma": float, Q-learning gamma rate.
+            "huber_loss_delta": (optional) float, if set, the Huber loss with this threshold is minimized
+                                instead of the squared TD error. [default: None]
+            "summary_interval": (optional) int, number of training iterations between two writes of
+                                the loss statistics to regym.rl_algorithms.DQN.dqn_loss.summary_writer. [default: 100]
+            "n_step": (optional) int, number of steps used to compute bootstrapped returns. [default: n_step=1]
             "preprocess": preprocessing function/transformation to apply to observations [default: preprocess=T.ToTensor()]
             "nbrTrainIteration": int, number of iteration to train the model at each new experience. [default: nbrTrainIteration=1]
+            "asynchronous_training": (optional) boolean, whether to train in a background learner thread
+                                     (see regym.rl_algorithms.DQN.AsynchronousLearner) instead of
+                                     training inline after each experience. [default: False]
+            "replay_ratio": (optional) float, number of gradient steps performed by the asynchronous learner
+                            per environment step. [default: replay_ratio=nbrTrainIteration]
+            "inference_sync_interval": (optional) int, number of gradient steps between two syncs of the model
+                                       used for acting with the asynchronous learner's model. [default: 100]
             "epsstart": starting value of the epsilong for the epsilon-greedy policy.
             "epsend": asymptotic value of the epsilon for the epsilon-greedy policy.
             "epsdecay": rate at which the epsilon of the epsilon-greedy policy decays.
@@ -58,23 +94,53 @@ class DeepQNetworkAlgorithm():
         self.target_model.share_memory()
 
         # Replay buffer parameters
-        if kwargs["use_PER"]:
-            self.replayBuffer = PrioritizedReplayBuffer(capacity=kwargs["replay_capacity"], alpha=kwargs["PER_alpha"])
+        self.use_PER = kwargs["use_PER"]
+        self.shared_replay = kwargs["shared_replay"] if "shared_replay" in kwargs else False
+        if self.use_PER and self.shared_replay:
+            raise ValueError('Prioritized Experience Replay is not supported together with "shared_replay"')
+        if self.shared_replay:
+            self.replayBuffer = SharedMemoryReplayBuffer(capacity=kwargs["replay_capacity"])
+        elif self.use_PER:
+            PER_beta = kwargs["PER_beta"] if "PER_beta" in kwargs else 1.0
+            self.replayBuffer = ColumnarPrioritizedReplayBuffer(capacity=kwargs["replay_capacity"],
+                                                                alpha=kwargs["PER_alpha"], beta=PER_beta)
+        elif "replay_directory" in kwargs and kwargs["replay_directory"] is not None:
+            self.replayBuffer = MemoryMappedReplayBuffer(capacity=kwargs["replay_capacity"],
+                                                         directory=kwargs["replay_directory"])
+        elif "deduplicate_observations" in kwargs and kwargs["deduplicate_observations"]:
+            self.replayBuffer = EpisodicReplayBuffer(capacity=kwargs["replay_capacity"])
         else:
-            self.replayBuffer = ReplayBuffer(capacity=kwargs["replay_capacity"])
+            self.replayBuffer = ColumnarReplayBuffer(capacity=kwargs["replay_capacity"])
 
         self.min_capacity = kwargs["min_capacity"]
         self.batch_size = kwargs["batch_size"]
 
+        prefetch_batches = int(kwargs["prefetch_batches"]) if "prefetch_batches" in kwargs else 0
+        self.prefetch_refresh_fraction = float(kwargs["prefetch_refresh_fraction"]) if "prefetch_refresh_fraction" in kwargs else 0.05
+        self.prefetcher = BatchPrefetcher(self.sample_batch, depth=prefetch_batches) if prefetch_batches > 0 else None
+        self.experiences_since_prefetch_refresh = 0
+
         # Target network update parameters
         self.TAU = kwargs["tau"]
         self.target_update_interval = int(1.0/self.TAU)
         self.target_update_count = 0
+        self.target_update = kwargs["target_update"] if "target_update" in kwargs else 'hard'
+        if self.target_update not in ['hard', 'soft']:
+            raise ValueError(f'Unknown "target_update": {self.target_update}. Expected \'hard\' or \'soft\'')
 
         # Learning rate parameters
         self.lr = kwargs["lr"]
         self.GAMMA = kwargs["gamma"]
-        self.optimizer: torch.optim = optim.Adam(self.model.parameters(), lr=self.lr)
+        self.huber_loss_delta = kwargs["huber_loss_delta"] if "huber_loss_delta" in kwargs else None
+        self.summary_interval = int(kwargs["summary_interval"]) if "summary_interval" in kwargs else 100
+        self.n_step = int(kwargs["n_step"]) if "n_step" in kwargs else 1
+        # One accumulator per stream of experiences (i.e per environment copy, see :func: handle_experience)
+        self.n_step_accumulators: Dict[int, NStepAccumulator] = {}
+        if self.n_step > 1 and isinstance(self.replayBuffer, EpisodicReplayBuffer):
+            raise ValueError('n-step returns are not supported together with "deduplicate_observations"')
+        self.weight_decay = float(kwargs["weight_decay"]) if "weight_decay" in kwargs else 1.0e-2
+        self.optimizer: torch.optim = optim.AdamW(self.model.parameters(), lr=self.lr,
+                                                  weight_decay=self.weight_decay, foreach=True)
 
         # PreprocessFunction
         self.preprocess = kwargs["preprocess"]
@@ -84,17 +150,40 @@ class DeepQNetworkAlgorithm():
         self.epsstart = kwargs['epsstart']
         self.epsdecay = kwargs['epsdecay']
 
+        self.learner = None
+        if "asynchronous_training" in kwargs and kwargs["asynchronous_training"]:
+            replay_ratio = float(kwargs["replay_ratio"]) if "replay_ratio" in kwargs else float(kwargs["nbrTrainIteration"])
+            sync_interval = int(kwargs["inference_sync_interval"]) if "inference_sync_interval" in kwargs else 100
+            self.learner = AsynchronousLearner(self, replay_ratio=replay_ratio, sync_interval=sync_interval)
+
     def clone(self):
-        cloned_kwargs = self.kwargs
-        cloned_model = self.model.clone()
+        # Clones use an in-memory replay buffer, instead of mapping the files of this one
+        cloned_kwargs = dict(self.kwargs, replay_directory=None)
+        with self.training_paused():
+            cloned_model = copy.deepcopy(self.model)
+            cloned_target_model = copy.deepcopy(self.target_model)
         cloned_model.share_memory()
-        cloned_target_model = self.target_model.clone()
         cloned_target_model.share_memory()
         cloned = DeepQNetworkAlgorithm(kwargs=cloned_kwargs, model=cloned_model, target_model=cloned_target_model)
         return cloned
 
+    def close(self):
+        '''
+        Stops the background threads of this algorithm (batch prefetching and asynchronous learner), if any.
+        The prefetching thread is also stopped once this algorithm is garbage collected.
+        '''
+        if self.prefetcher is not None: self.prefetcher.close()
+        if self.learner is not None: self.learner.close()
+
+    def acting_model(self) -> torch.nn.Module:
+        '''
+        :returns: Model with which actions should be selected: the inference copy
+                  synced by the asynchronous learner, if any, the learner model otherwise.
+        '''
+        return self.learner.inference_model if self.learner is not None else self.model
+
     def is_ready_to_train(self):
-        return self.replayBuffer.current_size >= self.min_capacity
+        return len(self.replayBuffer) >= self.min_capacity
 
     def optimize_model(self, gradient_clamping_value=None):
         """
@@ -103,40 +192,35 @@ class DeepQNetworkAlgorithm():
         from the replay buffer.
         2) Backward the loss.
         3) Update the weights with the optimizer.
-        4) Optional: Update the Prioritized Experience Replay buffer with new priorities.
+        4) Optional: Update the Prioritized Experience Replay buffer with new priorities,
+           computed from the TD errors of the whole batch, in a single batched update.
 
         :param gradient_clamping_value: if None, the gradient is not clamped,
                                         otherwise a positive float value is expected as a clamping value
                                         and gradients are clamped.
-        :returns loss_np: numpy scalar of the estimated loss function.
+        :returns loss: scalar tensor of the estimated loss function.
         """
-        # TODO: worry about this later
-        # if self.kwargs['use_PER']:
-        #     # Create batch with PrioritizedReplayBuffer/PER:
-        #     transitions, importance_sampling_weights = self.replayBuffer.sample(self.batch_size)
-        #     batch = EXPPER(*zip(*transitions))
-        #     importance_sampling_weights = torch.from_numpy(importance_sampling_weights)
-        #     if self.use_cuda:
-        #         importance_sampling_weights = importance_sampling_weights.cuda()
-
         self.optimizer.zero_grad()
-        transitions, batch = self.sample_from_replay_buffer(self.batch_size)
-
+        batch, importance_sampling_weights, tensors = self.prefetcher.get() if self.prefetcher is not None else self.sample_batch()
         next_state_batch, state_batch, action_batch, reward_batch, \
-        non_terminal_batch = self.create_tensors_for_optimization(batch,
-                                                                  use_cuda=self.use_cuda)
-
-        dqn_loss = compute_loss(states=state_batch,
-                                actions=action_batch,
-                                next_states=next_state_batch,
-                                rewards=reward_batch,
-                                non_terminals=non_terminal_batch,
-                                model=self.model,
-                                target_model=self.target_model,
-                                gamma=self.GAMMA,
-                                use_double=self.use_double,
-                                use_dueling=self.use_dueling,
-                                iteration_count=self.target_update_count)
+        non_terminal_batch, discount_exponent_batch = tensors
+
+        dqn_loss, td_errors = compute_loss(states=state_batch,
+                                           actions=action_batch,
+                                           next_states=next_state_batch,
+                                           rewards=reward_batch,
+                                           non_terminals=non_terminal_batch,
+                                           model=self.model,
+                                           target_model=self.target_model,
+                                           gamma=self.GAMMA,
+                                           discount_exponents=discount_exponent_batch,
+                                           use_PER=self.use_PER,
+                                           use_double=self.use_double,
+                                           use_dueling=self.use_dueling,
+                                           importance_sampling_weights=importance_sampling_weights,
+                                           huber_delta=self.huber_loss_delta,
+                                           iteration_count=self.target_update_count,
+                                           summary_interval=self.summary_interval)
 
         dqn_loss.backward()
 
@@ -145,26 +229,65 @@ class DeepQNetworkAlgorithm():
 
         self.optimizer.step()
 
-        # TODO: Worry about this later
-        #loss_per_item = dqn_loss
-        #loss_np = loss_per_item.cpu().data.numpy()
-        #if self.kwargs['use_PER']:
-        #    for (idx, new_error) in zip(batch.idx, loss_np):
-        #        new_priority = self.replayBuffer.priority(new_error)
-        #        self.replayBuffer.update(idx, new_priority)
+        if self.use_PER:
+            new_priorities = self.replayBuffer.priority(td_errors.cpu().numpy())
+            with self.replay_buffer_lock():
+                self.replayBuffer.update(batch.idx, new_priorities)
+
+        return dqn_loss.detach()
+
+    def replay_buffer_lock(self):
+        '''
+        :returns: Context manager guarding the replay buffer against
+                  concurrent access from the batch prefetching or asynchronous learner threads.
+        '''
+        if self.prefetcher is not None: return self.prefetcher.lock
+        if self.learner is not None: return self.learner.lock
+        return contextlib.nullcontext()
 
-        #return loss_np
+    @contextlib.contextmanager
+    def training_paused(self):
+        '''
+        :returns: Context manager within which the background threads of this algorithm
+                  (asynchronous learner and batch prefetching) modify neither its weights,
+                  nor its replay buffer. Useful to copy this algorithm.
+        '''
+        training_lock = self.learner.training_lock if self.learner is not None else contextlib.nullcontext()
+        with training_lock, self.replay_buffer_lock():
+            yield
 
-    def create_tensors_for_optimization(self, batch, use_cuda: bool):
+    def sample_batch(self):
+        '''
+        Samples a batch from the replay buffer and prepares it for :func: compute_loss.
+        :returns: sampled batch (EXP or EXPPER), importance sampling weights (None if PER is not used),
+                  and the tensors returned by :func: create_tensors_for_optimization.
         '''
-        TODO: document
+        importance_sampling_weights = None
+        with self.replay_buffer_lock():
+            if self.use_PER:
+                batch, importance_sampling_weights = self.replayBuffer.sample(self.batch_size)
+            else:
+                batch = self.sample_from_replay_buffer(self.batch_size)
+        if self.use_PER and self.use_cuda:
+            importance_sampling_weights = importance_sampling_weights.cuda()
+        tensors = self.create_tensors_for_optimization(batch, use_cuda=self.use_cuda)
+        return batch, importance_sampling_weights, tensors
+
+    def create_tensors_for_optimization(self, batch: EXP, use_cuda: bool):
         '''
-        next_state_batch = Variable(torch.cat(batch.next_state), requires_grad=False)
-        state_batch = Variable(torch.cat(batch.state), requires_grad=False)
-        action_batch = Variable(torch.cat(batch.action), requires_grad=False)
-        reward_batch = Variable(torch.cat(batch.reward), requires_grad=False).view((-1, 1))
-        non_terminal_batch = [float(not batch.done[i]) for i in range(len(batch.done))]
-        non_terminal_batch = Variable(torch.FloatTensor(non_terminal_batch), requires_grad=False).view((-1, 1))
+        Reshapes the batched tensors contained in :param batch: into
+        the shapes expected by :func: compute_loss, and moves them
+        to the GPU if :param use_cuda: is set.
+
+        :param batch: EXP whose fields are tensors batched along the first dimension.
+        :returns: next_state, state, action, reward, non_terminal and discount_exponent batches.
+        '''
+        next_state_batch = batch.next_state
+        state_batch = batch.state
+        action_batch = batch.action
+        reward_batch = batch.reward.view((-1, 1))
+        non_terminal_batch = (~batch.done).float().view((-1, 1))
+        discount_exponent_batch = torch.as_tensor(batch.discount_exponent)
 
         if use_cuda:
             next_state_batch = next_state_batch.cuda()
@@ -172,40 +295,73 @@ class DeepQNetworkAlgorithm():
             action_batch = action_batch.cuda()
             reward_batch = reward_batch.cuda()
             non_terminal_batch = non_terminal_batch.cuda()
+            discount_exponent_batch = discount_exponent_batch.cuda()
 
         return next_state_batch, state_batch, action_batch, \
-               reward_batch, non_terminal_batch
+               reward_batch, non_terminal_batch, discount_exponent_batch
 
-    def sample_from_replay_buffer(self, batch_size: int):
-        transitions = self.replayBuffer.sample(self.batch_size)
-        batch = EXP(*zip(*transitions))
-        return transitions, batch
+    def sample_from_replay_buffer(self, batch_size: int) -> EXP:
+        '''
+        :returns: EXP whose fields are tensors batched along the first dimension.
+        '''
+        if isinstance(self.replayBuffer, (ColumnarReplayBuffer, EpisodicReplayBuffer)):
+            return self.replayBuffer.sample(batch_size)
+        transitions = self.replayBuffer.sample(batch_size)
+        return self.collate_transitions(transitions)
 
-    def handle_experience(self, experience):
+    def collate_transitions(self, transitions) -> EXP:
+        '''
+        Concatenates a list of EXP, as stored by object based replay buffers,
+        into a single EXP whose fields are batched tensors.
+        '''
+        batch = EXP(*zip(*transitions))
+        return EXP(state=torch.cat(batch.state),
+                   action=torch.cat(batch.action),
+                   next_state=torch.cat(batch.next_state),
+                   reward=torch.cat(batch.reward),
+                   done=torch.tensor(batch.done, dtype=torch.bool),
+                   discount_exponent=torch.tensor(batch.discount_exponent))
+
+    def handle_experience(self, experience, stream: int = 0):
         '''
         This function is only called during training.
         It stores experience in the replay buffer.
 
         :param experience: EXP object containing the current, relevant experience.
+        :param stream: Index of the environment (copy) which generated :param experience:.
+                       Consecutive experiences of a stream are combined into n-step experiences.
         '''
-        if self.kwargs["use_PER"]:
-            init_sampling_priority = self.replayBuffer.priority(torch.abs(experience.reward).cpu().numpy() )
-            self.replayBuffer.add(experience, init_sampling_priority)
+        if self.n_step > 1:
+            if stream not in self.n_step_accumulators:
+                self.n_step_accumulators[stream] = NStepAccumulator(n=self.n_step, gamma=self.GAMMA)
+            for n_step_experience in self.n_step_accumulators[stream].push(experience):
+                self.store_experience(n_step_experience)
         else:
-            self.replayBuffer.push(experience)
+            self.store_experience(experience)
+
+    def store_experience(self, experience):
+        with self.replay_buffer_lock():
+            if self.use_PER:
+                init_sampling_priority = self.replayBuffer.priority(torch.abs(experience.reward).cpu().numpy() )
+                self.replayBuffer.add(experience, init_sampling_priority)
+            else:
+                self.replayBuffer.push(experience)
+
+        if self.prefetcher is not None:
+            self.experiences_since_prefetch_refresh += 1
+            if self.experiences_since_prefetch_refresh > self.prefetch_refresh_fraction * len(self.replayBuffer):
+                self.prefetcher.invalidate()
+                self.experiences_since_prefetch_refresh = 0
 
     def train(self, iterations: int):
         self.target_update_count += iterations
         for t in range(iterations):
             _ = self.optimize_model()
+            if self.target_update == 'soft': soft_update(self.target_model, self.model, self.TAU)
 
-        def weight_decay_closure():
-            self.optimizer.zero_grad()
-            weights_decay_loss = compute_weights_decay_loss(self.model)
-            weights_decay_loss.backward()
-            return weights_decay_loss
-        self.optimizer.step(weight_decay_closure)
-
-        # Update target network
-        if self.target_update_count % self.target_update_interval == 0:
+        # The counter advances by a variable number of iterations (i.e one batch per environment copy),
+        # so the target network is synced whenever it crosses a multiple of the interval
+        crossed_interval = ((self.target_update_count - iterations) // self.target_update_interval
+                            != self.target_update_count // self.target_update_interval)
+        if self.target_update == 'hard' and crossed_interval:
             hard_update(self.target_model, self.model)
@@ -1,6 +1,7 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import torch
+import torch.nn.functional as F
 from torch.utils.tensorboard import SummaryWriter
 
 summary_writer = None
@@ -13,15 +14,15 @@ def compute_loss(states: torch.Tensor,
                  model: torch.nn.Module,
                  target_model: torch.nn.Module,
                  gamma: float = 0.99,
+                 discount_exponents: torch.Tensor = None,
                  use_PER: bool = False,
                  use_double: bool = False,
                  use_dueling: bool = False,
-                 #PER_beta: float = 1.0,
-                 importanceSamplingWeights: torch.Tensor = None,
-                 #use_HER: bool = False,
-                 #summary_writer: object = None,
+                 importance_sampling_weights: torch.Tensor = None,
+                 huber_delta: float = None,
                  iteration_count: int = 0,
-                 rnn_states: Dict[str, Dict[str, List[torch.Tensor]]] = None) -> torch.Tensor:
+                 summary_interval: int = 100,
+                 rnn_states: Dict[str, Dict[str, List[torch.Tensor]]] = None) -> Tuple[torch.Tensor, torch.Tensor]:
     '''
     :param states: Dimension: batch_size x state_size: States visited by the agent.
     :param actions: Dimension: batch_size x action_size. Actions which the agent
@@ -32,6 +33,19 @@ def compute_loss(states: torch.Tensor,
     :param model: torch.nn.Module used to compute the loss.
     :param target_model: torch.nn.Module used to compute the loss.
     :param gamma: float discount factor.
+    :param discount_exponents: Dimension: batch_size. Number of environment steps
+                               between each state and its next state (i.e for n-step returns).
+                               The bootstrapped value of each next state is discounted by
+                               gamma**discount_exponent. If None, all exponents are 1.
+    :param use_PER: whether to weight each sample's squared TD error by
+                    its :param importance_sampling_weights:.
+    :param importance_sampling_weights: Dimension: batch_size. Importance sampling
+                                        weights of a Prioritized Experience Replay buffer.
+    :param huber_delta: If not None, the Huber loss with this threshold is used
+                        instead of the squared TD error.
+    :param iteration_count: Training iteration, used to index the summaries.
+    :param summary_interval: Statistics are only computed and written to :attr: summary_writer
+                             when :param iteration_count: is a multiple of this interval.
     :param rnn_states: The :param model: can be made up of different submodules.
                        Some of these submodules will feature an LSTM architecture.
                        This parameter is a dictionary which maps recurrent submodule names
@@ -39,57 +53,64 @@ def compute_loss(states: torch.Tensor,
                        corresponding to the 'hidden' and 'cell' states of
                        the LSTM submodules. These tensors are used by the
                        :param model: when calculating the policy probability ratio.
+    :returns: Scalar loss and per-sample TD errors (Dimension: batch_size x 1),
+              the latter being detached from the computational graph.
     '''
-#    td_error = compute_td_error(states, actions, next_states,
-#                                rewards, non_terminals, gamma,
-#                                model, target_model)
-#
-    if not use_double:  # TODO: Refactor
-        prediction = model(states, action=actions)
-        target_prediction = target_model(next_states)
-
-        Q_s_a = prediction['Q'].gather(dim=1, index=actions.long().unsqueeze(1))
-        target_Q_succs_a = target_prediction['Q'].detach().max(1)[0]
-
-        # Compute the expected Q values
-        td_target = rewards + non_terminals * (gamma * target_Q_succs_a.view(-1, 1))
-
-        # Compute td_error:
-        td_error = td_target.detach() - Q_s_a
+    batch_size = states.shape[0]
+    if discount_exponents is not None:
+        gamma = torch.pow(gamma, discount_exponents.float().view(-1, 1))
 
+    # Online network: a single forward pass on states and, for Double DQN, next states.
+    if use_double:
+        prediction = model(torch.cat([states, next_states]))
+        Q_values, succs_Q_values = prediction['Q'][:batch_size], prediction['Q'][batch_size:]
     else:
         prediction = model(states)
-        succs_prediction = model(next_states)
-
-        # Double DQN uses :param: model to choose an action,
-        # and :param: target_model to evaluate those values
-        target_prediction = target_model(next_states,
-                                         action=model(next_states)['a'])
-        Q_s_a = prediction['Q'].gather(dim=1, index=actions.long().unsqueeze(1))
+        Q_values = prediction['Q']
+    Q_s_a = Q_values.gather(dim=1, index=actions.long().view(-1, 1))
 
-        target_Q_succs_a = target_prediction['Q'].detach().gather(dim=1,
-                                                                  index=succs_prediction['a'].view(-1, 1))
+    with torch.no_grad():
+        target_Q_succs = target_model(next_states)['Q']
+        if use_double:
+            # Double DQN uses :param: model to choose an action,
+            # and :param: target_model to evaluate those values
+            succs_actions = succs_Q_values.argmax(dim=1, keepdim=True)
+            target_Q_succs_a = target_Q_succs.gather(dim=1, index=succs_actions)
+        else:
+            target_Q_succs_a = target_Q_succs.max(dim=1, keepdim=True)[0]
         # Compute the expected Q values
         td_target = rewards + non_terminals * (gamma * target_Q_succs_a)
 
-        # Compute td_error:
-        td_error = td_target.detach() - Q_s_a
+    td_error = td_target - Q_s_a
 
-    if use_PER:  # TODO: worry about this later
-        diff_squared = importance_sampling_weights.unsqueeze(1) * td_error.pow(2.0)
+    if huber_delta is not None:
+        element_wise_loss = F.huber_loss(Q_s_a, td_target, reduction='none', delta=huber_delta)
     else:
-        diff_squared = td_error.pow(2.0)
+        element_wise_loss = 0.5 * td_error.pow(2.0)
+    if use_PER:
+        element_wise_loss = importance_sampling_weights.view(-1, 1) * element_wise_loss
 
-    loss = 0.5 * torch.mean(diff_squared)
+    loss = torch.mean(element_wise_loss)
 
-    if summary_writer is not None:
-        summary_writer.add_scalar('Training/Mean_q_values', prediction['Q'].cpu().mean().item(), iteration_count)
-        summary_writer.add_scalar('Training/Std_q_values', prediction['Q'].cpu().std().item(), iteration_count)
-        summary_writer.add_scalar('Training/Q_value_loss', loss.cpu().item(), iteration_count)
-        summary_writer.add_scalar('Training/Q_value_entropy', prediction['entropy'].mean().cpu().item(), iteration_count)
-        if use_dueling:
-            summary_writer.add_scalar('Training/Mean_V_value', prediction['V'].cpu().mean().item(), iteration_count)
-            summary_writer.add_scalar('Training/Std_V_value', prediction['V'].cpu().std().item(), iteration_count)
-            summary_writer.add_scalar('Training/Mean_Advantage', prediction['A'].cpu().mean().item(), iteration_count)
-            summary_writer.add_scalar('Training/Std_Advantage', prediction['A'].cpu().std().item(), iteration_count)
-    return loss
+    if summary_writer is not None and iteration_count % summary_interval == 0:
+        write_summaries(prediction, batch_size, loss, use_dueling, iteration_count)
+    return loss, td_error.detach()
+
+
+def write_summaries(prediction: Dict[str, torch.Tensor], batch_size: int,
+                    loss: torch.Tensor, use_dueling: bool, iteration_count: int):
+    '''
+    Writes statistics of the online :param prediction: on the first :param batch_size:
+    (i.e current) states to :attr: summary_writer, with a single device to host transfer.
+    '''
+    Q = prediction['Q'][:batch_size].detach()
+    names = ['Training/Mean_q_values', 'Training/Std_q_values',
+             'Training/Q_value_loss', 'Training/Q_value_entropy']
+    values = [Q.mean(), Q.std(), loss.detach(), prediction['entropy'][:batch_size].detach().mean()]
+    if use_dueling:
+        V, A = prediction['V'][:batch_size].detach(), prediction['A'][:batch_size].detach()
+        names += ['Training/Mean_V_value', 'Training/Std_V_value',
+                  'Training/Mean_Advantage', 'Training/Std_Advantage']
+        values += [V.mean(), V.std(), A.mean(), A.std()]
+    for name, value in zip(names, torch.stack(values).cpu().tolist()):
+        summary_writer.add_scalar(name, value, iteration_count)
@@ -4,8 +4,11 @@ import torch.nn as nn
 import torch.optim as optim
 import numpy as np
 
-from ..replay_buffers import Storage
+from torch.nn.utils.rnn import pack_sequence
+
+from ..replay_buffers import RolloutBuffer
 from ..networks import random_sample
+from ..advantage_estimation import compute_returns, compute_gae
 
 
 class PPOAlgorithm():
@@ -25,6 +28,7 @@ class PPOAlgorithm():
         ppo_ratio_clip: float, clip boundaries (1 - clip, 1 + clip) used in clipping loss function.
         learning_rate: float, optimizer learning rate.
         adam_eps: (float), Small Epsilon value used for ADAM optimizer. Prevents numerical instability when v^{hat} (Second momentum estimator) is near 0.
+        sequence_length: int, (recurrent models only) maximal length of the sequences of timesteps on which recurrent models are trained. [default: 16]
         model: (Pytorch nn.Module) Used to represent BOTH policy network and value network
         '''
         self.kwargs = deepcopy(kwargs)
@@ -39,58 +43,67 @@ class PPOAlgorithm():
         if len(self.rnn_keys):
             self.recurrent = True 
         
-        self.storage = Storage(self.kwargs['horizon'])
+        self.storage = RolloutBuffer(self.kwargs['horizon'])
         if self.recurrent:
-            self.storage.add_key('rnn_states')
-            self.storage.add_key('next_rnn_states')
-        
-    def train(self):
-        self.storage.placeholder()
+            # Recurrent models are trained on sequences of at most 'sequence_length' timesteps,
+            # which also end with episodes. Only the recurrent states at the start of each
+            # sequence are stored, as (timestep, rnn_states) pairs (see :func: is_sequence_start)
+            self.sequence_length = self.kwargs['sequence_length'] if 'sequence_length' in self.kwargs else 16
+            self.storage.add_key('sequence_start_rnn_states')
+
+    @property
+    def device(self) -> torch.device:
+        '''
+        Device of the model, to which minibatches are moved from the (CPU) rollout storage.
+        '''
+        return next(self.model.parameters()).device
+
+    def is_sequence_start(self) -> bool:
+        '''
+        :returns: Whether the next timestep added to the storage starts a new training sequence,
+                  either because the current one is 'sequence_length' long, or because an episode just ended.
+        '''
+        t = self.storage.sizes['non_terminal']
+        return t % self.sequence_length == 0 or self.storage.arrays['non_terminal'][t - 1, 0] == 0
 
+    def train(self):
         self.compute_advantages_and_returns()
         states, actions, log_probs_old, returns, advantages, rnn_states = self.retrieve_values_from_storage()
-        
-        if self.recurrent: rnn_states = self.reformat_rnn_states(rnn_states)
-        
+
         for _ in range(self.kwargs['optimization_epochs']):
-            self.optimize_model(states, actions, log_probs_old, returns, advantages, rnn_states)
+            if self.recurrent:
+                self.optimize_model_on_sequences(states, actions, log_probs_old, returns, advantages, rnn_states)
+            else:
+                self.optimize_model(states, actions, log_probs_old, returns, advantages)
 
         self.storage.reset()
 
-    def reformat_rnn_states(self, rnn_states):
-        reformated_rnn_states = { k: ( [list()], [list()] ) for k in self.rnn_keys }
-        for rnn_state in rnn_states:
-            for k, (hstates, cstates) in rnn_state.items():
-                for idx_layer, (h,c) in enumerate(zip(hstates, cstates)):
-                    reformated_rnn_states[k][0][0].append(h)
-                    reformated_rnn_states[k][1][0].append(c)
-        for k, (hstates, cstates) in reformated_rnn_states.items():
-            hstates = torch.cat(hstates[0], dim=0) 
-            cstates = torch.cat(cstates[0], dim=0)
-            reformated_rnn_states[k] = ([hstates], [cstates])
-        return reformated_rnn_states
-
     def compute_advantages_and_returns(self):
-        advantages = torch.from_numpy(np.zeros((1, 1), dtype=np.float32)) # TODO explain (used to be number of workers)
-        returns = self.storage.v[-1].detach()
-        for i in reversed(range(self.kwargs['horizon'])):
-            returns = self.storage.r[i] + self.kwargs['discount'] * self.storage.non_terminal[i] * returns
-            if not self.kwargs['use_gae']:
-                advantages = returns - self.storage.v[i].detach()
-            else:
-                td_error = self.storage.r[i] + self.kwargs['discount'] * self.storage.non_terminal[i] * self.storage.v[i + 1] - self.storage.v[i]
-                advantages = advantages * self.kwargs['gae_tau'] * self.kwargs['discount'] * self.storage.non_terminal[i] + td_error
-            self.storage.adv[i] = advantages.detach()
-            self.storage.ret[i] = returns.detach()
+        '''
+        Computes advantages and returns of all parallel environments,
+        writing them in place into the 'adv' and 'ret' columns of the rollout storage.
+        '''
+        horizon = self.kwargs['horizon']
+        for key in ['adv', 'ret']:
+            if key not in self.storage.columns: self.storage.allocate(key, self.storage.columns['v'][0])
+        # Rewards / non terminal flags: (horizon + 1) x num_envs. Values: (horizon + 1) x num_envs x 1
+        r = self.storage.columns['r'][:horizon]
+        non_terminal = self.storage.columns['non_terminal'][:horizon]
+        v = self.storage.columns['v'].squeeze(-1)
+        adv = self.storage.columns['adv'][:horizon].squeeze(-1)
+        ret = self.storage.columns['ret'][:horizon].squeeze(-1)
+
+        compute_returns(r, non_terminal, bootstrap_values=v[horizon],
+                        discount=self.kwargs['discount'], out=ret)
+        if not self.kwargs['use_gae']:
+            torch.sub(ret, v[:horizon], out=adv)
+        else:
+            compute_gae(r, v[:horizon], non_terminal, bootstrap_values=v[horizon],
+                        discount=self.kwargs['discount'], gae_tau=self.kwargs['gae_tau'], out=adv)
 
     def retrieve_values_from_storage(self):
-        if self.recurrent:
-            cat = self.storage.cat(['s', 'a', 'log_pi_a', 'ret', 'adv', 'rnn_states'])
-            rnn_states = cat[-1]
-            states, actions, log_probs_old, returns, advantages = map(lambda x: torch.cat(x, dim=0), cat[:-1]) 
-        else:
-            states, actions, log_probs_old, returns, advantages= map(lambda x: torch.cat(x, dim=0), self.storage.cat(['s', 'a', 'log_pi_a', 'ret', 'adv']) )
-            rnn_states = None 
+        states, actions, log_probs_old, returns, advantages = map(self.storage.flat, ['s', 'a', 'log_pi_a', 'ret', 'adv'])
+        rnn_states = self.storage.sequence_start_rnn_states if self.recurrent else None
 
         advantages = self.standardize(advantages)
         return states, actions, log_probs_old, returns, advantages, rnn_states
@@ -98,41 +111,63 @@ class PPOAlgorithm():
     def standardize(self, x):
         return (x - x.mean()) / x.std()
 
-    def optimize_model(self, states, actions, log_probs_old, returns, advantages, rnn_states=None):
+    def optimize_model(self, states, actions, log_probs_old, returns, advantages):
         sampler = random_sample(np.arange(states.size(0)), self.kwargs['mini_batch_size'])
-        assert( (self.recurrent and rnn_states is not None) or not(self.recurrent or rnn_states is not None) )
-        if self.recurrent:
-            nbr_layers_per_rnn = { k:len(rnn_states[k][0] ) for k in self.rnn_keys}
-        
         for batch_indices in sampler:
             batch_indices = torch.from_numpy(batch_indices).long()
+            sampled_states = states[batch_indices].to(self.device)
+            self.optimize_minibatch(sampled_states, batch_indices, actions, log_probs_old, returns, advantages)
 
-            sampled_states = states[batch_indices].cuda() if self.kwargs['use_cuda'] else states[batch_indices]
-            sampled_actions = actions[batch_indices].cuda() if self.kwargs['use_cuda'] else actions[batch_indices]
-            sampled_log_probs_old = log_probs_old[batch_indices].cuda() if self.kwargs['use_cuda'] else log_probs_old[batch_indices]
-            sampled_returns = returns[batch_indices].cuda() if self.kwargs['use_cuda'] else returns[batch_indices]
-            sampled_advantages = advantages[batch_indices].cuda() if self.kwargs['use_cuda'] else advantages[batch_indices]
+    def optimize_model_on_sequences(self, states, actions, log_probs_old, returns, advantages, sequence_start_rnn_states):
+        '''
+        Recurrent version of :func: optimize_model. Minibatches are made of whole sequences
+        (see :func: is_sequence_start), packed together and processed in a single forward pass
+        from the recurrent states stored at their start.
+        :param sequence_start_rnn_states: List of (timestep, rnn_states) pairs, one for each sequence.
+        '''
+        starts = [t for t, _ in sequence_start_rnn_states]
+        ends = starts[1:] + [states.size(0)]
+        # As many minibatches as without recurrence, each one made of about 'mini_batch_size' timesteps
+        number_of_minibatches = min(len(starts), int(np.ceil(states.size(0) / self.kwargs['mini_batch_size'])))
+        for sequence_indices in np.array_split(np.random.permutation(len(starts)), number_of_minibatches):
+            steps = [torch.arange(starts[i], ends[i]) for i in sequence_indices]
+            # Timesteps ordered like the data of the packed sequences
+            packed_steps = pack_sequence(steps, enforce_sorted=False)
+            batch_indices = packed_steps.data
+            sampled_states = packed_steps._replace(data=states[batch_indices])
+            sampled_rnn_states = {k: ([torch.cat([sequence_start_rnn_states[i][1][k][0][layer] for i in sequence_indices])
+                                       for layer in range(len(hs))],
+                                      [torch.cat([sequence_start_rnn_states[i][1][k][1][layer] for i in sequence_indices])
+                                       for layer in range(len(cs))])
+                                  for k, (hs, cs) in sequence_start_rnn_states[0][1].items()}
+            device = self.device
+            sampled_states = sampled_states.to(device)
+            sampled_rnn_states = {k: ([h.to(device) for h in hs], [c.to(device) for c in cs])
+                                  for k, (hs, cs) in sampled_rnn_states.items()}
+            self.optimize_minibatch(sampled_states, batch_indices, actions, log_probs_old, returns, advantages,
+                                    rnn_states=sampled_rnn_states)
+
+    def optimize_minibatch(self, sampled_states, batch_indices, actions, log_probs_old, returns, advantages, rnn_states=None):
+        device = self.device
+        sampled_actions = actions[batch_indices].to(device)
+        sampled_log_probs_old = log_probs_old[batch_indices].to(device)
+        sampled_returns = returns[batch_indices].to(device)
+        sampled_advantages = advantages[batch_indices].to(device)
+
+        if rnn_states is not None:
+            prediction = self.model(sampled_states, sampled_actions, rnn_states=rnn_states)
+        else:
+            prediction = self.model(sampled_states, sampled_actions)
 
-            if self.recurrent:
-                sampled_rnn_states = { k: ([None]*nbr_layers_per_rnn[k] , [None]*nbr_layers_per_rnn[k]) for k in self.rnn_keys}
-                for k in sampled_rnn_states:
-                    for idx in range(nbr_layers_per_rnn[k]):
-                        sampled_rnn_states[k][0][idx] = rnn_states[k][0][idx][batch_indices].cuda() if self.kwargs['use_cuda'] else rnn_states[k][0][idx][batch_indices]
-                        sampled_rnn_states[k][1][idx] = rnn_states[k][1][idx][batch_indices].cuda() if self.kwargs['use_cuda'] else rnn_states[k][1][idx][batch_indices]
-                
-                prediction = self.model(sampled_states, sampled_actions, rnn_states=sampled_rnn_states)
-            else:
-                prediction = self.model(sampled_states, sampled_actions)
-                    
-            ratio = (prediction['log_pi_a'] - sampled_log_probs_old).exp()
-            obj = ratio * sampled_advantages
-            obj_clipped = ratio.clamp(1.0 - self.kwargs['ppo_ratio_clip'],
-                                      1.0 + self.kwargs['ppo_ratio_clip']) * sampled_advantages
-            policy_loss = -torch.min(obj, obj_clipped).mean() - self.kwargs['entropy_weight'] * prediction['ent'].mean() # L^{clip} and L^{S} from original paper
-
-            value_loss = 0.5 * (sampled_returns - prediction['v']).pow(2).mean()
-
-            self.optimizer.zero_grad()
-            (policy_loss + value_loss).backward(retain_graph=False)
-            nn.utils.clip_grad_norm_(self.model.parameters(), self.kwargs['gradient_clip'])
-            self.optimizer.step()
+        ratio = (prediction['log_pi_a'] - sampled_log_probs_old).exp()
+        obj = ratio * sampled_advantages
+        obj_clipped = ratio.clamp(1.0 - self.kwargs['ppo_ratio_clip'],
+                                  1.0 + self.kwargs['ppo_ratio_clip']) * sampled_advantages
+        policy_loss = -torch.min(obj, obj_clipped).mean() - self.kwargs['entropy_weight'] * prediction['ent'].mean() # L^{clip} and L^{S} from original paper
+
+        value_loss = 0.5 * (sampled_returns - prediction['v']).pow(2).mean()
+
+        self.optimizer.zero_grad()
+        (policy_loss + value_loss).backward(retain_graph=False)
+        nn.utils.clip_grad_norm_(self.model.parameters(), self.kwargs['gradient_clip'])
+        self.optimizer.step()
@@ -1,2 +1,3 @@
 from .tabular_q_learning import TabularQLearningAlgorithm
 from .repeated_update_q_learning import RepeatedUpdateQLearningAlgorithm
+from .q_tables import HashedQTable, SharedQTable, QTableSnapshot, build_q_table, gather_q_values, scatter_q_values
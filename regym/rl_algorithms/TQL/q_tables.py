@@ -0,0 +1,352 @@
+'''
+Q-table backends for tabular algorithms. Both are indexed like a
+(state_space_size x action_space_size) NumPy array: Q_table[s, a] or Q_table[s, :],
+where s is the (integer) output of a Task's hash_function.
+    - 'dense':  np.ndarray, with a row for every state of the state space.
+    - 'hashed': HashedQTable, with a row for every state that has been written to.
+    - 'shared': SharedQTable, a dense table stored in a named shared memory segment,
+                which can be updated concurrently by several processes.
+'''
+from multiprocessing.shared_memory import SharedMemory
+import weakref
+
+import numpy as np
+
+
+class HashedQTable():
+    '''
+    Open addressing hash table (linear probing) mapping integer state hashes
+    to rows of Q-values, stored in NumPy arrays which double in size whenever
+    the load factor would exceed :param max_load_factor:.
+    Reading a state which was never written to returns zeros (without inserting it),
+    so memory scales with the number of updated states only.
+    '''
+
+    def __init__(self, action_space_size: int, initial_capacity: int = 1024, max_load_factor: float = 0.5):
+        '''
+        :param action_space_size: Number of Q-values per state.
+        :param initial_capacity: Number of slots allocated upfront (rounded up to a power of 2).
+        :param max_load_factor: Maximum fraction of occupied slots before the table grows. (0, 1)
+        '''
+        assert 0 < max_load_factor < 1, 'Maximum load factor should be between (0, 1)'
+        self.action_space_size = action_space_size
+        self.max_load_factor = max_load_factor
+        self.number_of_states = 0
+        self.default_row = np.zeros(action_space_size, dtype=np.float64)
+        self.default_row.flags.writeable = False
+        self._allocate(1 << max(1, int(initial_capacity) - 1).bit_length())
+
+    def _allocate(self, capacity: int):
+        self.mask = capacity - 1
+        self.shift = 64 - (capacity.bit_length() - 1)
+        self.keys = np.zeros(capacity, dtype=np.int64)
+        self.occupied = np.zeros(capacity, dtype=bool)
+        self.values = np.zeros((capacity, self.action_space_size), dtype=np.float64)
+        self._create_views()
+
+    def _create_views(self):
+        # Element access through memoryviews is about twice as fast as through NumPy scalars
+        self.keys_view, self.occupied_view = memoryview(self.keys), memoryview(self.occupied)
+
+    def _probe(self, key: int) -> int:
+        '''
+        :returns: Slot holding :param key:, or the empty slot where it would be inserted.
+        '''
+        # Fibonacci hashing: the top bits of key * 2^64 / golden ratio (mod 2^64) depend on every bit of key
+        slot = ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+        occupied, keys = self.occupied_view, self.keys_view
+        while occupied[slot] and keys[slot] != key:
+            slot = (slot + 1) & self.mask
+        return slot
+
+    def _insert(self, key: int) -> int:
+        if not -2**63 <= key < 2**63:
+            raise ValueError(f'State hash {key} does not fit in a 64 bit signed integer, as required by HashedQTable')
+        if (self.number_of_states + 1) > self.max_load_factor * len(self.keys): self._grow()
+        slot = self._probe(key)
+        if not self.occupied_view[slot]:
+            self.occupied_view[slot], self.keys_view[slot] = True, key
+            self.number_of_states += 1
+        return slot
+
+    def _grow(self):
+        keys, values = self.keys[self.occupied], self.values[self.occupied]
+        self._allocate(2 * len(self.keys))
+        for key, row in zip(keys.tolist(), values):
+            slot = self._probe(key)
+            self.occupied[slot], self.keys[slot], self.values[slot] = True, key, row
+
+    def row(self, s: int) -> np.ndarray:
+        '''
+        :returns: Q-values of state :param s:. Read only zeros if :param s: was never written to.
+        '''
+        slot = self._probe(int(s))
+        return self.values[slot] if self.occupied_view[slot] else self.default_row
+
+    def rows(self, states) -> np.ndarray:
+        '''
+        :param states: Sequence of N states.
+        :returns: Dimension: N x action_space_size. Copy of the Q-values of :param states:
+                  (zeros for states which were never written to).
+        '''
+        slots = np.fromiter((self._probe(int(s)) for s in states), dtype=np.int64, count=len(states))
+        return np.where(self.occupied[slots][:, np.newaxis], self.values[slots], 0.)
+
+    def set_values(self, states, actions, values):
+        '''
+        Sets Q[states[i], actions[i]] = values[i] for every i, inserting unvisited states.
+        '''
+        # Grown upfront, so that slots aren't invalidated by a reallocation while inserting
+        while (self.number_of_states + len(states)) > self.max_load_factor * len(self.keys): self._grow()
+        slots = np.fromiter((self._insert(int(s)) for s in states), dtype=np.int64, count=len(states))
+        self.values[slots, actions] = values
+
+    def __getitem__(self, index):
+        s, a = index
+        slot = self._probe(int(s))
+        return self.values[slot, a] if self.occupied_view[slot] else self.default_row[a]
+
+    def __setitem__(self, index, value):
+        s, a = index
+        slot = self._insert(int(s))  # Before reading self.values, which may be reallocated
+        self.values[slot, a] = value
+
+    def __len__(self) -> int:
+        return self.number_of_states
+
+    def __contains__(self, s: int) -> bool:
+        return self.occupied_view[self._probe(int(s))]
+
+    def __getstate__(self):
+        # Memoryviews can't be pickled (or deep copied)
+        state = self.__dict__.copy()
+        del state['keys_view'], state['occupied_view']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._create_views()
+
+    @property
+    def shape(self):
+        return (self.number_of_states, self.action_space_size)
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.occupied.nbytes + self.values.nbytes
+
+
+def _release_shared_memory(shared_memory: SharedMemory, unlink: bool):
+    try:
+        shared_memory.close()
+    except BufferError:  # Arrays viewing the segment are still alive (i.e at interpreter exit)
+        pass
+    if unlink: shared_memory.unlink()
+
+
+class SharedQTable():
+    '''
+    Dense (state_space_size x action_space_size) Q-table stored in a named
+    shared memory segment. Pickling a SharedQTable (i.e to save an agent) pickles
+    a copy of its Q-values, which unpickles into a new segment.
+
+    To update the same table from several processes, without locks (Hogwild style),
+    send them the :func: handle of the table instead: handles only pickle the name
+    of the segment, and unpickling them attaches to the same memory. The segment is
+    unlinked once the SharedQTable which created it is garbage collected (or at
+    interpreter exit). Processes attaching to the table should be started (with
+    multiprocessing) by the process which created it, with which they share a
+    resource tracker: the resource tracker of an unrelated process would unlink
+    the segment when that process exits.
+
+    Frozen copies of the table should be taken with :func: snapshot. The rows of the
+    table are grouped in pages, and every write (through this table or any of its handles,
+    from any process) flags the pages it touches in the shared segment, so that a snapshot
+    only copies the pages written to since the previous snapshot, and shares all others
+    with it. Writes made directly to :attr: values are not tracked.
+    '''
+
+    page_bytes = 4096
+
+    def __init__(self, state_space_size: int, action_space_size: int, name: str = None):
+        '''
+        :param name: Name of an existing segment to attach to. A new (zeroed) segment is created if None.
+        '''
+        create = name is None
+        self.rows_per_page = max(1, self.page_bytes // (action_space_size * np.dtype(np.float64).itemsize))
+        number_of_pages = -(-state_space_size // self.rows_per_page)
+        values_nbytes = state_space_size * action_space_size * np.dtype(np.float64).itemsize
+        self.shared_memory = SharedMemory(name=name, create=create, size=values_nbytes + number_of_pages)
+        self.values = np.ndarray((state_space_size, action_space_size), dtype=np.float64, buffer=self.shared_memory.buf)
+        # Set (after writing the values) by every writer, and cleared by :func: snapshot
+        self.dirty_pages = np.ndarray((number_of_pages,), dtype=np.uint8,
+                                      buffer=self.shared_memory.buf, offset=values_nbytes)
+        if create:
+            self.values.fill(0.)
+            self.dirty_pages.fill(0)
+        self.is_handle = False
+        # Pages of the last snapshot (referenced weakly, so that they're released along with it)
+        self.last_snapshot = None
+        self.written_pages = np.zeros(number_of_pages, dtype=bool)
+        self.zero_page = np.zeros((self.rows_per_page, action_space_size), dtype=np.float64)
+        self.zero_page.flags.writeable = False
+        weakref.finalize(self, _release_shared_memory, self.shared_memory, create)
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    def handle(self) -> 'SharedQTable':
+        '''
+        :returns: SharedQTable attached to the same segment, which pickles as the name of the segment only.
+        '''
+        handle = SharedQTable(*self.shape, name=self.name)
+        handle.is_handle = True
+        return handle
+
+    def snapshot(self):
+        '''
+        Only the table which created the segment keeps track of its snapshots: snapshots
+        taken through a handle are full copies (np.ndarray) of the Q-values.
+        :returns: Read only copy of the current Q-values of this table, sharing
+                  the pages which weren't written to with the previous snapshot.
+        '''
+        if self.is_handle: return self.values.copy()
+        previous_snapshot = self.last_snapshot() if self.last_snapshot is not None else None
+        # Flags are cleared before copying, so that pages written during the copy are copied again next time
+        dirty_pages = np.flatnonzero(self.dirty_pages)
+        self.dirty_pages[dirty_pages] = 0
+        self.written_pages[dirty_pages] = True
+        if previous_snapshot is not None: pages = list(previous_snapshot.pages)
+        else:
+            # Every page written to since the table was created is copied
+            pages = [self.zero_page[:min(self.rows_per_page, self.shape[0] - p * self.rows_per_page)]
+                     for p in range(len(self.dirty_pages))]
+            dirty_pages = np.flatnonzero(self.written_pages)
+        for p in dirty_pages.tolist():
+            page = self.values[p * self.rows_per_page:(p + 1) * self.rows_per_page].copy()
+            page.flags.writeable = False
+            pages[p] = page
+        snapshot = QTableSnapshot(pages, self.rows_per_page, self.shape)
+        self.last_snapshot = weakref.ref(snapshot)
+        return snapshot
+
+    def _flag_pages(self, states):
+        self.dirty_pages[np.asarray(states, dtype=np.int64) // self.rows_per_page] = 1
+
+    def rows(self, states) -> np.ndarray:
+        return self.values[np.asarray(states, dtype=np.int64)]
+
+    def set_values(self, states, actions, values):
+        states = np.asarray(states, dtype=np.int64)
+        self.values[states, actions] = values
+        self._flag_pages(states)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __setitem__(self, index, value):
+        self.values[index] = value
+        states = index[0] if isinstance(index, tuple) else index
+        self._flag_pages(np.arange(self.shape[0])[states] if isinstance(states, slice) else states)
+
+    def __getstate__(self):
+        if self.is_handle: return {'name': self.name, 'shape': self.values.shape}
+        return {'values': self.values.copy()}
+
+    def __setstate__(self, state):
+        if 'name' in state:
+            self.__init__(*state['shape'], name=state['name'])
+            self.is_handle = True
+        else:
+            self.__init__(*state['values'].shape)
+            self.values[:] = state['values']
+            self.dirty_pages[:] = 1
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+
+class QTableSnapshot():
+    '''
+    Read only copy of a SharedQTable (see SharedQTable.snapshot), stored as a list
+    of pages of :param rows_per_page: rows, some of which are shared with other snapshots
+    of the same table. Pages which were never written to are views of a single page of zeros.
+
+    Deep copies of a snapshot are the snapshot itself. Pickling a snapshot
+    (i.e to send it to another process) pickles a full copy of its Q-values,
+    which unpickles as a dense np.ndarray Q-table.
+    '''
+
+    def __init__(self, pages, rows_per_page: int, shape):
+        self.pages, self.rows_per_page, self.shape = pages, rows_per_page, shape
+
+    def rows(self, states) -> np.ndarray:
+        rows = np.empty((len(states), self.shape[1]), dtype=np.float64)
+        for i, s in enumerate(np.asarray(states, dtype=np.int64).tolist()):
+            rows[i] = self.pages[s // self.rows_per_page][s % self.rows_per_page]
+        return rows
+
+    def set_values(self, states, actions, values):
+        raise TypeError('Q-table snapshots are read only')
+
+    def __getitem__(self, index):
+        s, a = index
+        return self.pages[s // self.rows_per_page][s % self.rows_per_page, a]
+
+    def __setitem__(self, index, value):
+        raise TypeError('Q-table snapshots are read only')
+
+    def to_numpy(self) -> np.ndarray:
+        return np.concatenate(self.pages)
+
+    def __reduce__(self):
+        return (np.array, (self.to_numpy(),))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Size of the pages copied from the table (which may be shared with other snapshots).
+        '''
+        # Copied pages own their memory, unlike the views of the page of zeros
+        return sum(page.nbytes for page in self.pages if page.base is None)
+
+
+def build_q_table(backend: str, state_space_size: int, action_space_size: int):
+    '''
+    :param backend: 'dense', 'hashed' or 'shared' (see module docstring).
+    :param state_space_size: Number of states. Not used by the 'hashed' backend.
+    :param action_space_size: Number of actions.
+    :returns: Q-table, initialized to zeros.
+    '''
+    if backend == 'dense': return np.zeros((state_space_size, action_space_size), dtype=np.float64)
+    if backend == 'hashed': return HashedQTable(action_space_size)
+    if backend == 'shared': return SharedQTable(state_space_size, action_space_size)
+    raise ValueError(f'Unknown Q-table backend: {backend}. Available backends: dense, hashed, shared')
+
+
+def gather_q_values(Q_table, states) -> np.ndarray:
+    '''
+    :param Q_table: Q-table built by :func: build_q_table.
+    :param states: Sequence of N (hashed) states.
+    :returns: Dimension: N x action_space_size. Q-values of :param states:.
+    '''
+    if isinstance(Q_table, np.ndarray): return Q_table[np.asarray(states, dtype=np.int64)]
+    return Q_table.rows(states)
+
+
+def scatter_q_values(Q_table, states, actions, values):
+    '''
+    Sets Q_table[states[i], actions[i]] = values[i] for every i.
+    Pairs (states[i], actions[i]) should be unique.
+    '''
+    if isinstance(Q_table, np.ndarray): Q_table[np.asarray(states, dtype=np.int64), actions] = values
+    else: Q_table.set_values(states, actions, values)
@@ -1,13 +1,29 @@
 import numpy as np
 
+from .q_tables import build_q_table, gather_q_values, scatter_q_values
+
+
+def boltzman_policies(q_values: np.ndarray, temperature: float) -> np.ndarray:
+    '''
+    :param q_values: Dimension: [N x] action_space_size.
+    :returns: Softmax of :param q_values: / :param temperature: over the last (action) dimension.
+    '''
+    # Subtracting the maximum Q-value leaves the policy unchanged, and prevents overflows
+    exp_q_values = np.exp((q_values - q_values.max(axis=-1, keepdims=True)) / temperature)
+    return exp_q_values / exp_q_values.sum(axis=-1, keepdims=True)
+
 
 class RepeatedUpdateQLearningAlgorithm():
     '''
     Repeated Update Q Learning (RUQL) as introduced in:
     "Addressing the Policy Bias of Q-Learning by Repeating Updates" - Sherief Abdallah, Michael Kaisers
     '''
-    def __init__(self, state_space_size, action_space_size, hashing_function, discount_factor, learning_rate, temperature):
-        self.Q_table = np.zeros((state_space_size, action_space_size), dtype=np.float64)
+    def __init__(self, state_space_size, action_space_size, hashing_function, discount_factor, learning_rate, temperature,
+                 q_table_backend='dense'):
+        '''
+        :param q_table_backend: 'dense', 'hashed' or 'shared'. See regym.rl_algorithms.TQL.q_tables
+        '''
+        self.Q_table = build_q_table(q_table_backend, state_space_size, action_space_size)
         self.learning_rate = learning_rate
         self.hashing_function = hashing_function
         self.temperature = temperature
@@ -15,20 +31,68 @@ class RepeatedUpdateQLearningAlgorithm():
 
     def update_q_table(self, s, a, r, succ_s):
         s, succ_s = self.hashing_function(s), self.hashing_function(succ_s)
-        probability_taking_action_a = self.boltzman_exploratory_policy_from_state(s)[a]
-        x = (1 - self.learning_rate)**(1 / probability_taking_action_a)
-        self.Q_table[s, a] = x * self.Q_table[s, a] + (1 - x) * (r + self.discount_factor * max(self.Q_table[succ_s, :]))
+        q_values = self.Q_table[s, :]
+        # 1 / probability of taking action a under the Boltzman exploratory policy
+        inverse_probability_taking_action_a = np.exp((q_values - q_values[a]) / self.temperature).sum()
+        x = (1 - self.learning_rate)**inverse_probability_taking_action_a
+        self.Q_table[s, a] = x * q_values[a] + (1 - x) * (r + self.discount_factor * self.Q_table[succ_s, :].max())
+
+    def update_q_tables(self, states, actions, rewards, succ_states):
+        '''
+        Batched version of :func: update_q_table. Applies the N updates
+        (states[i], actions[i], rewards[i], succ_states[i]) in a single vectorized call.
+        Exploration policies and bootstrapped targets are all computed from the Q-table
+        as it was before the call. Updates of the same (state, action) pair are then
+        composed as if they were applied one after another, in order:
+            Q_k = x^k * Q_0 + (1 - x) * sum_j x^(k - 1 - j) * target_j
+
+        :param states: Sequence of N environment states.
+        :param actions: Dimension: N.
+        :param rewards: Dimension: N.
+        :param succ_states: Sequence of N environment states.
+        '''
+        states = np.array([self.hashing_function(s) for s in states], dtype=np.int64)
+        succ_states = np.array([self.hashing_function(s) for s in succ_states], dtype=np.int64)
+        actions, rewards = np.asarray(actions, dtype=np.int64), np.asarray(rewards, dtype=np.float64)
+
+        q_values = gather_q_values(self.Q_table, states)
+        probabilities = boltzman_policies(q_values, self.temperature)[np.arange(len(actions)), actions]
+        xs = (1 - self.learning_rate)**(1 / probabilities)
+        targets = rewards + self.discount_factor * gather_q_values(self.Q_table, succ_states).max(axis=1)
+
+        pairs, first_indices, pair_indices, counts = np.unique(np.stack([states, actions], axis=1), axis=0,
+                                                               return_index=True, return_inverse=True, return_counts=True)
+        pair_indices = pair_indices.reshape(-1)
+        # Number of later updates of the same (state, action) pair, which shrink the contribution of each update
+        order = np.argsort(pair_indices, kind='stable')
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+        later_updates = counts[pair_indices] - 1 - ranks
+        contributions = np.bincount(pair_indices, weights=(1 - xs) * xs**later_updates * targets, minlength=len(pairs))
+
+        pair_xs = xs[first_indices]
+        initial_q_values = q_values[first_indices, pairs[:, 1]]
+        scatter_q_values(self.Q_table, pairs[:, 0], pairs[:, 1], pair_xs**counts * initial_q_values + contributions)
 
     def boltzman_exploratory_policy_from_state(self, s):
-        exp_q_values = np.exp([self.Q_table[s, i] / self.temperature for i in range(self.Q_table.shape[1])])
-        normalizing_constant = sum(exp_q_values)
-        return np.divide(exp_q_values, normalizing_constant)
+        q_values = self.Q_table[s, :]
+        exp_q_values = np.exp((q_values - q_values.max()) / self.temperature)
+        exp_q_values /= exp_q_values.sum()
+        return exp_q_values
+
+    def boltzman_exploratory_policies(self, states) -> np.ndarray:
+        '''
+        :param states: Sequence of N environment states.
+        :returns: Dimension: N x action_space_size. Boltzman exploratory policy of each state.
+        '''
+        states = [self.hashing_function(s) for s in states]
+        return boltzman_policies(gather_q_values(self.Q_table, states), self.temperature)
 
     def find_moves(self, state, exploration):
         state = self.hashing_function(state)
         if exploration:
             p = self.boltzman_exploratory_policy_from_state(state)
-            return np.random.choice(range(self.Q_table.shape[1]), p=p)
+            return np.random.choice(len(p), p=p)
         else:
-            optimal_moves = np.argwhere(self.Q_table[state, :] == np.amax(self.Q_table[state, :]))
-            return np.random.choice(optimal_moves.flatten().tolist())
+            q_values = self.Q_table[state, :]
+            return np.random.choice(np.flatnonzero(q_values == q_values.max()))
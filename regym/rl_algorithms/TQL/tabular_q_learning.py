@@ -1,13 +1,17 @@
 import numpy as np
 
+from .q_tables import build_q_table
+
 
 class TabularQLearningAlgorithm():
 
-    def __init__(self, state_space_size, action_space_size, hashing_function, discount_factor, epsilon_greedy, learning_rate):
+    def __init__(self, state_space_size, action_space_size, hashing_function, discount_factor, epsilon_greedy, learning_rate,
+                 q_table_backend='dense'):
         """
         TODO: Document
+        :param q_table_backend: 'dense', 'hashed' or 'shared'. See regym.rl_algorithms.TQL.q_tables
         """
-        self.Q_table = np.zeros((state_space_size, action_space_size), dtype=np.float64)
+        self.Q_table = build_q_table(q_table_backend, state_space_size, action_space_size)
         self.learning_rate = learning_rate
         self.hashing_function = hashing_function
         self.epsilon_greedy = epsilon_greedy
@@ -0,0 +1,79 @@
+'''
+Discounted returns and Generalized Advantage Estimation (GAE) over rollouts
+of shape (T, N): T timesteps collected from N parallel environments.
+Episode boundaries inside the rollout are given by :param non_terminals:,
+where non_terminals[t, n] = 0 if the episode of environment n finished at step t.
+
+Both estimators reduce to the recursion y[t] = x[t] + c[t] * y[t + 1],
+which is computed with a single reverse scan over the time dimension,
+vectorized over environments. Every other term is computed for all steps at once.
+Tensors are expected to live on CPU.
+'''
+from typing import Union
+
+import numpy as np
+import torch
+
+
+def _to_numpy(x: Union[torch.Tensor, np.ndarray, float]) -> np.ndarray:
+    if isinstance(x, torch.Tensor): return x.detach().cpu().numpy()
+    return np.asarray(x, dtype=np.float32)
+
+
+def discounted_cumulative_sum(x: torch.Tensor, coefficients: torch.Tensor,
+                              bootstrap: torch.Tensor, out: torch.Tensor = None) -> torch.Tensor:
+    '''
+    Computes y[t] = x[t] + coefficients[t] * y[t + 1], with y[T] = :param bootstrap:
+
+    :param x: Dimension: T x N.
+    :param coefficients: Dimension: T x N.
+    :param bootstrap: Dimension: N. Value of y after the last timestep.
+    :param out: (optional) T x N tensor into which the result is written.
+    :returns: Tensor y of dimension T x N.
+    '''
+    if out is None: out = torch.zeros(x.shape, dtype=torch.float32)
+    x, coefficients, y = _to_numpy(x), _to_numpy(coefficients), out.numpy()
+    next_y = np.broadcast_to(_to_numpy(bootstrap), y.shape[1:])
+    for t in reversed(range(y.shape[0])):
+        np.multiply(coefficients[t], next_y, out=y[t])
+        y[t] += x[t]
+        next_y = y[t]
+    return out
+
+
+def compute_returns(rewards: torch.Tensor, non_terminals: torch.Tensor,
+                    bootstrap_values: torch.Tensor, discount: float,
+                    out: torch.Tensor = None) -> torch.Tensor:
+    '''
+    :param rewards: Dimension: T x N.
+    :param non_terminals: Dimension: T x N. 0 at steps which finished an episode, 1 otherwise.
+    :param bootstrap_values: Dimension: N. Value estimates of the states following the last step.
+    :param discount: Reward discount factor.
+    :param out: (optional) T x N tensor into which the returns are written.
+    :returns: Discounted returns, of dimension T x N.
+    '''
+    return discounted_cumulative_sum(rewards, discount * _to_numpy(non_terminals),
+                                     bootstrap_values, out=out)
+
+
+def compute_gae(rewards: torch.Tensor, values: torch.Tensor, non_terminals: torch.Tensor,
+                bootstrap_values: torch.Tensor, discount: float, gae_tau: float,
+                out: torch.Tensor = None) -> torch.Tensor:
+    '''
+    Generalized Advantage Estimation: https://arxiv.org/abs/1506.02438
+
+    :param rewards: Dimension: T x N.
+    :param values: Dimension: T x N. Value estimates of the visited states.
+    :param non_terminals: Dimension: T x N. 0 at steps which finished an episode, 1 otherwise.
+    :param bootstrap_values: Dimension: N. Value estimates of the states following the last step.
+    :param discount: Reward discount factor.
+    :param gae_tau: GAE (lambda) bias-variance trade-off parameter.
+    :param out: (optional) T x N tensor into which the advantages are written.
+    :returns: Advantages, of dimension T x N.
+    '''
+    values = _to_numpy(values)
+    discounts = discount * _to_numpy(non_terminals)
+    next_values = np.concatenate([values[1:], _to_numpy(bootstrap_values).reshape(1, -1)])
+    td_errors = _to_numpy(rewards) + discounts * next_values - values
+    return discounted_cumulative_sum(td_errors, gae_tau * discounts,
+                                     np.zeros(values.shape[1:], dtype=np.float32), out=out)
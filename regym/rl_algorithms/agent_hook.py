@@ -3,10 +3,11 @@ from os import listdir
 from os.path import isfile, join
 from typing import List, Callable, Tuple, Any
 import torch
-from .agents import TabularQLearningAgent, DeepQNetworkAgent, PPOAgent, MixedStrategyAgent
+from .agents import TabularQLearningAgent, DeepQNetworkAgent, PPOAgent, MixedStrategyAgent, FrozenAgent
+from .agents import freeze_if_supported
 from enum import Enum
 
-AgentType = Enum("AgentType", "DQN TQL PPO MixedStrategyAgent")
+AgentType = Enum("AgentType", "DQN TQL PPO MixedStrategyAgent FrozenAgent")
 
 
 # TODO: move elsewhere. Maybe utils?
@@ -30,7 +31,7 @@ def load_population_from_path(path: str, file_extension='pt',
 
 
 class AgentHook():
-    def __init__(self, agent, save_path=None):
+    def __init__(self, agent, save_path=None, quantize=False):
         """
         Creates an agent hook which allows to transport :param: agent:
         - Between processes if by making all Torch.Tensors be in CPU IF :param: save_path is None
@@ -38,13 +39,22 @@ class AgentHook():
 
         :param agent: Agent to be hooked to be transported between processes
         :param save_path: path where to save the current agent.
+        :param quantize: Whether to hook an int8 quantized, frozen, snapshot of :param: agent
+                         (see `agent.freeze(quantize=True)`) instead of the agent itself.
+                         Meant for agents which will only be used as opponents.
+                         Ignored for agents which can't be frozen (see `freeze_if_supported`).
         :returns: AgentHook agent whose type is that of :param: agent
         """
 
         self.name = agent.name
         self.save_path = save_path
 
-        if isinstance(agent, MixedStrategyAgent):
+        frozen_agent = freeze_if_supported(agent, quantize=True) if quantize else None
+        if frozen_agent is not None: agent = frozen_agent
+
+        if isinstance(agent, FrozenAgent):
+            agent_type, model_list = AgentType.FrozenAgent, []
+        elif isinstance(agent, MixedStrategyAgent):
             agent_type, model_list = AgentType.MixedStrategyAgent, []
         elif isinstance(agent, TabularQLearningAgent):
             agent_type, model_list = AgentType.TQL, []
@@ -63,7 +73,7 @@ class AgentHook():
     @staticmethod
     def unhook(agent_hook, use_cuda=None):
         if hasattr(agent_hook, 'save_path') and agent_hook.save_path is not None: agent_hook.agent = torch.load(agent_hook.save_path)
-        if agent_hook.type == AgentType.TQL or agent_hook.type == AgentType.MixedStrategyAgent: return agent_hook.agent
+        if agent_hook.type in [AgentType.TQL, AgentType.MixedStrategyAgent, AgentType.FrozenAgent]: return agent_hook.agent
         if 'use_cuda' in agent_hook.agent.algorithm.kwargs:
             if use_cuda is not None:
                 agent_hook.agent.algorithm.kwargs['use_cuda'] = use_cuda
@@ -1,4 +1,6 @@
 from .agent import Agent
+from .frozen_agent import FrozenAgent, freeze_if_supported
+from .inference_proxy_agent import InferenceProxyAgent
 
 # Useful basic agents
 from .deterministic_agent import build_Deterministic_Agent, DeterministicAgent
@@ -1,4 +1,11 @@
-from regym.rl_algorithms.agents import Agent
+import copy
+from typing import List
+
+import numpy as np
+import torch
+
+from regym.rl_algorithms.agents import Agent, FrozenAgent
+from regym.rl_algorithms.networks import export_inference_policy
 from regym.rl_algorithms.A2C import A2CAlgorithm
 
 
@@ -7,7 +14,10 @@ class A2CAgent(Agent):
     def __init__(self, name: str, samples_before_update: int, algorithm):
         '''
         :param name: String identifier for the agent
-        :param samples_before_update: Number of actions the agent will take before updating
+        :param samples_before_update: Number of actions the agent will take before updating,
+                                      when acting in a single environment (see :func: take_action).
+                                      When acting in N environments at once (see :func: take_actions)
+                                      the agent updates every `algorithm.n_steps` timesteps instead.
         :param algorithm: Reinforcement Learning algorithm used to update the agent's policy.
                           Contains the agent's policy, represented as a neural network.
         '''
@@ -15,22 +25,95 @@ class A2CAgent(Agent):
         self.algorithm = algorithm
 
         self.samples_before_update = samples_before_update
-        self.samples = []
+        # Legal action masks of the last actions taken, stored along with their experiences
+        self.current_legal_action_masks = None
 
     def handle_experience(self, s, a, r, succ_s, done=False):
         super(A2CAgent, self).handle_experience(s, a, r, succ_s, done)
         if not self.training: return
-        self.samples.append((s, a, self.current_prediction['action_log_probability'],
-                             r, self.current_prediction['state_value'], succ_s, done))
-        if done or len(self.samples) >= self.samples_before_update:
-            bootstrapped_reward = self.current_prediction['state_value'] if not done else 0
-            self.algorithm.train(self.samples, bootstrapped_reward)
-            self.samples = []
-
-    def take_action(self, state):
-        self.current_prediction = self.algorithm.model(state)
+        if not self.algorithm.has_rollout(self.samples_before_update, 1):
+            self.algorithm.allocate_rollout(self.samples_before_update, 1)
+        state = self.algorithm.state_preprocessing.recall(s)
+        self.algorithm.store_experiences(state, [a], [r], [done], self.current_legal_action_masks)
+        if done or self.algorithm.is_rollout_full():
+            self.algorithm.train(bootstrap_states=self.algorithm.state_preprocessing(succ_s))
+
+    def handle_experiences(self, observations: np.ndarray, actions: np.ndarray, rewards: np.ndarray,
+                           succ_observations: np.ndarray, dones: np.ndarray):
+        '''
+        Batched version of :func: handle_experience, for experiences collected
+        simultaneously from N copies of an environment (see :func: take_actions).
+        Experiences are stored in a (n_steps x N) rollout, and the agent updates
+        once it is full. Row i of every parameter belongs to the i-th environment copy.
+
+        :param observations: Dimension: N x observation_dim.
+        :param actions: Dimension: N.
+        :param rewards: Dimension: N.
+        :param succ_observations: Dimension: N x observation_dim.
+        :param dones: Dimension: N.
+        '''
+        if not self.training: return
+        if not self.algorithm.has_rollout(self.algorithm.n_steps, len(actions)):
+            self.algorithm.allocate_rollout(self.algorithm.n_steps, len(actions))
+        states = self.algorithm.state_preprocessing.recall(observations, batched=True)
+        self.algorithm.store_experiences(states, actions, rewards, dones, self.current_legal_action_masks)
+        if self.algorithm.is_rollout_full():
+            self.algorithm.train(bootstrap_states=self.algorithm.state_preprocessing.batch(succ_observations))
+
+    def take_action(self, state, legal_actions: List[int] = None):
+        x = self.algorithm.state_preprocessing(state, update_statistics=self.training, memoize=self.training)
+        legal_action_mask = None
+        if legal_actions is not None:
+            action_dim = self.algorithm.model.policy_head_layer.out_features
+            legal_action_mask = torch.zeros((1, action_dim), dtype=torch.bool)
+            legal_action_mask[0, legal_actions] = True
+        self.current_legal_action_masks = legal_action_mask
+        with torch.no_grad():
+            self.current_prediction = self.algorithm.model(x, legal_action_mask)
         return self.current_prediction['action'].item()
 
+    def take_actions(self, observations: np.ndarray, legal_action_masks: np.ndarray = None) -> np.ndarray:
+        '''
+        Batched version of :func: take_action, for N copies of an environment.
+        Samples the actions of all observations from a single forward pass of the policy.
+
+        :param observations: Dimension: N x observation_dim.
+        :param legal_action_masks: (optional) Boolean array of dimension N x action_dim,
+                                   True for legal actions. All actions are legal if None.
+        :returns: Array of N actions.
+        '''
+        # Observations are memoized for handle_experiences while training, and only used to act otherwise
+        states = self.algorithm.state_preprocessing.batch(observations, update_statistics=self.training,
+                                                          memoize=self.training, reuse_buffer=not self.training)
+        if legal_action_masks is not None: legal_action_masks = torch.as_tensor(legal_action_masks)
+        self.current_legal_action_masks = legal_action_masks
+        with torch.no_grad():
+            logits = self.algorithm.model.policy_logits(states)
+            actions, _ = self.algorithm.model.policy_head(logits, legal_action_masks)
+        return actions.view(-1).numpy()
+
+    def export_inference(self, quantize: bool = False) -> torch.jit.ScriptModule:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: TorchScript snapshot of the (stochastic) policy of this agent,
+                  mapping observations and legal action masks to sampled actions.
+                  See regym.rl_algorithms.networks.export_inference_policy.
+        '''
+        model = self.algorithm.model
+        return export_inference_policy(model, observation_dim=model.layers[0].in_features,
+                                       action_dim=model.policy_head_layer.out_features,
+                                       greedy=False, quantize=quantize)
+
+    def freeze(self, quantize: bool = False) -> FrozenAgent:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: FrozenAgent acting with a snapshot of this agent's policy (see :func: export_inference),
+                  which never learns. Useful to evaluate / benchmark this agent.
+        '''
+        preprocess = copy.deepcopy(self.algorithm.state_preprocessing)
+        return FrozenAgent(name=self.name, policy=self.export_inference(quantize=quantize),
+                           preprocess=preprocess, action_dim=self.algorithm.model.policy_head_layer.out_features)
+
     def clone(self, training=None):
         pass
 
@@ -43,14 +126,18 @@ def build_A2C_Agent(task, config, agent_name):
                       Contains the agent's policy, represented as a neural network.
     :param config: Dictionary whose entries contain hyperparameters for the A2C agents:
         - 'discount_factor':       Discount factor (gamma in standard RL equations) used as a -variance / +bias tradeoff.
-        - 'n_steps':               'Forward view' timesteps used to compute the Q_values used to approximate the advantage function
+        - 'n_steps':               'Forward view' timesteps used to compute the Q_values used to approximate the advantage function.
+                                   Timesteps collected from each environment between updates when acting on N environments at once.
         - 'samples_before_update': Number of actions the agent will take before updating
         - 'learning_rate':         Learning rate for the Neural Network optimizer. Recommended: 1.0e-4
         - 'adam_eps':              Epsilon value used in denominator of Adam update computation. Recommended: 1.0e-5
+        - 'normalize_observations': (optional) Whether to normalize observations with their running mean and variance. [default: False]
 
     :returns: Agent using A2C algorithm to act and learn in environments
     '''
+    normalize_observations = config['normalize_observations'] if 'normalize_observations' in config else False
     algorithm = A2CAlgorithm(policy_model_input_dim=task.observation_dim, policy_model_output_dim=task.action_dim,
                              n_steps=config['n_steps'], discount_factor=config['discount_factor'],
-                             adam_eps=config['adam_eps'], learning_rate=config['learning_rate'])
+                             adam_eps=config['adam_eps'], learning_rate=config['learning_rate'],
+                             normalize_observations=normalize_observations)
     return A2CAgent(name=agent_name, algorithm=algorithm, samples_before_update=config['samples_before_update'])
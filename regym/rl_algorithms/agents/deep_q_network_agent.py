@@ -6,11 +6,12 @@ import torch as T
 
 import torch.nn as nn
 
-from regym.rl_algorithms.agents import Agent
+from regym.rl_algorithms.agents import Agent, FrozenAgent
 from regym.rl_algorithms.replay_buffers import EXP
 from regym.rl_algorithms.networks import CategoricalDuelingDQNet, CategoricalDQNet
 from regym.rl_algorithms.networks import LeakyReLU, FCBody
-from regym.rl_algorithms.networks import PreprocessFunction
+from regym.rl_algorithms.networks import PreprocessFunction, export_inference_policy
+from regym.rl_algorithms.networks.utils import epsilon_greedy
 from regym.rl_algorithms.DQN import DeepQNetworkAlgorithm
 
 
@@ -23,6 +24,8 @@ class DeepQNetworkAgent(Agent):
                                                 requires_environment_model=False)
 
         self.training = True
+        # Actors only collect experiences for a learner (see :func: actor_clone)
+        self.is_actor = False
         self.kwargs = algorithm.kwargs
 
         self.algorithm = algorithm
@@ -37,21 +40,52 @@ class DeepQNetworkAgent(Agent):
         return self.algorithm.model
 
     def handle_experience(self, s, a, r, succ_s, done=False):
-        hs = self.preprocessing_function(s)
+        hs = self.preprocessing_function.recall(s)
         hsucc = self.preprocessing_function(succ_s)
         r = T.ones(1)*r
         a_tensor = T.from_numpy(a) if isinstance(a, np.ndarray) else T.LongTensor([a])
         experience = EXP(hs, a_tensor, hsucc, r, done)
         self.algorithm.handle_experience(experience=experience)
+        self.train_on_new_experiences(number_of_experiences=1)
 
-        if self.training and self.algorithm.is_ready_to_train():
-            self.algorithm.train(iterations=self.kwargs['nbrTrainIteration'])
+    def handle_experiences(self, observations: np.ndarray, actions: np.ndarray, rewards: np.ndarray,
+                           succ_observations: np.ndarray, dones: np.ndarray):
+        '''
+        Batched version of :func: handle_experience, for experiences collected
+        simultaneously from N copies of an environment (see :func: take_actions).
+        Row i of every parameter belongs to the i-th environment copy.
+
+        :param observations: Dimension: N x observation_dim.
+        :param actions: Dimension: N.
+        :param rewards: Dimension: N.
+        :param succ_observations: Dimension: N x observation_dim.
+        :param dones: Dimension: N.
+        '''
+        states = self.preprocessing_function.recall(observations, batched=True)
+        succ_states = self.preprocessing_function.batch(succ_observations)
+        actions = T.as_tensor(np.asarray(actions), dtype=T.long)
+        rewards = T.as_tensor(np.asarray(rewards), dtype=T.float32)
+        for i in range(len(actions)):
+            experience = EXP(states[i:i+1], actions[i:i+1], succ_states[i:i+1], rewards[i:i+1], bool(dones[i]))
+            self.algorithm.handle_experience(experience=experience, stream=i)
+        self.train_on_new_experiences(number_of_experiences=len(actions))
+
+    def train_on_new_experiences(self, number_of_experiences: int):
+        '''
+        Trains for 'nbrTrainIteration' iterations per new experience,
+        or hands the new experiences over to the asynchronous learner.
+        '''
+        if not self.training or self.is_actor: return
+        if self.algorithm.learner is not None:
+            for _ in range(number_of_experiences): self.algorithm.learner.record_environment_step()
+        elif self.algorithm.is_ready_to_train():
+            self.algorithm.train(iterations=self.kwargs['nbrTrainIteration'] * number_of_experiences)
 
     def take_action(self, state: np.ndarray, legal_actions: List[int]):
         self.nbr_steps += 1
         self.eps = self.epsend + (self.epsstart-self.epsend) * np.exp(-1.0 * self.nbr_steps / self.epsdecay)
-        action = self.select_action(model=self.algorithm.model,
-                                    state=self.preprocessing_function(state),
+        action = self.select_action(model=self.algorithm.acting_model(),
+                                    state=self.preprocessing_function(state, update_statistics=self.training, memoize=True),
                                     eps=self.eps,
                                     training=self.training)
 
@@ -63,6 +97,29 @@ class DeepQNetworkAgent(Agent):
 
         return action
 
+    def take_actions(self, observations: np.ndarray, legal_action_masks: np.ndarray = None) -> np.ndarray:
+        '''
+        Batched version of :func: take_action, for N copies of an environment.
+        Computes the Q values of all observations in a single forward pass
+        and selects actions with a vectorized epsilon-greedy policy. The exploration
+        rate decays as if the N actions had been taken one after another.
+
+        :param observations: Dimension: N x observation_dim.
+        :param legal_action_masks: (optional) Boolean array of dimension N x action_dim,
+                                   True for legal actions. All actions are legal if None.
+        :returns: Array of N actions.
+        '''
+        steps = self.nbr_steps + 1 + np.arange(len(observations))
+        self.nbr_steps += len(observations)
+        epsilons = self.epsend + (self.epsstart-self.epsend) * np.exp(-1.0 * steps / self.epsdecay)
+        self.eps = epsilons[-1]
+        with T.no_grad():
+            # Observations are memoized for handle_experiences while training, and only used to act otherwise
+            states = self.preprocessing_function.batch(observations, update_statistics=self.training,
+                                                       memoize=self.training, reuse_buffer=not self.training)
+            q_values = self.algorithm.acting_model()(states)['Q'].cpu().numpy()
+        return epsilon_greedy(epsilons if self.training else 0., q_values, legal_action_masks)
+
     def reset_eps(self):
         self.eps = self.epsstart
 
@@ -75,11 +132,57 @@ class DeepQNetworkAgent(Agent):
             action = np.random.choice(range(self.algorithm.model.action_dim))
             return action
 
+    def actor_clone(self, shared_model: nn.Module):
+        '''
+        :param shared_model: model in shared memory, whose weights are published by this (learner) agent.
+        :returns: Copy of this agent which acts using :param shared_model:, and which
+                  stores its experiences in this agent's replay buffer without training.
+                  This agent's replay buffer must be a SharedMemoryReplayBuffer
+                  for the experiences to reach it from other processes.
+        '''
+        # The replay buffer is shared with the actor, instead of copied
+        with self.algorithm.training_paused():
+            actor = copy.deepcopy(self, memo={id(self.algorithm.replayBuffer): self.algorithm.replayBuffer})
+        actor.is_actor = True
+        actor.algorithm.model = shared_model
+        actor.algorithm.learner = None
+        return actor
+
+    def export_inference(self, quantize: bool = False) -> T.jit.ScriptModule:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: TorchScript snapshot of the greedy policy of this agent,
+                  mapping observations and legal action masks to actions.
+                  See regym.rl_algorithms.networks.export_inference_policy.
+        '''
+        return export_inference_policy(self.algorithm.model, observation_dim=self.kwargs['state_dim'],
+                                       action_dim=self.kwargs['nbr_actions'], greedy=True, quantize=quantize)
+
+    def freeze(self, quantize: bool = False) -> FrozenAgent:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8. Quantized
+                         snapshots are smaller and faster, which suits menageries of opponents.
+        :returns: FrozenAgent acting with a snapshot of this agent's policy (see :func: export_inference),
+                  which never learns. Useful to evaluate / benchmark this agent.
+        '''
+        # The preprocessing function is copied, to snapshot its normalization statistics along with the policy
+        preprocess = copy.deepcopy(self.preprocessing_function)
+        if quantize: preprocess.use_cuda = False  # Quantized policies run on CPU
+        return FrozenAgent(name=self.name, policy=self.export_inference(quantize=quantize),
+                           preprocess=preprocess, action_dim=self.kwargs['nbr_actions'])
+
     def clone(self, training=None):
-        clone = copy.deepcopy(self)
+        # The learner thread, if any, could otherwise update the weights while they are being copied
+        with self.algorithm.training_paused(): clone = copy.deepcopy(self)
         clone.training = training
         return clone
 
+    def close(self):
+        '''
+        Stops the background threads used to train this agent. See DeepQNetworkAlgorithm.close.
+        '''
+        self.algorithm.close()
+
 
 def build_DQN_Agent(task, config, agent_name):
     kwargs = dict()
@@ -87,15 +190,31 @@ def build_DQN_Agent(task, config, agent_name):
     :param kwargs:
         "use_cuda": boolean to specify whether to use CUDA.
         "replay_capacity": int, capacity of the replay buffer to use.
+        "replay_directory": (optional) str, directory where a memory mapped, out-of-core replay buffer is stored.
+        "deduplicate_observations": (optional) boolean, whether to store each observation only once in the replay buffer.
+        "shared_replay": (optional) boolean, whether to use a replay buffer in shared memory, written by several actor processes.
         "min_capacity": int, minimal capacity before starting to learn.
         "batch_size": int, batch size to use [default: batch_size=256].
+        "prefetch_batches": (optional) int, number of batches prepared ahead of time by a background thread. [default: prefetch_batches=0]
+        "prefetch_refresh_fraction": (optional) float, fraction of the replay buffer written after which prefetched batches are discarded. [default: prefetch_refresh_fraction=0.05]
         "use_PER": boolean to specify whether to use a Prioritized Experience Replay buffer.
         "PER_alpha": float, alpha value for the Prioritized Experience Replay buffer.
+        "PER_beta": float, importance sampling exponent for the Prioritized Experience Replay buffer. [default: PER_beta=1.0]
         "lr": float, learning rate [default: lr=1e-3].
         "tau": float, target network update rate.
+        "target_update": (optional) str, 'hard' (copy every 1/tau iterations) or 'soft' (Polyak averaging with tau). [default: target_update='hard']
+        "weight_decay": (optional) float, decoupled weight decay coefficient of the optimizer. [default: weight_decay=1e-2]
+                        Replaces the previous extra Adam step on a coupled L2 loss after every training call, which has no equivalent coefficient.
         "gamma": float, Q-learning gamma rate.
+        "huber_loss_delta": (optional) float, threshold of the Huber loss minimized instead of the squared TD error. [default: huber_loss_delta=None]
+        "summary_interval": (optional) int, training iterations between two writes of the loss statistics. [default: summary_interval=100]
+        "n_step": (optional) int, number of steps used to compute bootstrapped returns. [default: n_step=1]
         "preprocess": preprocessing function/transformation to apply to observations [default: preprocess=T.ToTensor()]
+        "normalize_observations": (optional) boolean, whether to normalize observations with their running mean and variance. [default: normalize_observations=False]
         "nbrTrainIteration": int, number of iteration to train the model at each new experience. [default: nbrTrainIteration=1]
+        "asynchronous_training": (optional) boolean, whether to train in a background learner thread. [default: asynchronous_training=False]
+        "replay_ratio": (optional) float, gradient steps per environment step of the asynchronous learner. [default: replay_ratio=nbrTrainIteration]
+        "inference_sync_interval": (optional) int, gradient steps between syncs of the model used for acting. [default: inference_sync_interval=100]
         "epsstart": starting value of the epsilong for the epsilon-greedy policy.
         "epsend": asymptotic value of the epsilon for the epsilon-greedy policy.
         "epsdecay": rate at which the epsilon of the epsilon-greedy policy decays.
@@ -107,7 +226,8 @@ def build_DQN_Agent(task, config, agent_name):
         "state_dim": number of dimensions in the state space.
     """
 
-    preprocess = PreprocessFunction(state_space_size=task.observation_dim, use_cuda=config['use_cuda'])
+    preprocess = PreprocessFunction(state_space_size=task.observation_dim, use_cuda=config['use_cuda'],
+                                    normalize=config['normalize_observations'] if 'normalize_observations' in config else False)
 
     kwargs['nbrTrainIteration'] = config['nbrTrainIteration']
     kwargs["nbr_actions"] = task.action_dim
@@ -131,14 +251,28 @@ def build_DQN_Agent(task, config, agent_name):
     kwargs["use_cuda"] = config['use_cuda']
 
     kwargs["replay_capacity"] = float(config['memoryCapacity'])
+    kwargs["replay_directory"] = config['replay_directory'] if 'replay_directory' in config else None
+    kwargs["deduplicate_observations"] = config['deduplicate_observations'] if 'deduplicate_observations' in config else False
+    kwargs["shared_replay"] = config['shared_replay'] if 'shared_replay' in config else False
     kwargs["min_capacity"] = float(config['min_memory'])
     kwargs["batch_size"] = int(config['batch_size'])
+    kwargs["prefetch_batches"] = int(config['prefetch_batches']) if 'prefetch_batches' in config else 0
+    kwargs["prefetch_refresh_fraction"] = float(config['prefetch_refresh_fraction']) if 'prefetch_refresh_fraction' in config else 0.05
     kwargs["use_PER"] = config['use_PER']
     kwargs["PER_alpha"] = float(config['PER_alpha'])
+    kwargs["PER_beta"] = float(config['PER_beta']) if 'PER_beta' in config else 1.0
 
     kwargs["lr"] = float(config['learning_rate'])
     kwargs["tau"] = float(config['tau'])
+    kwargs["target_update"] = config['target_update'] if 'target_update' in config else 'hard'
+    kwargs["weight_decay"] = float(config['weight_decay']) if 'weight_decay' in config else 1.0e-2
     kwargs["gamma"] = float(config['gamma'])
+    kwargs["huber_loss_delta"] = float(config['huber_loss_delta']) if 'huber_loss_delta' in config else None
+    kwargs["summary_interval"] = int(config['summary_interval']) if 'summary_interval' in config else 100
+    kwargs["n_step"] = int(config['n_step']) if 'n_step' in config else 1
+    kwargs["asynchronous_training"] = config['asynchronous_training'] if 'asynchronous_training' in config else False
+    kwargs["replay_ratio"] = float(config['replay_ratio']) if 'replay_ratio' in config else float(config['nbrTrainIteration'])
+    kwargs["inference_sync_interval"] = int(config['inference_sync_interval']) if 'inference_sync_interval' in config else 100
 
     kwargs["preprocess"] = preprocess
 
@@ -0,0 +1,74 @@
+from typing import Callable, List
+import io
+
+import numpy as np
+import torch
+
+from regym.rl_algorithms.agents import Agent
+
+
+class FrozenAgent(Agent):
+    '''
+    Agent which acts with an exported inference policy (see
+    regym.rl_algorithms.networks.export_inference_policy), and never learns.
+    Frozen agents are meant for evaluation and benchmarking, where agents
+    cloned with `training=False` act many times but are never updated.
+    They are created by calling `freeze()` on DQN, PPO, A2C and REINFORCE agents.
+    '''
+
+    def __init__(self, name: str, policy: torch.jit.ScriptModule,
+                 preprocess: Callable[[np.ndarray], torch.Tensor], action_dim: int):
+        '''
+        :param policy: Exported inference policy.
+        :param preprocess: Function mapping an observation to a batch (of one) of policy inputs.
+        :param action_dim: Number of (discrete) actions.
+        '''
+        super(FrozenAgent, self).__init__(name=name, requires_environment_model=False)
+        self.training = False
+        self.policy = policy
+        self.preprocess = preprocess
+        self.action_dim = action_dim
+        self.all_legal_mask = torch.ones(1, action_dim, dtype=torch.bool)
+
+    def take_action(self, state: np.ndarray, legal_actions: List[int] = None) -> int:
+        x = self.preprocess(state)
+        if legal_actions is None:
+            legal_action_mask = self.all_legal_mask.to(x.device)
+        else:
+            legal_action_mask = torch.zeros(1, self.action_dim, dtype=torch.bool, device=x.device)
+            legal_action_mask[0, legal_actions] = True
+        with torch.inference_mode():
+            return int(self.policy(x, legal_action_mask)[0])
+
+    def handle_experience(self, s, a, r, succ_s, done=False):
+        super(FrozenAgent, self).handle_experience(s, a, r, succ_s, done)
+
+    def clone(self, training=None):
+        # Exported policies are never modified, and can be shared among clones
+        return FrozenAgent(name=self.name, policy=self.policy,
+                           preprocess=self.preprocess, action_dim=self.action_dim)
+
+    def __getstate__(self):
+        # TorchScript modules can't be pickled, they are serialized with torch.jit.save instead
+        state = self.__dict__.copy()
+        buffer = io.BytesIO()
+        torch.jit.save(self.policy, buffer)
+        state['policy'] = buffer.getvalue()
+        return state
+
+    def __setstate__(self, state):
+        state['policy'] = torch.jit.load(io.BytesIO(state['policy']))
+        self.__dict__.update(state)
+
+
+def freeze_if_supported(agent: Agent, quantize: bool = False):
+    '''
+    :param quantize: Whether to quantize the weights of the frozen policy to int8.
+    :returns: FrozenAgent snapshot of :param agent: (see `agent.freeze`), or None if
+              :param agent: can't be frozen (i.e tabular or recurrent PPO agents).
+    '''
+    if not hasattr(agent, 'freeze'): return None
+    try:
+        return agent.freeze(quantize=quantize)
+    except NotImplementedError:
+        return None
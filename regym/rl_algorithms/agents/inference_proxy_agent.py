@@ -0,0 +1,36 @@
+from typing import List
+
+import numpy as np
+import torch
+
+from regym.rl_algorithms.agents import Agent
+
+
+class InferenceProxyAgent(Agent):
+    '''
+    Agent which forwards every action request to an InferenceServer.
+    Many proxies, each one used by a different environment loop, can share a server.
+    Proxies never learn.
+    '''
+
+    def __init__(self, name: str, server):
+        '''
+        :param server: regym.rl_algorithms.inference_server.InferenceServer computing the actions of this agent.
+        '''
+        super(InferenceProxyAgent, self).__init__(name=name, requires_environment_model=False)
+        self.training = False
+        self.server = server
+
+    def take_action(self, state: np.ndarray, legal_actions: List[int] = None) -> int:
+        legal_action_mask = torch.ones(1, self.server.action_dim, dtype=torch.bool)
+        if legal_actions is not None:
+            legal_action_mask[:] = False
+            legal_action_mask[0, legal_actions] = True
+        x = self.server.preprocess(state)
+        return self.server.submit(x, legal_action_mask.to(x.device)).result()
+
+    def handle_experience(self, s, a, r, succ_s, done=False):
+        super(InferenceProxyAgent, self).handle_experience(s, a, r, succ_s, done)
+
+    def clone(self, training=None):
+        return InferenceProxyAgent(name=self.name, server=self.server)
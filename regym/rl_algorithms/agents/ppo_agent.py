@@ -3,10 +3,10 @@ import torch
 import copy
 
 import regym
-from regym.rl_algorithms.agents import Agent
+from regym.rl_algorithms.agents import Agent, FrozenAgent
 from regym.rl_algorithms.networks import CategoricalActorCriticNet, GaussianActorCriticNet
 from regym.rl_algorithms.networks import FCBody, LSTMBody
-from regym.rl_algorithms.networks import PreprocessFunction
+from regym.rl_algorithms.networks import PreprocessFunction, export_inference_policy
 from regym.rl_algorithms.PPO import PPOAlgorithm
 
 import torch.nn.functional as F
@@ -37,26 +37,15 @@ class PPOAgent(Agent):
             if 'actor' in k:
                 self.rnn_states[k] = self.algorithm.model.network.actor_body.get_reset_states(cuda=self.algorithm.kwargs['use_cuda'])
 
-    def _post_process(self, prediction):
+    def _post_process(self, prediction, update_rnn_states=True):
         if self.recurrent:
-            for k, (hs, cs) in self.rnn_states.items():
-                for idx in range(len(hs)):
-                    self.rnn_states[k][0][idx] = torch.Tensor(prediction['next_rnn_states'][k][0][idx].cpu())
-                    self.rnn_states[k][1][idx] = torch.Tensor(prediction['next_rnn_states'][k][1][idx].cpu())
-
-            for k, v in prediction.items():
-                if isinstance(v, dict):
-                    for vk, (hs, cs) in v.items():
-                        for idx in range(len(hs)):
-                            hs[idx] = hs[idx].detach().cpu()
-                            cs[idx] = cs[idx].detach().cpu()
-                        prediction[k][vk] = (hs, cs)
-                else:
-                    prediction[k] = v.detach().cpu()
-        else:
-            prediction = {k: v.detach().cpu() for k, v in prediction.items()}
-
-        return prediction
+            # Recurrent states are never modified in place: they are only detached, and stay on the model's device
+            if update_rnn_states:
+                self.rnn_states = {k: ([h.detach() for h in hs], [c.detach() for c in cs])
+                                   for k, (hs, cs) in prediction['next_rnn_states'].items()}
+            # Only the recurrent states at the start of training sequences are stored (see :func: take_action)
+            prediction = {k: v for k, v in prediction.items() if k not in ['rnn_states', 'next_rnn_states']}
+        return {k: v.detach().cpu() for k, v in prediction.items()}
 
     def _pre_process_rnn_states(self, done=False):
         if done or self.rnn_states is None: self._reset_rnn_states()
@@ -68,9 +57,8 @@ class PPOAgent(Agent):
 
     def handle_experience(self, s, a, r, succ_s, done):
         super(PPOAgent, self).handle_experience(s, a, r, succ_s, done)
-        non_terminal = torch.ones(1)*(1 - int(done))
-        state = self.state_preprocessing(s)
-        r = torch.ones(1)*r
+        non_terminal = 1 - int(done)
+        state = self.state_preprocessing.recall(s)
 
         self.algorithm.storage.add(self.current_prediction)
         self.algorithm.storage.add({'r': r, 'non_terminal': non_terminal, 's': state})
@@ -83,17 +71,22 @@ class PPOAgent(Agent):
                 next_prediction = self.algorithm.model(next_state, rnn_states=self.rnn_states)
             else:
                 next_prediction = self.algorithm.model(next_state)
-            next_prediction = self._post_process(next_prediction)
+            # The recurrent states are not advanced, as take_action will process the next state again
+            next_prediction = self._post_process(next_prediction, update_rnn_states=False)
 
             self.algorithm.storage.add(next_prediction)
             self.algorithm.train()
             self.handled_experiences = 0
 
+        if self.recurrent and done: self._reset_rnn_states()
+
     def take_action(self, state, legal_actions: List[int] = None):
-        state = self.state_preprocessing(state)
+        state = self.state_preprocessing(state, update_statistics=self.training, memoize=True)
 
         if self.recurrent:
             self._pre_process_rnn_states()
+            if self.training and self.algorithm.is_sequence_start():
+                self.algorithm.storage.add({'sequence_start_rnn_states': (self.algorithm.storage.sizes['s'], self.rnn_states)})
             self.current_prediction = self.algorithm.model(state, rnn_states=self.rnn_states,
                                                            legal_actions=legal_actions)
         else:
@@ -106,6 +99,31 @@ class PPOAgent(Agent):
             action = np.int(action)
         return action
 
+    def export_inference(self, quantize: bool = False) -> torch.jit.ScriptModule:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: TorchScript snapshot of the (stochastic) policy of this agent,
+                  mapping observations and legal action masks to sampled actions.
+                  See regym.rl_algorithms.networks.export_inference_policy.
+        '''
+        if self.recurrent:
+            raise NotImplementedError('Exporting the policy of a recurrent PPO agent is not supported')
+        if not isinstance(self.algorithm.model, CategoricalActorCriticNet):
+            raise NotImplementedError('Only policies over discrete actions can be exported')
+        return export_inference_policy(self.algorithm.model, observation_dim=self.state_preprocessing.state_space_size,
+                                       action_dim=self.algorithm.model.action_dim, greedy=False, quantize=quantize)
+
+    def freeze(self, quantize: bool = False) -> FrozenAgent:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: FrozenAgent acting with a snapshot of this agent's policy (see :func: export_inference),
+                  which never learns. Useful to evaluate / benchmark this agent.
+        '''
+        preprocess = copy.deepcopy(self.state_preprocessing)
+        if quantize: preprocess.use_cuda = False
+        return FrozenAgent(name=self.name, policy=self.export_inference(quantize=quantize),
+                           preprocess=preprocess, action_dim=self.algorithm.model.action_dim)
+
     def clone(self, training=None):
         clone = PPOAgent(name=self.name, algorithm=copy.deepcopy(self.algorithm))
         clone.training = training
@@ -116,11 +134,13 @@ class PPOAgent(Agent):
 def build_PPO_Agent(task: regym.environments.Task, config: Dict[str, object], agent_name: str) -> PPOAgent:
     '''
     :param task: Environment specific configuration
-    :param config: Dict containing configuration for ppo agent
+    :param config: Dict containing configuration for ppo agent. Optionally:
+        - 'normalize_observations': Whether to normalize observations with their running mean and variance. [default: False]
     :returns: PPOAgent adapted to be trained on :param: task under :param: config
     '''
     kwargs = config.copy()
-    kwargs['state_preprocess'] = PreprocessFunction(task.observation_dim, kwargs['use_cuda'])
+    normalize_observations = kwargs['normalize_observations'] if 'normalize_observations' in kwargs else False
+    kwargs['state_preprocess'] = PreprocessFunction(task.observation_dim, kwargs['use_cuda'], normalize=normalize_observations)
 
     input_dim = task.observation_dim
     if kwargs['phi_arch'] != 'None':
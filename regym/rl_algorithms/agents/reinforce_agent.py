@@ -1,8 +1,11 @@
-from typing import Dict
+from typing import Dict, List
 import copy
 
+import torch
+
 import regym
-from regym.rl_algorithms.agents import Agent
+from regym.rl_algorithms.agents import Agent, FrozenAgent
+from regym.rl_algorithms.networks import export_inference_policy
 from regym.rl_algorithms.reinforce import ReinforceAlgorithm
 
 
@@ -22,6 +25,8 @@ class ReinforceAgent(Agent):
         self.episodes_before_update = episodes_before_update
         self.completed_episodes = 0
         self.trajectories = [[]]
+        # Legal action mask of the last action taken, stored along with its experience
+        self.current_legal_action_mask = None
 
     def handle_experience(self, s, a, r, succ_s, done=False):
         '''
@@ -37,6 +42,14 @@ class ReinforceAgent(Agent):
         '''
         super(ReinforceAgent, self).handle_experience(s, a, r, succ_s, done)
         if not self.training: return
+        if self.algorithm.recompute_on_update:
+            self.algorithm.store_experience(self.algorithm.state_preprocessing.recall(s), a, r, done,
+                                            self.current_legal_action_mask)
+            if done:
+                self.completed_episodes += 1
+                if (self.completed_episodes % self.episodes_before_update) == 0:
+                    self.algorithm.train_on_stored_experiences()
+            return
         trajectory_index = self.completed_episodes % self.episodes_before_update
         self.trajectories[trajectory_index].append((s, a, self.current_prediction['action_log_probability'], r, succ_s))
         if done:
@@ -46,14 +59,45 @@ class ReinforceAgent(Agent):
                 self.trajectories = []
             self.trajectories.append([])
 
-    def take_action(self, state):
+    def take_action(self, state, legal_actions: List[int] = None):
         '''
         :param state: Environment state
+        :param legal_actions: (optional) Actions which can be taken at :param state:. All actions if None.
         :returns: Action to be executed by the environment conditioned on :param: state
         '''
-        self.current_prediction = self.algorithm.model(state)
+        x = self.algorithm.state_preprocessing(state, update_statistics=self.training,
+                                               memoize=self.training and self.algorithm.recompute_on_update)
+        legal_action_mask = None
+        if legal_actions is not None:
+            legal_action_mask = torch.zeros((1, self.algorithm.model.layers[-1].out_features), dtype=torch.bool)
+            legal_action_mask[0, legal_actions] = True
+        self.current_legal_action_mask = legal_action_mask
+        # Without recomputation, the log probability of the action (and its graph) is kept until the next update
+        with torch.set_grad_enabled(self.training and not self.algorithm.recompute_on_update):
+            self.current_prediction = self.algorithm.model(x, legal_action_mask)
         return self.current_prediction['action'].item()
 
+    def export_inference(self, quantize: bool = False) -> torch.jit.ScriptModule:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: TorchScript snapshot of the (stochastic) policy of this agent,
+                  mapping observations and legal action masks to sampled actions.
+                  See regym.rl_algorithms.networks.export_inference_policy.
+        '''
+        model = self.algorithm.model
+        return export_inference_policy(model, observation_dim=model.layers[0].in_features,
+                                       action_dim=model.layers[-1].out_features, greedy=False, quantize=quantize)
+
+    def freeze(self, quantize: bool = False) -> FrozenAgent:
+        '''
+        :param quantize: Whether to quantize the weights of the policy to int8.
+        :returns: FrozenAgent acting with a snapshot of this agent's policy (see :func: export_inference),
+                  which never learns. Useful to evaluate / benchmark this agent.
+        '''
+        preprocess = copy.deepcopy(self.algorithm.state_preprocessing)
+        return FrozenAgent(name=self.name, policy=self.export_inference(quantize=quantize),
+                           preprocess=preprocess, action_dim=self.algorithm.model.layers[-1].out_features)
+
     def clone(self, training=True):
         '''
         :param training: Boolean specifying whether the newly cloned agent will be in training mode
@@ -76,10 +120,19 @@ def build_Reinforce_Agent(task: regym.environments.Task, config: Dict[str, objec
         - 'learning_rate':          Learning rate for the Neural Network optimizer. Recommended: 1.0e-4
         - 'episodes_before_update': Number of full environment episodes that will be sampled before computing a policy update. [1, infinity)
         - 'adam_eps':               Epsilon value used in denominator of Adam update computation. Recommended: 1.0e-5
+        - 'normalize_observations': (optional) Whether to normalize observations with their running mean and variance. [default: False]
+        - 'recompute_on_update':    (optional) Whether to only store observations, actions and rewards, and recompute the action
+                                    log probabilities in a single forward pass at update time, weighting them by their
+                                    reward-to-go minus a mean baseline. Keeps memory and backward time independent of the
+                                    autograd graphs of the actions taken. [default: False]
 
     :returns: Agent using Reinforce algorithm to act and learn in environments
     '''
+    normalize_observations = config['normalize_observations'] if 'normalize_observations' in config else False
+    recompute_on_update = config['recompute_on_update'] if 'recompute_on_update' in config else False
     algorithm = ReinforceAlgorithm(policy_model_input_dim=task.observation_dim, policy_model_output_dim=task.action_dim,
-                                   learning_rate=config['learning_rate'], adam_eps=config['adam_eps'])
+                                   learning_rate=config['learning_rate'], adam_eps=config['adam_eps'],
+                                   normalize_observations=normalize_observations,
+                                   recompute_on_update=recompute_on_update)
     return ReinforceAgent(name=agent_name, episodes_before_update=config['episodes_before_update'],
                           algorithm=algorithm)
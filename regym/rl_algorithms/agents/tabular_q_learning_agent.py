@@ -1,6 +1,7 @@
 import copy
 from regym.rl_algorithms.TQL import TabularQLearningAlgorithm
 from regym.rl_algorithms.TQL import RepeatedUpdateQLearningAlgorithm
+from regym.rl_algorithms.TQL import SharedQTable
 
 from regym.rl_algorithms.agents import Agent
 
@@ -19,22 +20,48 @@ class TabularQLearningAgent(Agent):
         return self.algorithm.find_moves(state, exploration=self.training)
 
     def clone(self, training=None):
-        clone = copy.deepcopy(self)
+        '''
+        :param training: Boolean specifying whether the newly cloned agent will be in training mode
+        :returns: Deep cloned version of this agent. If its Q-table is a SharedQTable, training clones
+                  update the same table, and other clones act on a snapshot of it (see SharedQTable.snapshot).
+        '''
+        memo = {}
+        if isinstance(self.algorithm.Q_table, SharedQTable):
+            memo[id(self.algorithm.Q_table)] = self.algorithm.Q_table if training else self.algorithm.Q_table.snapshot()
+        clone = copy.deepcopy(self, memo)
         clone.training = training
         return clone
 
 
 def build_TabularQ_Agent(task, config, agent_name):
+    '''
+    :param task: Task in which the agent will be able to act
+    :param config: Dictionary whose entries contain hyperparameters for the tabular agents:
+        - 'use_repeated_update_q_learning': Whether to use Repeated Update Q Learning (RUQL) instead of Q Learning
+        - 'discount_factor':                Discount factor (gamma in standard RL equations)
+        - 'learning_rate':                  Learning rate of the Q-value updates. [0, 1]
+        - 'epsilon_greedy':                 (Q Learning) Probability of taking a random action while training. [0, 1]
+        - 'temperature':                    (RUQL) Temperature of the Boltzmann exploration policy
+        - 'q_table_backend':                (optional) 'dense', a row per state of the Task's state space, 'hashed',
+                                            a row per visited state (for large state spaces), or 'shared', a dense table
+                                            in shared memory, which can be updated by several processes through
+                                            handles (see SharedQTable.handle). [default: 'dense']
+    :param agent_name: String identifier for the agent
+    :returns: Agent using tabular Q Learning (or RUQL) to act and learn in environments
+    '''
     state_space_size, action_space_size = task.state_space_size, task.action_dim
     hash_state = task.hash_function
+    q_table_backend = config['q_table_backend'] if 'q_table_backend' in config else 'dense'
     if config['use_repeated_update_q_learning']:
         algorithm = RepeatedUpdateQLearningAlgorithm(state_space_size, action_space_size, hash_state,
                                                      discount_factor=config['discount_factor'],
                                                      learning_rate=config['learning_rate'],
-                                                     temperature=config['temperature'])
+                                                     temperature=config['temperature'],
+                                                     q_table_backend=q_table_backend)
     else:
         algorithm = TabularQLearningAlgorithm(state_space_size, action_space_size, hash_state,
                                               discount_factor=config['discount_factor'],
                                               learning_rate=config['learning_rate'],
-                                              epsilon_greedy=config['epsilon_greedy'])
+                                              epsilon_greedy=config['epsilon_greedy'],
+                                              q_table_backend=q_table_backend)
     return TabularQLearningAgent(name=agent_name, algorithm=algorithm)
@@ -0,0 +1,124 @@
+'''
+Local inference server: a single copy of a policy answers the action requests
+of many environment loops (threads), which are dynamically batched together.
+Agents talk to the server through InferenceProxyAgents (see :func: InferenceServer.proxy),
+which implement Agent.take_action, so that Task.run_episode can be used unchanged.
+'''
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from regym.rl_algorithms.agents import InferenceProxyAgent
+
+
+class InferenceServer():
+    '''
+    Background thread owning :param policy:, an exported inference policy
+    (see regym.rl_algorithms.networks.export_inference_policy) mapping a batch
+    of observations and a batch of legal action masks to a batch of actions.
+
+    Requests are batched dynamically: once a request arrives, the server waits
+    at most :param max_latency: seconds for more requests, or until
+    :param max_batch_size: requests are pending, before running a single forward pass.
+    Observations are preprocessed by the proxies, with :param preprocess:.
+    '''
+
+    def __init__(self, policy: torch.jit.ScriptModule, action_dim: int,
+                 preprocess: Callable[[np.ndarray], torch.Tensor],
+                 max_batch_size: int = 64, max_latency: float = 1.0e-3):
+        self.policy = policy
+        self.action_dim = action_dim
+        self.preprocess = preprocess
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.stop_event = threading.Event()
+        self.start_lock = threading.Lock()
+        self.thread = None
+        self.batches_served = 0
+        self.requests_served = 0
+
+    @staticmethod
+    def from_agent(agent, max_batch_size: int = 64, max_latency: float = 1.0e-3):
+        '''
+        :param agent: Agent implementing `freeze()` (i.e DQN, PPO, A2C or REINFORCE agents).
+        :returns: InferenceServer serving a snapshot of :param agent:'s policy.
+        '''
+        frozen_agent = agent.freeze()
+        return InferenceServer(frozen_agent.policy, frozen_agent.action_dim, frozen_agent.preprocess,
+                               max_batch_size=max_batch_size, max_latency=max_latency)
+
+    def proxy(self, name: str) -> InferenceProxyAgent:
+        '''
+        :returns: Agent named :param name: whose actions are computed by this server.
+        '''
+        return InferenceProxyAgent(name=name, server=self)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, x: torch.Tensor, legal_action_mask: torch.Tensor) -> Future:
+        '''
+        :param x: Dimension: 1 x observation_dim. Preprocessed observation.
+        :param legal_action_mask: Dimension: 1 x action_dim. Boolean tensor, True for legal actions.
+        :returns: Future, whose result is the selected action.
+        '''
+        with self.start_lock:
+            if self.thread is None: self.start()
+        future = Future()
+        self.requests.put((x, legal_action_mask, future))
+        return future
+
+    def _next_batch(self) -> List:
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0
+                             else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            batch = self._next_batch()
+            if len(batch) == 0: continue
+            xs, masks, futures = zip(*batch)
+            try:
+                with torch.inference_mode():
+                    actions = self.policy(torch.cat(xs), torch.cat(masks)).tolist()
+            except Exception as e:
+                for future in futures: future.set_exception(e)
+                continue
+            for future, action in zip(futures, actions): future.set_result(action)
+            self.batches_served += 1
+            self.requests_served += len(batch)
+
+    def close(self):
+        if self.thread is None: return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.stop_event.clear()
+
+    def statistics(self) -> Dict[str, float]:
+        '''
+        :returns: Dictionary containing:
+            - 'batches_served': number of forward passes computed.
+            - 'requests_served': number of actions returned.
+            - 'mean_batch_size': average number of requests per forward pass.
+        '''
+        return {'batches_served': self.batches_served,
+                'requests_served': self.requests_served,
+                'mean_batch_size': self.requests_served / max(1, self.batches_served)}
@@ -7,6 +7,7 @@ from .bodies import FCBody, LSTMBody
 
 from .heads import GaussianActorCriticNet
 
-from .utils import PreprocessFunction
+from .utils import PreprocessFunction, RunningMeanStd
 from .utils import random_sample
 from .utils import hard_update, soft_update
+from .inference import InferencePolicy, export_inference_policy
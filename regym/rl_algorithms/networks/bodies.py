@@ -8,6 +8,7 @@ from functools import reduce
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.rnn import PackedSequence
 from regym.rl_algorithms.networks.utils import layer_init, layer_init_lstm
 
 
@@ -72,8 +73,11 @@ class LSTMBody(nn.Module):
         :param x: input to LSTM cells. Structured as (input, (hidden_states, cell_states)).
         hidden_states: list of hidden_state(s) one for each self.layers.
         cell_states: list of hidden_state(s) one for each self.layers.
+        If input is a PackedSequence, whole sequences are processed at once (see :func: forward_sequences),
+        otherwise a single timestep is processed, cell by cell.
         '''
         x, (hidden_states, cell_states) = x
+        if isinstance(x, PackedSequence): return self.forward_sequences(x, hidden_states, cell_states)
         next_hstates, next_cstates = [], []
         for idx, (layer, hx, cx) in enumerate(zip(self.layers, hidden_states, cell_states) ):
             batch_size = x.size(0)
@@ -92,6 +96,37 @@ class LSTMBody(nn.Module):
 
         return x, (next_hstates, next_cstates)
 
+    def forward_sequences(self, x: PackedSequence, hidden_states, cell_states):
+        '''
+        Runs each layer over whole sequences with a single fused LSTM kernel call
+        (the one behind nn.LSTM), directly on the weights of the LSTMCell used to act.
+        :param x: PackedSequence of inputs, of B sequences.
+        :param hidden_states: list of initial hidden states (Dimension: B x hidden_size), one for each self.layers.
+        :param cell_states: list of initial cell states (Dimension: B x hidden_size), one for each self.layers.
+        :returns: PackedSequence of outputs, and the hidden / cell states at the end of each sequence.
+        '''
+        batch_size = x.batch_sizes[0].item()
+        next_hstates, next_cstates = [], []
+        for layer, hx, cx in zip(self.layers, hidden_states, cell_states):
+            if hx.size(0) == 1:
+                hx, cx = hx.expand(batch_size, -1), cx.expand(batch_size, -1)
+            # Packed sequences are sorted by decreasing length, and so must be the initial states
+            if x.sorted_indices is not None:
+                hx, cx = hx.index_select(0, x.sorted_indices), cx.index_select(0, x.sorted_indices)
+            weights = [layer.weight_ih, layer.weight_hh, layer.bias_ih, layer.bias_hh]
+            initial_states = (hx.unsqueeze(0).contiguous(), cx.unsqueeze(0).contiguous())
+            # Arguments following the weights: has_biases, num_layers, dropout, train, bidirectional
+            data, nhx, ncx = torch._VF.lstm(x.data, x.batch_sizes, initial_states, weights,
+                                            True, 1, 0., self.training, False)
+            nhx, ncx = nhx.squeeze(0), ncx.squeeze(0)
+            if x.unsorted_indices is not None:
+                nhx, ncx = nhx.index_select(0, x.unsorted_indices), ncx.index_select(0, x.unsorted_indices)
+            next_hstates.append(nhx)
+            next_cstates.append(ncx)
+            if self.gate is not None: data = self.gate(data)
+            x = x._replace(data=data)
+        return x, (next_hstates, next_cstates)
+
     def get_reset_states(self, cuda=False):
         hidden_states, cell_states = [], []
         for layer in self.layers:
@@ -3,12 +3,13 @@
 # Permission given to modify the code as long as you keep this        #
 # declaration at the top                                              #
 #######################################################################
-from typing import List
+from typing import List, Union
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.rnn import PackedSequence
 from regym.rl_algorithms.networks import LeakyReLU
 from regym.rl_algorithms.networks.utils import BaseNet, layer_init, tensor
 from regym.rl_algorithms.networks.bodies import DummyBody
@@ -54,15 +55,11 @@ class CategoricalDQNet(nn.Module, BaseNet):
                 'Q': q_values,
                 'entropy': entropy}
 
-    def _mask_ilegal_action_logits(self, logits: torch.Tensor, legal_actions: List[int]):
+    def policy_logits(self, x: torch.Tensor) -> torch.Tensor:
         '''
-        TODO: document
+        :returns: Q values for all actions, used as logits by frozen inference policies.
         '''
-        illegal_action_mask = torch.tensor([float(i not in legal_actions)
-                                            for i in range(self.action_dim)])
-        illegal_logit_penalties = illegal_action_mask * self.ILLEGAL_ACTIONS_LOGIT_PENALTY
-        masked_logits = logits + illegal_logit_penalties
-        return masked_logits
+        return self.qsa(self.body(x))
 
 
 class CategoricalDuelingDQNet(nn.Module, BaseNet):
@@ -95,6 +92,14 @@ class CategoricalDuelingDQNet(nn.Module, BaseNet):
         return {'V': V, 'A': A, 'Q': Q, 'a': Q.max(dim=1)[1],
                 'entropy': entropy}
 
+    def policy_logits(self, x: torch.Tensor) -> torch.Tensor:
+        '''
+        :returns: Q values for all actions, used as logits by frozen inference policies.
+        '''
+        x = self.body(x)
+        A = self.advantage(x)
+        return self.value(x) + (A - A.mean(1, keepdim=True))
+
 
 class CategoricalNet(nn.Module, BaseNet):
     def __init__(self, action_dim, num_atoms, body):
@@ -262,25 +267,21 @@ class CategoricalActorCriticNet(nn.Module, BaseNet):
 
     # TODO: type hint rnn_states
     def forward(self, obs: np.ndarray, action: int = None, rnn_states=None,
-                legal_actions: List[int] = None):
-        obs = tensor(obs)
-        if rnn_states is not None:
-            next_rnn_states = {k: None for k in rnn_states}
-
-        if rnn_states is not None and 'phi_arch' in rnn_states:
-            phi, next_rnn_states['phi_arch'] = self.network.phi_body( (obs, rnn_states['phi_arch']) )
-        else:
-            phi = self.network.phi_body(obs)
+                legal_actions: Union[List[int], torch.Tensor] = None):
+        '''
+        :param obs: Dimension: batch_size x state_dim. With recurrent bodies, :param obs: can also be
+                    a PackedSequence of observations, processed as whole sequences starting from
+                    :param rnn_states:. All outputs are then given per timestep, in the order of
+                    the packed data (as are :param action: and :param legal_actions: masks).
+        '''
+        sequences = isinstance(obs, PackedSequence)
+        if not sequences: obs = tensor(obs)
+        next_rnn_states = {k: None for k in rnn_states} if rnn_states is not None else None
 
-        if rnn_states is not None and 'actor_arch' in rnn_states:
-            phi_a, next_rnn_states['actor_arch'] = self.network.actor_body( (phi, rnn_states['actor_arch']) )
-        else:
-            phi_a = self.network.actor_body(phi)
-
-        if rnn_states is not None and 'critic_arch' in rnn_states:
-            phi_v, next_rnn_states['critic_arch'] = self.network.critic_body( (phi, rnn_states['critic_arch']) )
-        else:
-            phi_v = self.network.critic_body(phi)
+        phi = self._body_forward('phi_arch', self.network.phi_body, obs, rnn_states, next_rnn_states)
+        phi_a = self._body_forward('actor_arch', self.network.actor_body, phi, rnn_states, next_rnn_states)
+        phi_v = self._body_forward('critic_arch', self.network.critic_body, phi, rnn_states, next_rnn_states)
+        if sequences: phi_a, phi_v = phi_a.data, phi_v.data
 
         logits = self.network.fc_action(phi_a)
         if legal_actions is not None:
@@ -289,16 +290,16 @@ class CategoricalActorCriticNet(nn.Module, BaseNet):
         v = self.network.fc_critic(phi_v)
         # batch x 1
 
-        dist = torch.distributions.Categorical(logits=logits)
+        log_probs = F.log_softmax(logits, dim=-1)
+        probs = log_probs.exp()
+        # batch x action_dim
         if action is None:
-            action = dist.sample(sample_shape=(logits.size(0),))
+            action = torch.multinomial(probs.detach(), num_samples=1)
             # batch x 1
-        log_prob = dist.log_prob(action).unsqueeze(-1)
-        # estimates the log likelihood of each action against each batched distributions... : batch x batch x 1
-        log_prob = torch.cat([log_prob[idx][idx].view((1,-1)) for idx in range(log_prob.size(0))], dim=0)
-        # retrieve the log likelihood of each batched action against its relevant batched distribution: batch x 1
-        entropy = dist.entropy().unsqueeze(-1)
-        # retrieve the the entropy of each batched distribution: batch x 1
+        log_prob = log_probs.gather(-1, action.view(-1, 1).long())
+        # log likelihood of each batched action under its own distribution: batch x 1
+        entropy = -1. * torch.sum(probs * log_probs, dim=-1, keepdim=True)
+        # entropy of each batched distribution: batch x 1
 
         if rnn_states is not None:
             return {'a': action,
@@ -313,12 +314,17 @@ class CategoricalActorCriticNet(nn.Module, BaseNet):
                     'ent': entropy,
                     'v': v}
 
-    def _mask_ilegal_action_logits(self, logits: torch.Tensor, legal_actions: List[int]):
+    def _body_forward(self, key: str, body: nn.Module, x, rnn_states, next_rnn_states):
+        if rnn_states is not None and key in rnn_states:
+            x, next_rnn_states[key] = body((x, rnn_states[key]))
+            return x
+        if isinstance(x, PackedSequence): return x._replace(data=body(x.data))
+        return body(x)
+
+    def policy_logits(self, obs: torch.Tensor) -> torch.Tensor:
         '''
-        TODO: document 
+        :returns: Action logits of the policy, without computing the value head.
+                  Only supported for non recurrent bodies.
         '''
-        illegal_action_mask = torch.tensor([float(i not in legal_actions)
-                                            for i in range(self.action_dim)])
-        illegal_logit_penalties = illegal_action_mask * self.ILLEGAL_ACTIONS_LOGIT_PENALTY
-        masked_logits = logits + illegal_logit_penalties
-        return masked_logits
+        phi = self.network.phi_body(tensor(obs))
+        return self.network.fc_action(self.network.actor_body(phi))
@@ -0,0 +1,68 @@
+import copy
+import warnings
+
+import torch
+import torch.nn as nn
+
+
+class InferencePolicy(nn.Module):
+    '''
+    Frozen, action only, version of a policy network. Computes the action
+    logits (or Q values) of :param model: through its `policy_logits` method,
+    and either picks the action with the highest logit (:param greedy:)
+    or samples one from the categorical distribution over the logits.
+    None of the extra outputs of the model's forward pass (values, entropies,
+    log probabilities...) are computed.
+    '''
+
+    def __init__(self, model: nn.Module, greedy: bool):
+        super(InferencePolicy, self).__init__()
+        self.model = model
+        self.greedy = greedy
+
+    def forward(self, x: torch.Tensor, legal_action_mask: torch.Tensor) -> torch.Tensor:
+        '''
+        :param x: Dimension: batch_size x observation_dim.
+        :param legal_action_mask: Dimension: batch_size x action_dim. Boolean tensor, True for legal actions.
+        :returns: Dimension: batch_size. Selected actions.
+        '''
+        logits = self.model.policy_logits(x)
+        logits = logits.masked_fill(~legal_action_mask, float('-inf'))
+        if self.greedy:
+            return logits.argmax(dim=-1)
+        return torch.multinomial(torch.softmax(logits, dim=-1), num_samples=1).squeeze(-1)
+
+
+def export_inference_policy(model: nn.Module, observation_dim: int, action_dim: int,
+                            greedy: bool, quantize: bool = False) -> torch.jit.ScriptModule:
+    '''
+    Exports a snapshot of :param model: (which must implement `policy_logits`)
+    as a TorchScript InferencePolicy: the policy is traced with torch.jit.trace,
+    and frozen with torch.jit.freeze, which inlines its weights as constants.
+    Later updates of :param model: do not affect the exported policy.
+
+    Exported policies should be called under torch.inference_mode().
+    They can be serialized with torch.jit.save.
+
+    :param observation_dim: Dimension of the (flattened, preprocessed) observations.
+    :param action_dim: Number of (discrete) actions.
+    :param greedy: Whether to select the action with the highest logit instead of sampling.
+    :param quantize: Whether to quantize the weights of all linear layers to int8, with
+                     torch.ao.quantization.quantize_dynamic (activations are quantized on the fly).
+                     Quantized policies are about 4 times smaller, and run on CPU only.
+    :returns: Traced policy, mapping a batch of observations and legal action masks to a batch of actions.
+    '''
+    model = copy.deepcopy(model)
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+    policy = InferencePolicy(model, greedy=greedy).eval()
+    device = torch.device('cpu') if quantize else next(model.parameters()).device
+    example_inputs = (torch.zeros(1, observation_dim, device=device),
+                      torch.ones(1, action_dim, dtype=torch.bool, device=device))
+    with torch.no_grad(), warnings.catch_warnings():
+        # Recent torch versions flag TorchScript as deprecated in favour of torch.compile,
+        # whose compilation time is too high for policies exported on every menagerie update
+        warnings.simplefilter('ignore', FutureWarning)
+        # Tracing checks are disabled because sampled actions differ on every call
+        traced_policy = torch.jit.trace(policy, example_inputs, check_trace=False)
+        return torch.jit.freeze(traced_policy)
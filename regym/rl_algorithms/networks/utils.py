@@ -10,32 +10,68 @@ class BaseNet:
         # max. This prevents illegal action values from being considered as target.
         self.ILLEGAL_ACTIONS_LOGIT_PENALTY = -1e9
         self.EPS = 1e-9
-
-
-def compute_weights_decay_loss(model: torch.nn.Module, decay_rate: float = 1e-1) -> torch.Tensor:
-    '''
-    A form of regularization. Computes a loss aiming to regress
-    network parameter values to 0.
-    :param model: Model whose parameters will be used to compute the decay loss
-    :param decay_rate: coefficient determining the magnitude (severity) of decay
-    :returns: Weight decay loss
-    '''
-    return decay_rate * sum([torch.mean(param * param)
-                             for param in model.parameters()])
+        # Boolean legal action masks of already seen sets of legal actions,
+        # indexed by (legal actions, device). See _mask_ilegal_action_logits
+        self.legal_action_masks = {}
+        self.MAX_CACHED_LEGAL_ACTION_MASKS = 1024
+
+    def _legal_action_mask(self, legal_actions, action_dim: int, device) -> torch.Tensor:
+        '''
+        :param legal_actions: List of legal actions.
+        :returns: Dimension: 1 x :param action_dim:. Boolean tensor, True for legal actions.
+                  Masks are cached, as most environments repeat the same few sets of legal actions.
+        '''
+        key = (tuple(legal_actions), device)
+        if key not in self.legal_action_masks:
+            if len(self.legal_action_masks) >= self.MAX_CACHED_LEGAL_ACTION_MASKS:
+                self.legal_action_masks.clear()
+            mask = torch.zeros((1, action_dim), dtype=torch.bool, device=device)
+            mask[0, list(legal_actions)] = True
+            self.legal_action_masks[key] = mask
+        return self.legal_action_masks[key]
+
+    def _mask_ilegal_action_logits(self, logits: torch.Tensor, legal_actions) -> torch.Tensor:
+        '''
+        Replaces the logits of illegal actions by ILLEGAL_ACTIONS_LOGIT_PENALTY.
+        :param logits: Dimension: batch_size x action_dim.
+        :param legal_actions: Either a list of legal actions, shared by the whole batch,
+                              or a boolean tensor of dimension batch_size x action_dim,
+                              True for the legal actions of each element of the batch.
+        :returns: Dimension: batch_size x action_dim. Masked logits.
+        '''
+        if isinstance(legal_actions, torch.Tensor):
+            legal_action_mask = legal_actions.to(device=logits.device, dtype=torch.bool)
+        else:
+            legal_action_mask = self._legal_action_mask(legal_actions, logits.size(-1), logits.device)
+        return logits.masked_fill(~legal_action_mask, self.ILLEGAL_ACTIONS_LOGIT_PENALTY)
 
 
 def hard_update(fromm: torch.nn.Module, to: torch.nn.Module):
     '''
     Updates network parameters from :param fromm: to :param to:.
-    Useful for updating target networks in DQN algorithms
+    Useful for updating target networks in DQN algorithms.
+    All parameters are copied with a single multi-tensor (foreach) operation.
     '''
-    for fp, tp in zip(fromm.parameters(), to.parameters()):
-        fp.data.copy_(tp.data)
+    with torch.no_grad():
+        fromm_parameters, to_parameters = list(fromm.parameters()), list(to.parameters())
+        if hasattr(torch, '_foreach_copy_'):
+            torch._foreach_copy_(fromm_parameters, to_parameters)
+        else:
+            for fp, tp in zip(fromm_parameters, to_parameters): fp.copy_(tp)
 
 
 def soft_update(fromm: torch.nn.Module, to: torch.nn.Module, tau: float):
-    for fp, tp in zip(fromm.parameters(), to.parameters()):
-        fp.data.copy_(((1.0 - tau) * fp.data) + (tau * tp.data))
+    '''
+    Polyak averaging of the parameters of :param fromm: towards those of :param to:,
+    i.e fromm = (1 - tau) * fromm + tau * to, computed in place with a single
+    multi-tensor (foreach) operation.
+    '''
+    with torch.no_grad():
+        fromm_parameters, to_parameters = list(fromm.parameters()), list(to.parameters())
+        if hasattr(torch, '_foreach_lerp_'):
+            torch._foreach_lerp_(fromm_parameters, to_parameters, tau)
+        else:
+            for fp, tp in zip(fromm_parameters, to_parameters): fp.lerp_(tp, tau)
 
 
 def layer_init(layer, w_scale=1.0):
@@ -84,12 +120,26 @@ def huber(x, k=1.0):
     return torch.where(x.abs() < k, 0.5 * x.pow(2), k * (x.abs() - 0.5 * k))
 
 
-def epsilon_greedy(epsilon, x):
+def epsilon_greedy(epsilon, x, legal_action_mask=None):
+    '''
+    :param epsilon: Exploration rate. If :param x: is 2-dimensional, it can
+                    also be an array containing one exploration rate per row.
+    :param x: Action values. Either of dimension: action_dim, or N x action_dim,
+              in which case an action is selected for each row.
+    :param legal_action_mask: (optional, only used if :param x: is 2-dimensional)
+                              Boolean array of dimension N x action_dim. Illegal actions
+                              are never selected, neither greedily nor at random.
+    '''
     if len(x.shape) == 1:
         return np.random.randint(len(x)) if np.random.rand() < epsilon else np.argmax(x)
     elif len(x.shape) == 2:
-        random_actions = np.random.randint(x.shape[1], size=x.shape[0])
-        greedy_actions = np.argmax(x, axis=-1)
+        if legal_action_mask is None:
+            random_actions = np.random.randint(x.shape[1], size=x.shape[0])
+            greedy_actions = np.argmax(x, axis=-1)
+        else:
+            # Uniform noise restricted to legal actions yields a uniformly sampled legal action
+            random_actions = np.argmax(np.random.rand(*x.shape) * legal_action_mask, axis=-1)
+            greedy_actions = np.argmax(np.where(legal_action_mask, x, -np.inf), axis=-1)
         dice = np.random.rand(x.shape[0])
         return np.where(dice < epsilon, random_actions, greedy_actions)
 
@@ -99,18 +149,143 @@ def sync_grad(target_network, src_network):
         param._grad = src_param.grad.clone()
 
 
+class RunningMeanStd():
+    '''
+    Running mean and variance of a stream of (batches of) vectors,
+    updated with Welford's online algorithm, generalized to batches
+    by Chan et al.'s parallel variance formula.
+    '''
+
+    def __init__(self, shape, epsilon: float = 1.0e-4):
+        '''
+        :param shape: Shape of the vectors whose statistics are tracked.
+        :param epsilon: Initial count, which avoids dividing by zero before the first update.
+        '''
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.var = np.ones(shape, dtype=np.float64)
+        self.count = epsilon
+
+    def update(self, x: np.ndarray):
+        '''
+        :param x: Dimension: batch_size x shape. New vectors of the stream.
+        '''
+        batch_count = x.shape[0]
+        if batch_count == 1: return self._update_single(x[0])
+        batch_mean, batch_var = x.mean(axis=0), x.var(axis=0)
+        delta = batch_mean - self.mean
+        total_count = self.count + batch_count
+        self.mean = self.mean + delta * (batch_count / total_count)
+        squared_deviations = self.var * self.count + batch_var * batch_count \
+                             + np.square(delta) * (self.count * batch_count / total_count)
+        self.var = squared_deviations / total_count
+        self.count = total_count
+
+    def _update_single(self, x: np.ndarray):
+        # Welford's update
+        total_count = self.count + 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / total_count
+        self.var = (self.var * self.count + delta * (x - self.mean)) / total_count
+        self.count = total_count
+
+
 class PreprocessFunction():
+    '''
+    Maps (possibly nested) observations to flattened float32 tensors.
+    Optionally normalizes observations with the running mean and variance of
+    all observations seen with `update_statistics=True`. These statistics are
+    part of this object, and are therefore saved / copied with the agents using it.
+
+    The tensor of the observation last preprocessed with `memoize=True`
+    (typically by `take_action`) can be retrieved with :func: recall
+    (typically by `handle_experience`), without preprocessing it again.
+    '''
 
-    def __init__(self, state_space_size, use_cuda=False):
+    def __init__(self, state_space_size, use_cuda=False, normalize=False, clip=10.):
+        '''
+        :param state_space_size: Dimension of the flattened observations.
+        :param use_cuda: Whether to place the preprocessed observations on GPU.
+        :param normalize: Whether to normalize observations with their running mean and variance.
+        :param clip: Normalized observations are clipped to [-clip, clip].
+        '''
         self.state_space_size = state_space_size
         self.use_cuda = use_cuda
-
-    def __call__(self, x):
-        x = np.concatenate(x, axis=None)
-        if self.use_cuda:
-            return torch.from_numpy(x).unsqueeze(0).type(torch.cuda.FloatTensor)
+        self.normalize = normalize
+        self.clip = clip
+        self.running_statistics = RunningMeanStd(state_space_size) if normalize else None
+        # Reusable float32 buffer into which batches of observations can be flattened and normalized
+        self.buffer = np.empty((0, state_space_size), dtype=np.float32)
+        # (observation, tensor) pair of the last memoized observation
+        self.memo = None
+
+    def __call__(self, x, update_statistics=False, memoize=False) -> torch.Tensor:
+        '''
+        :param x: Observation.
+        :param update_statistics: Whether to update the normalization statistics with :param x:.
+        :param memoize: Whether to memoize the returned tensor, to be retrieved with :func: recall.
+        :returns: Dimension: 1 x state_space_size. Preprocessed observation.
+        '''
+        # Written into its own tensor (instead of the buffer) so that it can be stored, and computed concurrently
+        preprocessed_x = torch.empty((1, self.state_space_size), dtype=torch.float32)
+        self._flatten_into(x, preprocessed_x.numpy()[0])
+        self._normalize(preprocessed_x.numpy(), update_statistics)
+        if self.use_cuda: preprocessed_x = preprocessed_x.cuda()
+        if memoize: self.memo = (x, preprocessed_x)
+        return preprocessed_x
+
+    def batch(self, observations, update_statistics=False, memoize=False, reuse_buffer=False) -> torch.Tensor:
+        '''
+        Batched version of :func: __call__.
+        :param observations: Sequence (or array) of N observations.
+        :param reuse_buffer: Whether to write the observations into a reusable buffer instead of a new tensor.
+                             The returned tensor is then only valid until the next call with :param reuse_buffer:,
+                             which makes it suitable to compute actions, but not to be stored or memoized.
+                             Not thread safe.
+        :returns: Dimension: N x state_space_size. Preprocessed observations.
+        '''
+        if reuse_buffer:
+            if len(observations) > len(self.buffer):
+                self.buffer = np.empty((max(len(observations), 2 * len(self.buffer)), self.state_space_size), dtype=np.float32)
+            rows = self.buffer[:len(observations)]
+            preprocessed_observations = torch.from_numpy(rows)
+        else:
+            preprocessed_observations = torch.empty((len(observations), self.state_space_size), dtype=torch.float32)
+            rows = preprocessed_observations.numpy()
+        if isinstance(observations, np.ndarray): np.copyto(rows, observations.reshape(len(observations), -1))
         else:
-            return torch.from_numpy(x).unsqueeze(0).type(torch.FloatTensor)
+            for observation, row in zip(observations, rows): self._flatten_into(observation, row)
+        self._normalize(rows, update_statistics)
+        if self.use_cuda: preprocessed_observations = preprocessed_observations.cuda()
+        if memoize and not reuse_buffer: self.memo = (observations, preprocessed_observations)
+        return preprocessed_observations
+
+    def recall(self, x, batched=False) -> torch.Tensor:
+        '''
+        :param x: Observation (or batch of observations if :param batched:).
+        :returns: The memoized tensor if :param x: is the last memoized observation,
+                  otherwise :param x: preprocessed (without updating normalization statistics).
+        '''
+        memo = self.memo
+        if memo is not None and memo[0] is x: return memo[1]
+        return self.batch(x) if batched else self(x)
+
+    def _flatten_into(self, x, out: np.ndarray):
+        if isinstance(x, np.ndarray): np.copyto(out, x.reshape(-1))
+        else: np.concatenate(x, axis=None, out=out)
+
+    def _normalize(self, x: np.ndarray, update_statistics: bool):
+        if not self.normalize: return
+        if update_statistics: self.running_statistics.update(x)
+        x -= self.running_statistics.mean
+        x /= np.sqrt(self.running_statistics.var + 1.0e-8)
+        np.clip(x, -self.clip, self.clip, out=x)
+
+    def __getstate__(self):
+        # Neither the buffer nor the memoized observation are part of the preprocessing state
+        state = self.__dict__.copy()
+        state['buffer'] = np.empty((0, self.state_space_size), dtype=np.float32)
+        state['memo'] = None
+        return state
 
 
 def random_sample(indices, batch_size):
@@ -1,18 +1,36 @@
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from regym.rl_algorithms.networks.utils import layer_init
+from regym.rl_algorithms.networks.utils import layer_init, PreprocessFunction
 
 from functools import reduce
 
 
 class ReinforceAlgorithm():
 
-    def __init__(self, policy_model_input_dim, policy_model_output_dim, learning_rate, adam_eps):
+    def __init__(self, policy_model_input_dim, policy_model_output_dim, learning_rate, adam_eps,
+                 normalize_observations=False, recompute_on_update=False):
+        '''
+        :param recompute_on_update: Whether experiences are stored as (preprocessed observation, action, reward,
+                                    legal action mask) arrays (see :func: store_experience), and action
+                                    log probabilities recomputed in a single forward pass when training
+                                    (see :func: train_on_stored_experiences), instead of keeping the
+                                    autograd graph of every action taken until the update.
+        '''
         self.learning_rate = learning_rate
         self.model = FullyConnectedFeedForward(policy_model_input_dim, policy_model_output_dim, hidden_units=(16,))
         self.optimizer = optim.Adam(self.model.parameters(), lr=learning_rate, eps=adam_eps)
+        self.state_preprocessing = PreprocessFunction(policy_model_input_dim, normalize=normalize_observations)
+
+        self.recompute_on_update = recompute_on_update
+        self.states = np.empty((0, policy_model_input_dim), dtype=np.float32)
+        self.actions = np.empty(0, dtype=np.int64)
+        self.rewards = np.empty(0, dtype=np.float32)
+        self.legal_action_masks = np.empty((0, policy_model_output_dim), dtype=bool)
+        self.number_of_stored_experiences = 0
+        self.episode_ends = []
 
     def train(self, trajectories):
         def closure():
@@ -35,6 +53,58 @@ class ReinforceAlgorithm():
     def cummulative_trajectory_reward(self, trajectory):
         return sum([reward for (s, a, log_a, reward, succ_s) in trajectory])
 
+    def store_experience(self, state: torch.Tensor, action: int, reward: float, done: bool,
+                         legal_action_mask: torch.Tensor = None):
+        '''
+        :param state: Dimension: 1 x input_dim. Preprocessed observation.
+        :param legal_action_mask: (optional) Boolean tensor of dimension 1 x output_dim, True for
+                                  the legal actions at :param state:. All actions are legal if None.
+        '''
+        t = self.number_of_stored_experiences
+        if t == len(self.actions):
+            capacity = max(256, 2 * len(self.actions))
+            self.states = np.resize(self.states, (capacity, self.states.shape[1]))
+            self.actions, self.rewards = np.resize(self.actions, capacity), np.resize(self.rewards, capacity)
+            self.legal_action_masks = np.resize(self.legal_action_masks, (capacity, self.legal_action_masks.shape[1]))
+        self.states[t], self.actions[t], self.rewards[t] = state.cpu().numpy(), action, reward
+        self.legal_action_masks[t] = True if legal_action_mask is None else legal_action_mask.cpu().numpy()
+        self.number_of_stored_experiences += 1
+        if done: self.episode_ends.append(self.number_of_stored_experiences)
+
+    def train_on_stored_experiences(self):
+        '''
+        Updates the policy on the episodes stored with :func: store_experience, and empties the storage.
+        Each action is weighted by its (undiscounted) reward-to-go, minus the mean
+        reward-to-go over all stored actions as a baseline.
+        '''
+        number_of_experiences = self.episode_ends[-1]
+        states = torch.from_numpy(self.states[:number_of_experiences])
+        actions = torch.from_numpy(self.actions[:number_of_experiences])
+        legal_action_masks = torch.from_numpy(self.legal_action_masks[:number_of_experiences])
+        rewards_to_go = self.compute_rewards_to_go(self.rewards[:number_of_experiences], self.episode_ends)
+        advantages = torch.from_numpy(rewards_to_go - rewards_to_go.mean())
+
+        def closure():
+            self.optimizer.zero_grad()
+            log_action_probabilities = self.model.log_probabilities(states, actions, legal_action_masks)
+            loss = -1. * (log_action_probabilities * advantages).sum() / len(self.episode_ends)
+            loss.backward()
+            return loss
+        self.optimizer.step(closure)
+        self.number_of_stored_experiences = 0
+        self.episode_ends = []
+
+    def compute_rewards_to_go(self, rewards: np.ndarray, episode_ends) -> np.ndarray:
+        '''
+        :param rewards: Dimension: T. Rewards of consecutive episodes.
+        :param episode_ends: Index (exclusive) at which each episode in :param rewards: ends.
+        :returns: Dimension: T. Sum of the rewards from each timestep until the end of its episode.
+        '''
+        # Sum of all following rewards, minus those following the end of the timestep's episode
+        suffix_sums = np.append(np.cumsum(rewards[::-1])[::-1], 0.)
+        episode_lengths = np.diff(np.concatenate([[0], episode_ends]))
+        return (suffix_sums[:-1] - suffix_sums[np.repeat(episode_ends, episode_lengths)]).astype(np.float32)
+
 
 class FullyConnectedFeedForward(nn.Module):
 
@@ -45,11 +115,36 @@ class FullyConnectedFeedForward(nn.Module):
                                      for dim_in, dim_out in zip(dimensions[:-1], dimensions[1:])])
         self.gate = gate
 
-    def forward(self, x):
-        x = torch.from_numpy(x).unsqueeze(0).type(torch.FloatTensor).cpu()
-        last_layer_output = reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x)
-        action_probabilities = F.softmax(last_layer_output)
-        distribution = torch.distributions.Categorical(probs=action_probabilities)
-        action = distribution.sample(sample_shape=(action_probabilities.size(0),))
-        log_probability = distribution.log_prob(action)
-        return {'action': action, 'action_log_probability': log_probability}
+    def forward(self, x: torch.Tensor, legal_action_mask: torch.Tensor = None):
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :param legal_action_mask: (optional) Boolean tensor of dimension batch_size x output_dim,
+                                  True for legal actions. All actions are legal if None.
+        '''
+        logits = reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x)
+        if legal_action_mask is not None: logits = logits.masked_fill(~legal_action_mask, -1.0e9)
+        log_probabilities = F.log_softmax(logits, dim=-1)
+        # One action sampled per row: batch_size x 1
+        action = torch.multinomial(log_probabilities.exp(), num_samples=1)
+        return {'action': action, 'action_log_probability': log_probabilities.gather(1, action)}
+
+    def log_probabilities(self, x: torch.Tensor, actions: torch.Tensor,
+                          legal_action_mask: torch.Tensor = None) -> torch.Tensor:
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :param actions: Dimension: batch_size. Actions taken at observations :param x:.
+        :param legal_action_mask: (optional) Boolean tensor of dimension batch_size x output_dim,
+                                  True for the actions which were legal when :param actions: were taken.
+        :returns: Dimension: batch_size. Log probabilities of :param actions:.
+        '''
+        logits = self.policy_logits(x)
+        if legal_action_mask is not None: logits = logits.masked_fill(~legal_action_mask, -1.0e9)
+        log_probabilities = F.log_softmax(logits, dim=-1)
+        return log_probabilities.gather(1, actions.view(-1, 1)).view(-1)
+
+    def policy_logits(self, x: torch.Tensor) -> torch.Tensor:
+        '''
+        :param x: Dimension: batch_size x input_dim. Preprocessed observations.
+        :returns: Action logits of the policy.
+        '''
+        return reduce(lambda acc, layer: self.gate(layer(acc)), self.layers, x)
@@ -0,0 +1,150 @@
+from typing import Callable, Dict
+import inspect
+import queue
+import threading
+import time
+import weakref
+
+
+class BatchPrefetcher():
+    '''
+    Background thread which keeps up to :param depth: batches, produced by
+    :param sample_fn:, ready in a bounded queue, so that sampling and collating
+    a batch overlaps with the gradient step computed on the previous one.
+
+    :param sample_fn: should guard its access to the replay buffer with :attr: lock,
+    which the owner of the replay buffer must also hold while modifying it.
+    Calling :func: invalidate discards all batches sampled before the call
+    (i.e once the replay buffer has changed significantly).
+
+    Counters are kept to tell whether the consumer is sample-bound
+    (it often finds the queue empty and waits) or compute-bound
+    (the queue is usually full). See :func: statistics.
+
+    If :param sample_fn: is a bound method, its owner is only referenced weakly,
+    so that the background thread never keeps it alive: the thread is stopped
+    (see :func: close) once the owner is garbage collected.
+    '''
+
+    def __init__(self, sample_fn: Callable[[], object], depth: int):
+        self.depth = depth
+        self._set_sample_fn(sample_fn)
+        self._initialize_thread_state()
+        self.reset_statistics()
+
+    def _set_sample_fn(self, sample_fn: Callable[[], object]):
+        if inspect.ismethod(sample_fn):
+            self._sample_fn_ref = weakref.WeakMethod(sample_fn)
+            weakref.finalize(sample_fn.__self__, self.close)
+        else:
+            self._sample_fn_ref = lambda: sample_fn
+
+    @property
+    def sample_fn(self) -> Callable[[], object]:
+        ''':returns: the sampling function, or None if its owner was garbage collected.'''
+        return self._sample_fn_ref()
+
+    def _initialize_thread_state(self):
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=self.depth)
+        self.generation = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.exception = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _sample(self):
+        sample_fn = self.sample_fn
+        if sample_fn is None: raise RuntimeError('The owner of the sampling function was garbage collected')
+        return sample_fn()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            generation = self.generation
+            try:
+                # No reference to the sampling function is kept between two samples
+                item = (generation, self._sample())
+            except Exception as e:
+                self.exception = e
+                return
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    if generation != self.generation: break  # Stale batch, sample a new one
+
+    def get(self):
+        '''
+        :returns: next batch sampled after the last call to :func: invalidate.
+                  Starts the background thread on its first call.
+        '''
+        if self.thread is None: self.start()
+        self.total_queue_depth += self.queue.qsize()
+        if self.queue.empty(): self.empty_queue_gets += 1
+        start = time.perf_counter()
+        generation, batch = self._get_item()
+        while generation != self.generation:
+            self.discarded_batches += 1
+            generation, batch = self._get_item()
+        self.total_wait_time += time.perf_counter() - start
+        self.batches_served += 1
+        return batch
+
+    def _get_item(self):
+        while True:
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.exception is not None:
+                    raise RuntimeError('Batch prefetching thread failed') from self.exception
+
+    def invalidate(self):
+        self.generation += 1
+
+    def close(self):
+        if self.thread is None: return
+        self.stop_event.set()
+        # The owner of the sampling function can be collected from within the thread itself
+        if self.thread is threading.current_thread(): return
+        self.thread.join()
+        self.thread = None
+        self.stop_event.clear()
+
+    def reset_statistics(self):
+        self.batches_served = 0
+        self.empty_queue_gets = 0
+        self.discarded_batches = 0
+        self.total_queue_depth = 0
+        self.total_wait_time = 0.
+
+    def statistics(self) -> Dict[str, float]:
+        '''
+        :returns: Dictionary containing:
+            - 'batches_served': number of batches returned by :func: get.
+            - 'mean_queue_depth': average number of ready batches when :func: get was called.
+            - 'sample_bound_fraction': fraction of calls to :func: get which found the queue empty.
+            - 'mean_wait_time': average time (in seconds) spent waiting for a batch in :func: get.
+            - 'discarded_batches': number of batches discarded after an invalidation.
+        '''
+        served = max(1, self.batches_served)
+        return {'batches_served': self.batches_served,
+                'mean_queue_depth': self.total_queue_depth / served,
+                'sample_bound_fraction': self.empty_queue_gets / served,
+                'mean_wait_time': self.total_wait_time / served,
+                'discarded_batches': self.discarded_batches}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['lock', 'queue', 'stop_event', 'thread', 'exception', '_sample_fn_ref']: del state[key]
+        state['sample_fn'] = self.sample_fn
+        return state
+
+    def __setstate__(self, state):
+        sample_fn = state.pop('sample_fn')
+        self.__dict__.update(state)
+        self._set_sample_fn(sample_fn)
+        self._initialize_thread_state()
@@ -0,0 +1,92 @@
+import numpy as np
+import torch
+
+from .experience import EXP, EXPPER
+from .SumTree import SumTree
+from .ColumnarReplayBuffer import ColumnarReplayBuffer
+
+
+class ColumnarPrioritizedReplayBuffer(ColumnarReplayBuffer):
+    '''
+    Prioritized Experience Replay buffer built on top of
+    the column based storage of :class: ColumnarReplayBuffer
+    and a batched :class: SumTree. Sampling, importance sampling weight
+    computation and priority updates are performed for a whole batch at once.
+    '''
+
+    def __init__(self, capacity: int, alpha: float = 0.2, beta: float = 1.0):
+        super(ColumnarPrioritizedReplayBuffer, self).__init__(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = 1e-6
+        self.tree = SumTree(self.capacity)
+
+    def reset(self):
+        self.__init__(capacity=self.capacity, alpha=self.alpha, beta=self.beta)
+
+    def priority(self, error):
+        return (np.abs(error) + self.epsilon)**self.alpha
+
+    def _sanitize_priorities(self, priorities) -> np.ndarray:
+        priorities = np.array(priorities, dtype=np.float64).reshape(-1)
+        invalid = ~np.isfinite(priorities)
+        if invalid.any():
+            fallback = self.tree.total() / self.capacity
+            priorities[invalid] = fallback if fallback > 0 else 1.0
+        return priorities
+
+    def add(self, exp: EXP, priority: float):
+        index = self.position
+        self.push(exp)
+        self.tree.update([index], self._sanitize_priorities(priority))
+
+    def update(self, indices, priorities):
+        '''
+        Batched priority update.
+        :param indices: Array of data indices, as returned in the idx field of :func: sample
+        :param priorities: Array of new priorities (already exponentiated by alpha)
+        '''
+        if isinstance(indices, torch.Tensor): indices = indices.cpu().numpy()
+        self.tree.update(indices, self._sanitize_priorities(priorities))
+
+    def sample(self, batch_size: int):
+        '''
+        Samples :param batch_size: experiences proportionally to their priorities
+        using stratified sampling over the sum-tree.
+
+        :returns:
+            - EXPPER whose fields are batched tensors.
+            - torch.Tensor of importance sampling weights, normalized by the maximum weight
+        '''
+        indices = self.tree.stratified_sample(batch_size, length=self.current_size)
+        priorities = self.tree.get(indices)
+        importance_sampling_weights = self.importance_sampling_weights(priorities)
+
+        batch = self.gather(torch.from_numpy(indices))
+        batch = EXPPER(idx=torch.from_numpy(indices), priority=torch.from_numpy(priorities),
+                       **batch._asdict())
+        return batch, torch.from_numpy(importance_sampling_weights).float()
+
+    def importance_sampling_weights(self, priorities: np.ndarray) -> np.ndarray:
+        '''
+        w_i = (N * P(i))^-beta / max_j w_j. The maximum weight corresponds to the
+        minimum priority, which the min-tree provides in O(1), so that:
+        w_i = (p_i / p_min)^-beta
+        '''
+        return np.power(priorities / self.tree.min(), -self.beta)
+
+    def total(self):
+        return self.tree.total()
+
+    def save(self, path):
+        super(ColumnarPrioritizedReplayBuffer, self).save(path)
+        np.savez(path + '.tree', sum_tree=self.tree.sum_tree, min_tree=self.tree.min_tree,
+                 alpha=np.asarray(self.alpha), beta=np.asarray(self.beta))
+
+    def load(self, path):
+        super(ColumnarPrioritizedReplayBuffer, self).load(path)
+        data = np.load(path + '.tree.npz')
+        self.tree.sum_tree = data['sum_tree']
+        self.tree.min_tree = data['min_tree']
+        self.alpha = float(data['alpha'])
+        self.beta = float(data['beta'])
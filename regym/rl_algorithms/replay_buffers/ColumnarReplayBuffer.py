@@ -0,0 +1,90 @@
+import numpy as np
+import torch
+
+from .experience import EXP
+
+
+class ColumnarReplayBuffer():
+    '''
+    Struct-of-arrays replay buffer. Instead of storing one EXP object
+    (and its small tensors) per transition, every field of EXP is stored
+    in its own preallocated, contiguous tensor of shape (capacity, ...).
+    Columns are allocated the first time an experience is pushed,
+    inferring shapes and dtypes from it:
+        - state / next_state: float32
+        - action: int64 (float32 if the action is continuous)
+        - reward: float32
+        - done: bool
+        - discount_exponent: int64
+
+    Sampling gathers a whole batch with a single fancy-index per column,
+    returning an EXP whose fields are already batched tensors.
+    '''
+
+    def __init__(self, capacity: int):
+        self.capacity = int(capacity)
+        self.columns = None
+        self.position = 0
+        self.current_size = 0
+
+    def _allocate_columns(self, experience: EXP):
+        self.columns = {}
+        for key, value in experience._asdict().items():
+            value = self._to_row(value)
+            dtype = value.dtype
+            if key in ('state', 'next_state', 'reward') or dtype.is_floating_point:
+                dtype = torch.float32
+            self.columns[key] = self._allocate_column(key, (self.capacity, *value.shape), dtype)
+
+    def _allocate_column(self, key: str, shape, dtype: torch.dtype) -> torch.Tensor:
+        return torch.zeros(shape, dtype=dtype)
+
+    @staticmethod
+    def _to_row(value) -> torch.Tensor:
+        '''
+        Converts an element of an experience into a tensor representing a single row.
+        Preprocessed elements are batches of one element (i.e: shape 1 x ...),
+        whose leading dimension is dropped.
+        '''
+        if not isinstance(value, torch.Tensor):
+            value = torch.as_tensor(np.asarray(value))
+        value = value.detach().cpu()
+        if value.dim() > 0 and value.size(0) == 1:
+            value = value[0]
+        return value
+
+    def push(self, experience: EXP):
+        if self.columns is None: self._allocate_columns(experience)
+        for key, value in experience._asdict().items():
+            self.columns[key][self.position] = self._to_row(value)
+        self.position = (self.position + 1) % self.capacity
+        self.current_size = min(self.capacity, self.current_size + 1)
+
+    def sample(self, batch_size: int) -> EXP:
+        '''
+        Samples (with replacement) :param batch_size: experiences uniformly.
+        :returns: EXP whose fields are batched tensors of shape (batch_size, ...)
+        '''
+        indices = torch.randint(high=self.current_size, size=(batch_size,))
+        return self.gather(indices)
+
+    def gather(self, indices: torch.Tensor) -> EXP:
+        return EXP(**{key: column[indices] for key, column in self.columns.items()})
+
+    def save(self, path):
+        path += '.crb'
+        columns = {} if self.columns is None else {k: v.numpy() for k, v in self.columns.items()}
+        np.savez(path, position=np.asarray(self.position),
+                 current_size=np.asarray(self.current_size), **columns)
+
+    def load(self, path):
+        path += '.crb.npz'
+        data = np.load(path)
+        self.position = int(data['position'])
+        self.current_size = int(data['current_size'])
+        # Buffers saved before discount_exponent was introduced lack its column
+        if all(key in data for key in EXP._fields[:5]):
+            self.columns = {key: torch.from_numpy(data[key]) for key in EXP._fields if key in data}
+
+    def __len__(self):
+        return self.current_size
@@ -0,0 +1,136 @@
+import numpy as np
+import torch
+
+from .experience import EXP
+from .ColumnarReplayBuffer import ColumnarReplayBuffer
+
+
+class EpisodicReplayBuffer():
+    '''
+    Episode aware replay buffer which stores every observation only once.
+    Within an episode, the next_state of the transition at step t is the
+    state of the transition at step t+1. Observations are therefore written
+    sequentially into a ring buffer of slots, and the transition starting
+    at slot i has its next_state stored in slot i+1. Only the first
+    observation of an episode requires an extra slot, roughly halving
+    observation memory with respect to storing (state, next_state) pairs.
+
+    Each slot also holds the action, reward and done flag of the transition
+    starting at that slot, alongside a validity flag. Slots holding the terminal
+    observation of an episode, or whose successor has been overwritten,
+    are not valid transitions and are never sampled.
+
+    If :param frame_stack: is greater than 1, the states returned by :func: sample
+    are the concatenation (along their first dimension) of the last
+    :param frame_stack: observations of the episode, repeating the first
+    observation of the episode when needed. In this case pushed experiences
+    are expected to contain single (non stacked) frames.
+
+    Only one-step experiences are supported: the discount_exponent of pushed
+    experiences is ignored, and that of sampled experiences is always 1.
+    '''
+
+    def __init__(self, capacity: int, frame_stack: int = 1):
+        self.capacity = int(capacity)
+        self.frame_stack = frame_stack
+        self.columns = None
+        self.position = 0        # Next slot to be written
+        self.filled_slots = 0    # Number of slots written at least once
+        self.current_size = 0    # Number of valid transitions
+        self.last_slot = None    # Slot of the last observation of an ongoing episode
+
+    def _allocate_columns(self, experience: EXP):
+        observation = ColumnarReplayBuffer._to_row(experience.state)
+        action = ColumnarReplayBuffer._to_row(experience.action)
+        action_dtype = torch.float32 if action.dtype.is_floating_point else action.dtype
+        self.columns = {'observation': torch.zeros((self.capacity, *observation.shape), dtype=torch.float32),
+                        'action': torch.zeros((self.capacity, *action.shape), dtype=action_dtype),
+                        'reward': torch.zeros(self.capacity, dtype=torch.float32),
+                        'done': torch.zeros(self.capacity, dtype=torch.bool),
+                        'valid': torch.zeros(self.capacity, dtype=torch.bool),
+                        'episode_start': torch.zeros(self.capacity, dtype=torch.bool)}
+
+    def _write_observation(self, observation: torch.Tensor, episode_start: bool) -> int:
+        slot = self.position
+        if self.columns['valid'][slot]: self.current_size -= 1
+        self.columns['observation'][slot] = observation
+        self.columns['valid'][slot] = False
+        self.columns['episode_start'][slot] = episode_start
+        self.position = (self.position + 1) % self.capacity
+        self.filled_slots = min(self.capacity, self.filled_slots + 1)
+        return slot
+
+    def push(self, experience: EXP):
+        if self.columns is None: self._allocate_columns(experience)
+        state = ColumnarReplayBuffer._to_row(experience.state)
+        # An experience continues the ongoing episode if its state
+        # is the last stored observation
+        continues_episode = self.last_slot is not None and \
+            torch.equal(self.columns['observation'][self.last_slot], state)
+        if continues_episode: slot = self.last_slot
+        else: slot = self._write_observation(state, episode_start=True)
+
+        self.columns['action'][slot] = ColumnarReplayBuffer._to_row(experience.action)
+        self.columns['reward'][slot] = ColumnarReplayBuffer._to_row(experience.reward)
+        self.columns['done'][slot] = bool(experience.done)
+
+        next_slot = self._write_observation(ColumnarReplayBuffer._to_row(experience.next_state),
+                                            episode_start=False)
+        self.columns['valid'][slot] = True
+        self.current_size += 1
+        self.last_slot = None if experience.done else next_slot
+
+    def sample(self, batch_size: int) -> EXP:
+        '''
+        Samples (with replacement) :param batch_size: valid transitions uniformly.
+        :returns: EXP whose fields are batched tensors of shape (batch_size, ...)
+        '''
+        slots = torch.randint(high=self.filled_slots, size=(batch_size,))
+        invalid = ~self.columns['valid'][slots]
+        # Rejection sampling: invalid slots are roughly one per episode
+        while invalid.any():
+            slots[invalid] = torch.randint(high=self.filled_slots, size=(int(invalid.sum()),))
+            invalid = ~self.columns['valid'][slots]
+        return self.gather(slots)
+
+    def gather(self, slots: torch.Tensor) -> EXP:
+        next_slots = (slots + 1) % self.capacity
+        return EXP(state=self._stacked_observations(slots),
+                   action=self.columns['action'][slots],
+                   next_state=self._stacked_observations(next_slots),
+                   reward=self.columns['reward'][slots],
+                   done=self.columns['done'][slots],
+                   discount_exponent=torch.ones_like(slots))
+
+    def _stacked_observations(self, slots: torch.Tensor) -> torch.Tensor:
+        observations = self.columns['observation']
+        if self.frame_stack == 1: return observations[slots]
+        frames = [observations[slots]]
+        for _ in range(self.frame_stack - 1):
+            # Stop going back in time once the first observation of the episode,
+            # or the oldest observation in the buffer, is reached
+            first_frame = self.columns['episode_start'][slots] | (slots == self.position)
+            slots = torch.where(first_frame, slots, (slots - 1) % self.capacity)
+            frames.insert(0, observations[slots])
+        return torch.cat(frames, dim=1)
+
+    def save(self, path):
+        path += '.erb'
+        columns = {} if self.columns is None else {k: v.numpy() for k, v in self.columns.items()}
+        last_slot = -1 if self.last_slot is None else self.last_slot
+        np.savez(path, position=np.asarray(self.position), filled_slots=np.asarray(self.filled_slots),
+                 current_size=np.asarray(self.current_size), last_slot=np.asarray(last_slot), **columns)
+
+    def load(self, path):
+        path += '.erb.npz'
+        data = np.load(path)
+        self.position = int(data['position'])
+        self.filled_slots = int(data['filled_slots'])
+        self.current_size = int(data['current_size'])
+        self.last_slot = None if int(data['last_slot']) == -1 else int(data['last_slot'])
+        keys = ['observation', 'action', 'reward', 'done', 'valid', 'episode_start']
+        if all(key in data for key in keys):
+            self.columns = {key: torch.from_numpy(data[key]) for key in keys}
+
+    def __len__(self):
+        return self.current_size
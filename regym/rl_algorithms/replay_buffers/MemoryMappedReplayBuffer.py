@@ -0,0 +1,225 @@
+import os
+import json
+import mmap
+
+import numpy as np
+import torch
+
+from .experience import EXP
+from .ColumnarReplayBuffer import ColumnarReplayBuffer
+
+
+class MemoryMappedReplayBuffer(ColumnarReplayBuffer):
+    '''
+    Out-of-core version of :class: ColumnarReplayBuffer. Each column lives
+    in its own memory mapped file inside :param directory:, so that the
+    capacity of the buffer is bounded by disk space instead of physical memory.
+    The operating system pages rows in and out as they are sampled / written.
+
+    Checkpointing (:func: save) only flushes to disk the ring buffer segment
+    written since the previous checkpoint, and then atomically records the
+    write cursor in a small metadata file. Creating a buffer over a
+    :param directory: which already contains a checkpoint reopens it,
+    without deserializing any of the stored experiences.
+
+    Rows are written to the mapped files as soon as experiences are pushed, so
+    the checkpointed content of a row is appended to an undo journal right before
+    it is first overwritten after a checkpoint. Reopening the buffer rolls the
+    journal back, so that it contains exactly the last checkpoint: experiences
+    pushed after it are discarded.
+
+    NOTE: Pickled copies of this buffer (i.e saved agents) map the same files
+    once unpickled. Deep copies (i.e cloned agents) are in-memory
+    :class: ColumnarReplayBuffer holding a copy of the stored experiences,
+    so that they never write to the files of this buffer.
+    '''
+
+    METADATA_FILE = 'metadata.json'
+
+    def __init__(self, capacity: int, directory: str):
+        super(MemoryMappedReplayBuffer, self).__init__(capacity)
+        self.directory = directory
+        self.mmaps = {}
+        self.dirty_start, self.dirty_count = 0, 0
+        # Identifies the last checkpoint, and the journal of the rows overwritten since
+        self.checkpoint = 0
+        self.checkpointed_size = 0
+        self.journal, self.journaled_rows = None, set()
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.isfile(self._metadata_path()): self._reopen()
+
+    def _metadata_path(self):
+        return os.path.join(self.directory, self.METADATA_FILE)
+
+    def _journal_path(self, checkpoint: int):
+        return os.path.join(self.directory, f'journal-{checkpoint}.bin')
+
+    def _column_path(self, key: str):
+        return os.path.join(self.directory, f'{key}.bin')
+
+    def _map_column(self, key: str, shape, dtype: np.dtype, create: bool) -> torch.Tensor:
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        path = self._column_path(key)
+        with open(path, 'w+b' if create and not os.path.isfile(path) else 'r+b') as f:
+            # Extending creates a sparse file: disk blocks are only used once written.
+            # Existing files are never shrunk nor cleared
+            if create and os.fstat(f.fileno()).st_size < nbytes: f.truncate(nbytes)
+            self.mmaps[key] = mmap.mmap(f.fileno(), nbytes)
+        array = np.frombuffer(self.mmaps[key], dtype=dtype).reshape(shape)
+        return torch.from_numpy(array)
+
+    def _allocate_column(self, key: str, shape, dtype: torch.dtype) -> torch.Tensor:
+        numpy_dtype = torch.empty(0, dtype=dtype).numpy().dtype
+        return self._map_column(key, shape, numpy_dtype, create=True)
+
+    def _allocate_columns(self, experience: EXP):
+        super(MemoryMappedReplayBuffer, self)._allocate_columns(experience)
+        self._write_metadata()
+
+    def _read_metadata(self):
+        with open(self._metadata_path(), 'r') as f:
+            return json.load(f)
+
+    def _map_columns(self, columns_metadata):
+        if columns_metadata is None: return
+        self.columns = {key: self._map_column(key, tuple(shape), np.dtype(dtype), create=False)
+                        for key, (shape, dtype) in columns_metadata.items()}
+
+    def _reopen(self):
+        metadata = self._read_metadata()
+        if metadata['capacity'] != self.capacity:
+            raise ValueError(f'Replay buffer at {self.directory} has capacity {metadata["capacity"]}, '
+                             f'but a capacity of {self.capacity} was requested')
+        self.position, self.current_size = metadata['position'], metadata['current_size']
+        self.checkpoint = metadata['checkpoint'] if 'checkpoint' in metadata else 0
+        self.checkpointed_size = self.current_size
+        self.dirty_start, self.dirty_count = self.position, 0
+        self._map_columns(metadata['columns'])
+        self._roll_back_journal()
+
+    def _journal_row(self, row: int):
+        '''
+        Appends the checkpointed content of :param row: to the journal of the current checkpoint.
+        '''
+        if self.journal is None: self.journal = open(self._journal_path(self.checkpoint), 'ab')
+        self.journal.write(np.int64(row).tobytes())
+        for key in sorted(self.columns): self.journal.write(self.columns[key][row].numpy().tobytes())
+        self.journal.flush()
+        self.journaled_rows.add(row)
+
+    def _roll_back_journal(self):
+        '''
+        Restores the rows overwritten since the last checkpoint, and removes
+        every journal (including those of older checkpoints, left behind if the
+        process stopped in the middle of :func: save).
+        '''
+        journal_path = self._journal_path(self.checkpoint)
+        if self.columns is not None and os.path.isfile(journal_path):
+            keys = sorted(self.columns)
+            row_nbytes = [self.columns[key][0].numel() * self.columns[key].element_size() for key in keys]
+            with open(journal_path, 'rb') as f:
+                journal = f.read()
+            record_nbytes = 8 + sum(row_nbytes)
+            # A record cut short by a crash was never followed by the overwrite of its row
+            for start in range(0, len(journal) - record_nbytes + 1, record_nbytes):
+                row = int(np.frombuffer(journal, dtype=np.int64, count=1, offset=start)[0])
+                offset = start + 8
+                for key, nbytes in zip(keys, row_nbytes):
+                    column = self.columns[key]
+                    row_array = column[row].numpy()
+                    row_array[...] = np.frombuffer(journal, dtype=row_array.dtype, count=row_array.size,
+                                                   offset=offset).reshape(row_array.shape)
+                    offset += nbytes
+            for mapped_file in self.mmaps.values(): mapped_file.flush()
+        self._remove_journals()
+
+    def _remove_journals(self):
+        if self.journal is not None: self.journal.close()
+        self.journal, self.journaled_rows = None, set()
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith('journal-'): os.remove(os.path.join(self.directory, file_name))
+
+    def _write_metadata(self):
+        columns = None if self.columns is None else \
+            {key: (list(column.shape), column.numpy().dtype.str) for key, column in self.columns.items()}
+        metadata = {'capacity': self.capacity, 'position': self.position, 'current_size': self.current_size,
+                    'checkpoint': self.checkpoint, 'columns': columns}
+        temporary_path = self._metadata_path() + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(temporary_path, self._metadata_path())
+
+    def push(self, experience: EXP):
+        if self.position < self.checkpointed_size and self.position not in self.journaled_rows:
+            self._journal_row(self.position)
+        super(MemoryMappedReplayBuffer, self).push(experience)
+        self.dirty_count = min(self.capacity, self.dirty_count + 1)
+
+    def _dirty_segments(self):
+        '''
+        :returns: List of (first_row, number_of_rows) ring buffer segments
+                  written since the last checkpoint.
+        '''
+        if self.dirty_count == self.capacity: return [(0, self.capacity)]
+        end = self.dirty_start + self.dirty_count
+        if end <= self.capacity: return [(self.dirty_start, self.dirty_count)]
+        return [(self.dirty_start, self.capacity - self.dirty_start), (0, end - self.capacity)]
+
+    def _flush_rows(self, key: str, first_row: int, number_of_rows: int):
+        column = self.columns[key]
+        row_nbytes = column[0].numel() * column.element_size()
+        start, end = first_row * row_nbytes, (first_row + number_of_rows) * row_nbytes
+        # mmap.flush requires offsets aligned to the page size
+        start -= start % mmap.PAGESIZE
+        self.mmaps[key].flush(start, end - start)
+
+    def save(self, path: str = None):
+        '''
+        Checkpoints the buffer into its own directory. :param path: is
+        ignored, and only kept for interface compatibility with other buffers.
+        '''
+        if self.columns is not None and self.dirty_count > 0:
+            for first_row, number_of_rows in self._dirty_segments():
+                for key in self.columns: self._flush_rows(key, first_row, number_of_rows)
+        # Once the new metadata is written, the journal of the previous checkpoint is ignored
+        self.checkpoint += 1
+        self._write_metadata()
+        self._remove_journals()
+        self.checkpointed_size = self.current_size
+        self.dirty_start, self.dirty_count = self.position, 0
+
+    def load(self, path: str = None):
+        '''
+        Reopens the last checkpoint stored in this buffer's directory.
+        :param path: is ignored, and only kept for interface compatibility with other buffers.
+        '''
+        self.close()
+        self._reopen()
+
+    def close(self):
+        '''
+        Unmaps the buffer. Its journal is kept, so that experiences pushed since
+        the last checkpoint are discarded when the buffer is reopened.
+        '''
+        if self.journal is not None: self.journal.close()
+        self.journal, self.journaled_rows = None, set()
+        self.columns = None
+        for mapped_file in self.mmaps.values(): mapped_file.close()
+        self.mmaps = {}
+
+    def __deepcopy__(self, memo):
+        copied = ColumnarReplayBuffer(self.capacity)
+        copied.position, copied.current_size = self.position, self.current_size
+        if self.columns is not None: copied.columns = {key: column.clone() for key, column in self.columns.items()}
+        return copied
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['columns'], state['mmaps'] = None, {}
+        state['journal'], state['journaled_rows'] = None, set()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if os.path.isfile(self._metadata_path()):
+            self._map_columns(self._read_metadata()['columns'])
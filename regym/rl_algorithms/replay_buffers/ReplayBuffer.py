@@ -28,4 +28,4 @@ class ReplayBuffer():
         self.position = int(data['position'])
 
     def __len__(self):
-        return len(self.memory)
+        return self.current_size
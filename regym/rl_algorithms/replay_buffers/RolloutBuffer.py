@@ -0,0 +1,71 @@
+from typing import Dict, List
+
+import numpy as np
+import torch
+
+
+class RolloutBuffer():
+    '''
+    On-policy rollout storage which preallocates, for each key, a tensor of shape
+    (horizon + 1, num_envs, ...) and writes every step in place.
+    The extra row holds the prediction on the state following the last step,
+    which is used to bootstrap returns.
+
+    Shapes and dtypes are inferred from the first value added for each key:
+    tensors are expected to have a leading dimension of size :param num_envs:
+    (and are copied to CPU from any device), and python scalars (i.e rewards)
+    are stored in a column of shape (horizon + 1, num_envs).
+    Values added for keys which are not tracked by the buffer are ignored.
+    Keys registered via :func: add_key hold arbitrary (non tensor)
+    values in lists (i.e recurrent states).
+
+    Every column is also exposed as a numpy array sharing its memory
+    (in :attr: arrays), which is cheaper to write rows into than a tensor.
+    '''
+
+    def __init__(self, horizon: int, num_envs: int = 1, keys: List[str] = None):
+        self.horizon = horizon
+        self.num_envs = num_envs
+        self.keys = keys if keys is not None else ['s', 'a', 'r', 'non_terminal',
+                                                  'v', 'log_pi_a', 'adv', 'ret']
+        self.columns: Dict[str, torch.Tensor] = {}
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.list_keys: List[str] = []
+        self.reset()
+
+    def add_key(self, key: str):
+        self.list_keys.append(key)
+        setattr(self, key, [])
+
+    def allocate(self, key: str, example):
+        '''
+        Allocates the column of :param key: with the shape and dtype of :param example:,
+        a value for all :param num_envs: environments at a single step.
+        '''
+        if isinstance(example, torch.Tensor):
+            shape, dtype = example.shape, example.dtype
+        else:
+            shape, dtype = (self.num_envs,), torch.float32
+        self.columns[key] = torch.zeros((self.horizon + 1, *shape), dtype=dtype)
+        self.arrays[key] = self.columns[key].numpy()
+
+    def add(self, data: Dict[str, object]):
+        for key, value in data.items():
+            if key in self.list_keys:
+                getattr(self, key).append(value)
+            elif key in self.keys:
+                if key not in self.columns: self.allocate(key, value)
+                self.arrays[key][self.sizes[key]] = value.detach().cpu().numpy() if isinstance(value, torch.Tensor) else value
+                self.sizes[key] += 1
+
+    def reset(self):
+        self.sizes = {key: 0 for key in self.keys}
+        for key in self.list_keys: setattr(self, key, [])
+
+    def flat(self, key: str) -> torch.Tensor:
+        '''
+        :returns: zero-copy view of the first :param horizon: steps of :param key:,
+                  of shape (horizon * num_envs, ...)
+        '''
+        column = self.columns[key]
+        return column[:self.horizon].view(self.horizon * self.num_envs, *column.shape[2:])
@@ -0,0 +1,80 @@
+import torch
+import torch.multiprocessing as mp
+
+from .experience import EXP
+from .ColumnarReplayBuffer import ColumnarReplayBuffer
+
+
+class SharedMemoryReplayBuffer(ColumnarReplayBuffer):
+    '''
+    Version of :class: ColumnarReplayBuffer whose columns and write cursor
+    live in shared memory, so that several actor processes can push
+    experiences into it while a learner process samples from it.
+
+    Writes and reads are serialized by a single (coarse) lock, held while
+    reserving a row and copying an experience into it, and while gathering
+    a sampled batch. Both are small copies, which keeps contention low.
+
+    Columns must be allocated before the buffer is sent to other processes,
+    either by passing an example :param experience: to the constructor or by
+    pushing a first experience.
+
+    NOTE: Pickled copies of this buffer (i.e sent to other processes) share
+    the same memory. Deep copies hold a copy of its experiences in new shared
+    memory, unless the buffer is passed in the memo of copy.deepcopy
+    (see DeepQNetworkAgent.actor_clone).
+    '''
+
+    def __init__(self, capacity: int, experience: EXP = None):
+        # [position, current_size]
+        self.cursor = torch.zeros(2, dtype=torch.int64).share_memory_()
+        self.lock = mp.Lock()
+        super(SharedMemoryReplayBuffer, self).__init__(capacity)
+        if experience is not None: self._allocate_columns(experience)
+
+    @property
+    def position(self) -> int:
+        return int(self.cursor[0])
+
+    @position.setter
+    def position(self, value: int):
+        self.cursor[0] = value
+
+    @property
+    def current_size(self) -> int:
+        return int(self.cursor[1])
+
+    @current_size.setter
+    def current_size(self, value: int):
+        self.cursor[1] = value
+
+    def _allocate_column(self, key: str, shape, dtype: torch.dtype) -> torch.Tensor:
+        return torch.zeros(shape, dtype=dtype).share_memory_()
+
+    def push(self, experience: EXP):
+        with self.lock:
+            super(SharedMemoryReplayBuffer, self).push(experience)
+
+    def sample(self, batch_size: int) -> EXP:
+        with self.lock:
+            return super(SharedMemoryReplayBuffer, self).sample(batch_size)
+
+    def load(self, path):
+        with self.lock:
+            super(SharedMemoryReplayBuffer, self).load(path)
+            if self.columns is not None:
+                self.columns = {key: column.share_memory_() for key, column in self.columns.items()}
+
+    def __deepcopy__(self, memo):
+        with self.lock:
+            copied = SharedMemoryReplayBuffer(self.capacity)
+            copied.cursor.copy_(self.cursor)
+            if self.columns is not None:
+                copied.columns = {key: column.clone().share_memory_() for key, column in self.columns.items()}
+        return copied
+
+    def __getstate__(self):
+        if self.columns is None:
+            raise ValueError('SharedMemoryReplayBuffer columns must be allocated '
+                             'before sharing the buffer with other processes')
+        return self.__dict__.copy()
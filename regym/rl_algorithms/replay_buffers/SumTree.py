@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class SumTree():
+    '''
+    Array based binary sum-tree (and parallel min-tree) over :param capacity: priorities.
+    All operations are batched: they act on arrays of (leaf) indices and are
+    computed level by level with NumPy operations, instead of recursing
+    once per element.
+
+    Layout: the root lives at index 1, the children of node i live at 2i and 2i+1,
+    and the leaf corresponding to data index j lives at index self.leaf_offset + j.
+    The number of leaves is rounded up to a power of two so that every leaf
+    lies at the same depth.
+    '''
+
+    def __init__(self, capacity: int):
+        self.capacity = int(capacity)
+        self.depth = int(np.ceil(np.log2(max(self.capacity, 2))))
+        self.leaf_offset = 2 ** self.depth
+        self.sum_tree = np.zeros(2 * self.leaf_offset, dtype=np.float64)
+        # Empty leaves hold +inf so that they never become the minimum
+        self.min_tree = np.full(2 * self.leaf_offset, np.inf, dtype=np.float64)
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray):
+        '''
+        Sets the priority of data indices :param indices: to :param priorities:.
+        Repeated indices are allowed, the last occurrence wins.
+
+        :param indices: Array of data indices in [0, capacity)
+        :param priorities: Array of non-negative priorities, same length as :param indices:
+        '''
+        nodes = np.asarray(indices, dtype=np.int64).reshape(-1) + self.leaf_offset
+        priorities = np.asarray(priorities, dtype=np.float64).reshape(-1)
+        self.sum_tree[nodes] = priorities
+        self.min_tree[nodes] = priorities
+        for _ in range(self.depth):
+            # Parents are recomputed from their children, so duplicated
+            # nodes (siblings sharing a parent) need only be visited once.
+            nodes = np.unique(nodes // 2)
+            left, right = 2 * nodes, 2 * nodes + 1
+            self.sum_tree[nodes] = self.sum_tree[left] + self.sum_tree[right]
+            self.min_tree[nodes] = np.minimum(self.min_tree[left], self.min_tree[right])
+
+    def retrieve(self, values: np.ndarray) -> np.ndarray:
+        '''
+        Finds, for each value in :param values:, the leaf whose cumulative
+        priority interval contains it.
+
+        :param values: Array of values in [0, self.total())
+        :returns: Array of data indices, one per value
+        '''
+        values = np.array(values, dtype=np.float64).reshape(-1)
+        nodes = np.ones(values.shape, dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.sum_tree[left]
+            go_right = values > left_sums
+            values -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.leaf_offset
+
+    def stratified_sample(self, batch_size: int, length: int = None) -> np.ndarray:
+        '''
+        Splits [0, self.total()) into :param batch_size: equally sized segments
+        and retrieves one uniformly sampled value from each of them.
+
+        :param batch_size: Number of data indices to sample
+        :param length: If given, sampled indices are clipped to [0, length),
+                       guarding against floating point errors landing on empty leaves.
+        :returns: Array of :param batch_size: data indices
+        '''
+        segment = self.total() / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        indices = self.retrieve(values)
+        if length is not None: indices = np.minimum(indices, length - 1)
+        return indices
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        return self.sum_tree[np.asarray(indices, dtype=np.int64) + self.leaf_offset]
+
+    def total(self) -> float:
+        return self.sum_tree[1]
+
+    def min(self) -> float:
+        return self.min_tree[1]
@@ -1,4 +1,13 @@
 from .experience import EXP, EXPPER
 from .ReplayBuffer import ReplayBuffer
 from .PrioritizedReplayBuffer import PrioritizedReplayBuffer
+from .SumTree import SumTree
+from .ColumnarReplayBuffer import ColumnarReplayBuffer
+from .ColumnarPrioritizedReplayBuffer import ColumnarPrioritizedReplayBuffer
+from .MemoryMappedReplayBuffer import MemoryMappedReplayBuffer
+from .EpisodicReplayBuffer import EpisodicReplayBuffer
+from .SharedMemoryReplayBuffer import SharedMemoryReplayBuffer
+from .n_step_accumulator import NStepAccumulator
 from .storage import Storage
+from .RolloutBuffer import RolloutBuffer
+from .BatchPrefetcher import BatchPrefetcher
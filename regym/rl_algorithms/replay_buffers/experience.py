@@ -1,4 +1,6 @@
 from collections import namedtuple
 
-EXP = namedtuple('EXP', ('state','action','next_state', 'reward','done') )
-EXPPER = namedtuple('EXPPER', ('idx','priority','state','action','next_state', 'reward','done') )
+# discount_exponent: number of environment steps between :state: and :next_state:.
+# The bootstrapped value of :next_state: is discounted by gamma**discount_exponent.
+EXP = namedtuple('EXP', ('state','action','next_state', 'reward','done', 'discount_exponent'), defaults=(1,) )
+EXPPER = namedtuple('EXPPER', ('idx','priority','state','action','next_state', 'reward','done', 'discount_exponent'), defaults=(1,) )
@@ -0,0 +1,67 @@
+from typing import List
+
+import numpy as np
+import torch
+
+from .experience import EXP
+
+
+class NStepAccumulator():
+    '''
+    Streaming builder of n-step transitions. One-step experiences are pushed
+    as they are collected, and n-step experiences are emitted as soon as
+    their n-step return is known:
+
+        (s_t, a_t, sum_{k=0}^{n-1} gamma^k r_{t+k}, s_{t+n}, done_{t+n-1}, discount_exponent=n)
+
+    Pending experiences are kept in a ring buffer of size n, alongside
+    their partial discounted returns, which are updated incrementally
+    with every new reward. When an episode finishes, all pending experiences
+    are emitted with the terminal state and their (shorter) discount exponents.
+    '''
+
+    def __init__(self, n: int, gamma: float):
+        self.n = n
+        self.gamma = gamma
+        self.experiences = [None] * n
+        self.returns = np.zeros(n, dtype=np.float64)
+        self.discounts = np.ones(n, dtype=np.float64)
+        self.start, self.count = 0, 0
+
+    def reset(self):
+        self.experiences = [None] * self.n
+        self.start, self.count = 0, 0
+
+    def push(self, experience: EXP) -> List[EXP]:
+        '''
+        :param experience: one-step experience
+        :returns: List of n-step experiences whose return is complete (possibly empty)
+        '''
+        slot = (self.start + self.count) % self.n
+        self.experiences[slot] = experience
+        self.returns[slot], self.discounts[slot] = 0., 1.
+        self.count += 1
+
+        pending = (self.start + np.arange(self.count)) % self.n
+        self.returns[pending] += self.discounts[pending] * float(experience.reward)
+        self.discounts[pending] *= self.gamma
+
+        if experience.done:
+            ready_experiences = [self._n_step_experience(index, experience, self.count - i)
+                                 for i, index in enumerate(pending)]
+            self.reset()
+            return ready_experiences
+        if self.count == self.n:
+            ready_experience = self._n_step_experience(self.start, experience, self.n)
+            self.experiences[self.start] = None
+            self.start, self.count = (self.start + 1) % self.n, self.count - 1
+            return [ready_experience]
+        return []
+
+    def _n_step_experience(self, index: int, last_experience: EXP, discount_exponent: int) -> EXP:
+        first_experience = self.experiences[index]
+        return EXP(state=first_experience.state, action=first_experience.action,
+                   next_state=last_experience.next_state,
+                   reward=torch.ones(1) * self.returns[index],
+                   done=last_experience.done,
+                   discount_exponent=discount_exponent)
@@ -1 +1,2 @@
 from . import rl_loop
+from . import vectorized_rl_loop
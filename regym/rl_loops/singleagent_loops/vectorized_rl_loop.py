@@ -0,0 +1,59 @@
+from typing import Dict, List, Sequence
+import numpy as np
+import gym
+
+
+def run_episodes(envs: List[gym.Env], agent, episodes: int, training: bool) -> List[List]:
+    '''
+    Runs :param episodes: episodes of a single-agent rl loop, stepping the N
+    environments in :param envs: (copies of the same environment) in lockstep.
+    At every step :param agent: selects the actions of all environments at once,
+    which requires it to implement `take_actions` (and `handle_experiences` if training),
+    like regym.rl_algorithms.agents.DeepQNetworkAgent. Each environment is reset
+    as soon as its episode finishes.
+
+    :param envs: OpenAI gym environments
+    :param agent: Agent policy used to take actions in the environments and to process simulated experiences
+    :param episodes: Number of episodes to complete. Episodes which are still
+                     running once this number is reached are not returned.
+    :param training: (boolean) Whether the agent will learn from the experiences it recieves
+    :returns: List of finished episode trajectories, each one a list of (o,a,r,o',done)
+    '''
+    observations = [env.reset() for env in envs]
+    trajectories: List[List] = [[] for _ in envs]
+    finished_trajectories: List[List] = []
+    legal_action_masks = None
+    while len(finished_trajectories) < episodes:
+        # Stacked once, so that agents can reuse the observations preprocessed in take_actions
+        stacked_observations = np.stack(observations)
+        actions = agent.take_actions(stacked_observations, legal_action_masks)
+        succ_observations, rewards, dones, infos = zip(*[env.step(a) for env, a in zip(envs, actions)])
+        if training:
+            agent.handle_experiences(stacked_observations, actions, np.asarray(rewards),
+                                     np.stack(succ_observations), np.asarray(dones))
+
+        for i, env in enumerate(envs):
+            trajectories[i].append((observations[i], actions[i], rewards[i], succ_observations[i], dones[i]))
+            observations[i] = succ_observations[i]
+            if dones[i]:
+                finished_trajectories.append(trajectories[i])
+                trajectories[i] = []
+                observations[i] = env.reset()
+        legal_action_masks = legal_action_masks_from_infos(infos, dones, envs[0].action_space.n)
+    return finished_trajectories[:episodes]
+
+
+def legal_action_masks_from_infos(infos: Sequence[Dict], dones: Sequence[bool], action_dim: int) -> np.ndarray:
+    '''
+    :returns: Boolean array of dimension N x :param action_dim:, built from the 'legal_actions'
+              entries of :param infos:. All actions are legal in environments which do
+              not report legal actions, or which were just reset.
+              None if no environment reports legal actions.
+    '''
+    if not any('legal_actions' in info for info in infos): return None
+    masks = np.ones((len(infos), action_dim), dtype=bool)
+    for i, (info, done) in enumerate(zip(infos, dones)):
+        if 'legal_actions' in info and not done:
+            masks[i] = False
+            masks[i, info['legal_actions']] = True
+    return masks
@@ -1,6 +1,9 @@
 from test_fixtures import a2c_config_dict, CartPoleTask
 from utils import can_act_in_environment
 
+import numpy as np
+import torch
+
 from regym.rl_algorithms.agents import build_A2C_Agent
 from regym.rl_loops.singleagent_loops.rl_loop import run_episode
 
@@ -17,3 +20,38 @@ def test_learns_to_solve_cartpole(CartPoleTask, a2c_config_dict):
     for _ in progress_bar:
         trajectory = run_episode(CartPoleTask.env, agent, training=True)
         progress_bar.set_description(f'{agent.name} in {CartPoleTask.env.spec.id}. Episode length: {len(trajectory)}')
+
+
+def test_a2c_trains_on_synchronous_batched_rollouts(CartPoleTask, a2c_config_dict):
+    agent = build_A2C_Agent(CartPoleTask, a2c_config_dict, 'Test-A2C')
+    parameters = [p.clone() for p in agent.algorithm.model.parameters()]
+    trajectories = CartPoleTask.run_vectorized_episodes(agent, number_of_environments=4, episodes=8, training=True)
+    assert len(trajectories) == 8
+    assert tuple(agent.algorithm.rollout['actions'].shape) == (a2c_config_dict['n_steps'], 4)
+    assert any(not torch.equal(p, q) for p, q in zip(parameters, agent.algorithm.model.parameters()))
+
+
+def test_a2c_temporal_difference_targets_are_bootstrapped_per_environment(CartPoleTask, a2c_config_dict):
+    algorithm = build_A2C_Agent(CartPoleTask, a2c_config_dict, 'Test-A2C').algorithm
+    gamma = a2c_config_dict['discount_factor']
+    rewards = torch.tensor([[1., 0.], [1., 1.]])
+    non_terminals = torch.tensor([[0., 1.], [1., 1.]])
+    targets = algorithm.compute_temporal_differences_targets(rewards, non_terminals, torch.tensor([10., 20.]))
+    expected = torch.tensor([[1., gamma * (1. + gamma * 20.)], [1. + gamma * 10., 1. + gamma * 20.]])
+    assert torch.allclose(targets, expected)
+
+
+def test_a2c_recomputes_log_probabilities_under_the_stored_legal_action_masks(CartPoleTask, a2c_config_dict):
+    agent = build_A2C_Agent(CartPoleTask, a2c_config_dict, 'Test-A2C')
+    observations = np.stack([CartPoleTask.env.observation_space.sample() for _ in range(3)])
+    legal_action_masks = np.array([[True, False], [False, True], [True, True]])
+    actions = agent.take_actions(observations, legal_action_masks)
+    assert actions.tolist()[:2] == [0, 1]
+    agent.handle_experiences(observations, actions, np.ones(3), observations, np.zeros(3, dtype=bool))
+    assert torch.equal(agent.algorithm.rollout['legal_action_masks'][0], torch.as_tensor(legal_action_masks))
+
+    states = agent.algorithm.state_preprocessing.batch(observations)
+    log_probabilities, _ = agent.algorithm.model.evaluate_actions(states, torch.as_tensor(actions),
+                                                                  torch.as_tensor(legal_action_masks))
+    # Only legal action at the first two observations
+    assert torch.allclose(log_probabilities[:2], torch.zeros(2, 1))
@@ -0,0 +1,34 @@
+import torch
+
+from regym.rl_algorithms.advantage_estimation import compute_returns, compute_gae
+
+
+def reference_returns_and_advantages(rewards, values, non_terminals, bootstrap_values, discount, gae_tau):
+    T, N = rewards.shape
+    returns, advantages = torch.zeros(T, N), torch.zeros(T, N)
+    for n in range(N):
+        next_return, next_value, next_advantage = bootstrap_values[n], bootstrap_values[n], 0.
+        for t in reversed(range(T)):
+            next_return = rewards[t, n] + discount * non_terminals[t, n] * next_return
+            td_error = rewards[t, n] + discount * non_terminals[t, n] * next_value - values[t, n]
+            next_advantage = td_error + gae_tau * discount * non_terminals[t, n] * next_advantage
+            returns[t, n], advantages[t, n], next_value = next_return, next_advantage, values[t, n]
+    return returns, advantages
+
+
+def test_returns_and_gae_with_parallel_environments_and_episode_boundaries():
+    T, N, discount, gae_tau = 20, 3, 0.9, 0.8
+    rewards, values, bootstrap_values = torch.randn(T, N), torch.randn(T, N), torch.randn(N)
+    non_terminals = (torch.rand(T, N) > 0.2).float()
+    expected_returns, expected_advantages = reference_returns_and_advantages(rewards, values, non_terminals,
+                                                                             bootstrap_values, discount, gae_tau)
+
+    returns = compute_returns(rewards, non_terminals, bootstrap_values, discount)
+    advantages = compute_gae(rewards, values, non_terminals, bootstrap_values, discount, gae_tau)
+    assert returns.shape == (T, N) and advantages.shape == (T, N)
+    assert torch.allclose(returns, expected_returns, atol=1e-5)
+    assert torch.allclose(advantages, expected_advantages, atol=1e-5)
+
+    out = torch.zeros(T + 1, N)
+    compute_returns(rewards, non_terminals, bootstrap_values, discount, out=out[:T])
+    assert torch.allclose(out[:T], expected_returns, atol=1e-5) and torch.all(out[T] == 0)
@@ -1,7 +1,10 @@
+import torch
+
 from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.rl_algorithms.replay_buffers import MemoryMappedReplayBuffer
 from regym.rl_algorithms import rockAgent
 
-from test_fixtures import RPSTask, dqn_config_dict
+from test_fixtures import RPSTask, CartPoleTask, dqn_config_dict
 
 
 def test_dqn_can_take_actions(RPSTask, dqn_config_dict):
@@ -16,7 +19,20 @@ def test_dqn_can_take_actions(RPSTask, dqn_config_dict):
         assert RPSTask.env.action_space.contains([a, a])
 
 
-def test_vanilla_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+def test_DQN_clones_do_not_map_the_replay_buffer_files_of_the_original(RPSTask, dqn_config_dict, tmpdir):
+    dqn_config_dict['replay_directory'] = str(tmpdir.join('replay_buffer'))
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN')
+    RPSTask.run_episode([agent, rockAgent], training=True)
+    rewards = agent.algorithm.replayBuffer.columns['reward'].clone()
+
+    assert not isinstance(agent.algorithm.clone().replayBuffer, MemoryMappedReplayBuffer)
+    cloned_agent = agent.clone(training=True)
+    assert not isinstance(cloned_agent.algorithm.replayBuffer, MemoryMappedReplayBuffer)
+    RPSTask.run_episode([cloned_agent, rockAgent], training=True)
+    assert torch.equal(agent.algorithm.replayBuffer.columns['reward'], rewards)
+
+
+def test_vanilla_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict, tmp_path, monkeypatch):
     '''
     Test used to make sure that agent is 'learning' by learning a best response
     against an agent that only plays rock in rock paper scissors.
@@ -26,7 +42,8 @@ def test_vanilla_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
 
     from torch.utils.tensorboard import SummaryWriter
     import regym
-    regym.rl_algorithms.DQN.dqn_loss.summary_writer = SummaryWriter('test_tensorboard')
+    # Restored after the test, and written to a temporary directory
+    monkeypatch.setattr(regym.rl_algorithms.DQN.dqn_loss, 'summary_writer', SummaryWriter(str(tmp_path)))
     agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN')
     assert agent.training
     learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
@@ -38,7 +55,7 @@ def test_vanilla_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
                                evaluation_method='cumulative')
 
 
-def test_double_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+def test_double_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict, tmp_path, monkeypatch):
     '''
     Test used to make sure that agent is 'learning' by learning a best response
     against an agent that only plays rock in rock paper scissors.
@@ -48,7 +65,8 @@ def test_double_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
 
     from torch.utils.tensorboard import SummaryWriter
     import regym
-    regym.rl_algorithms.DQN.dqn_loss.summary_writer = SummaryWriter('test_tensorboard')
+    # Restored after the test, and written to a temporary directory
+    monkeypatch.setattr(regym.rl_algorithms.DQN.dqn_loss, 'summary_writer', SummaryWriter(str(tmp_path)))
     dqn_config_dict['double'] = True
     agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'Double_DQN')
     assert agent.training and agent.algorithm.use_double
@@ -61,7 +79,7 @@ def test_double_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
                                evaluation_method='cumulative')
 
 
-def test_dueling_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+def test_dueling_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict, tmp_path, monkeypatch):
     '''
     Test used to make sure that agent is 'learning' by learning a best response
     against an agent that only plays rock in rock paper scissors.
@@ -71,7 +89,8 @@ def test_dueling_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
 
     from torch.utils.tensorboard import SummaryWriter
     import regym
-    regym.rl_algorithms.DQN.dqn_loss.summary_writer = SummaryWriter('test_tensorboard')
+    # Restored after the test, and written to a temporary directory
+    monkeypatch.setattr(regym.rl_algorithms.DQN.dqn_loss, 'summary_writer', SummaryWriter(str(tmp_path)))
     dqn_config_dict['dueling'] = True
     agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'Dueling_DQN')
     assert agent.training and agent.algorithm.use_dueling
@@ -82,3 +101,258 @@ def test_dueling_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
                                reward_tolerance=2.,
                                maximum_average_reward=10.0,
                                evaluation_method='cumulative')
+
+
+def test_PER_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict, tmp_path, monkeypatch):
+    '''
+    Test used to make sure that agent is 'learning' by learning a best response
+    against an agent that only plays rock in rock paper scissors.
+    i.e from random, learns to play only (or mostly) paper
+    '''
+    from play_against_fixed_opponent import learn_against_fix_opponent
+
+    from torch.utils.tensorboard import SummaryWriter
+    import regym
+    # Restored after the test, and written to a temporary directory
+    monkeypatch.setattr(regym.rl_algorithms.DQN.dqn_loss, 'summary_writer', SummaryWriter(str(tmp_path)))
+    dqn_config_dict['use_PER'] = True
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'PER_DQN')
+    assert agent.training and agent.algorithm.use_PER
+    learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
+                               agent_position=0,  # Doesn't matter in RPS
+                               task=RPSTask,
+                               total_episodes=250, training_percentage=0.9,
+                               reward_tolerance=2.,
+                               maximum_average_reward=10.0,
+                               evaluation_method='cumulative')
+
+
+def test_n_step_DQN_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+    '''
+    Test used to make sure that agent is 'learning' by learning a best response
+    against an agent that only plays rock in rock paper scissors.
+    i.e from random, learns to play only (or mostly) paper
+    '''
+    from play_against_fixed_opponent import learn_against_fix_opponent
+
+    dqn_config_dict['n_step'] = 3
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'n_step_DQN')
+    assert agent.training and agent.algorithm.n_step == 3
+    learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
+                               agent_position=0,  # Doesn't matter in RPS
+                               task=RPSTask,
+                               total_episodes=250, training_percentage=0.9,
+                               reward_tolerance=2.,
+                               maximum_average_reward=10.0,
+                               evaluation_method='cumulative')
+
+
+def test_DQN_learns_to_beat_rock_in_RPS_from_several_actor_processes(RPSTask, dqn_config_dict):
+    '''
+    Test used to make sure that a learner agent is 'learning' from the experiences
+    that several actor processes collect against an agent that only plays rock.
+    '''
+    from play_against_fixed_opponent import learn_against_fix_opponent
+    from regym.rl_algorithms.DQN import train_with_actors
+
+    dqn_config_dict['shared_replay'] = True
+    dqn_config_dict['min_memory'] = 256
+    dqn_config_dict['learning_rate'] = 1.0e-3
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'shared_replay_DQN')
+    RPSTask.extend_task({1: rockAgent})
+    iterations = train_with_actors(RPSTask, agent, number_of_actors=3, episodes_per_actor=150)
+    RPSTask.extended_agents = {}
+    assert iterations > 0 and iterations % dqn_config_dict['nbrTrainIteration'] == 0
+    assert len(agent.algorithm.replayBuffer) == agent.algorithm.replayBuffer.capacity
+    learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
+                               agent_position=0,  # Doesn't matter in RPS
+                               task=RPSTask,
+                               total_episodes=50, training_percentage=0.1,
+                               reward_tolerance=2.,
+                               maximum_average_reward=10.0,
+                               evaluation_method='cumulative')
+
+
+def test_DQN_with_batch_prefetching_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+    '''
+    Test used to make sure that agent is 'learning' by learning a best response
+    against an agent that only plays rock in rock paper scissors.
+    i.e from random, learns to play only (or mostly) paper
+    '''
+    from play_against_fixed_opponent import learn_against_fix_opponent
+
+    dqn_config_dict['prefetch_batches'] = 4
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'prefetching_DQN')
+    assert agent.training and agent.algorithm.prefetcher is not None
+    learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
+                               agent_position=0,  # Doesn't matter in RPS
+                               task=RPSTask,
+                               total_episodes=250, training_percentage=0.9,
+                               reward_tolerance=2.,
+                               maximum_average_reward=10.0,
+                               evaluation_method='cumulative')
+    assert agent.algorithm.prefetcher.statistics()['batches_served'] > 0
+    agent.close()
+    assert agent.algorithm.prefetcher.thread is None
+
+
+def test_DQN_batch_prefetching_threads_stop_once_their_algorithm_is_collected(RPSTask, dqn_config_dict):
+    import gc
+    dqn_config_dict['prefetch_batches'] = 2
+    dqn_config_dict['min_memory'] = 5
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'prefetching_DQN')
+    for _ in range(5): RPSTask.run_episode([agent, rockAgent], training=True)
+    clone = agent.clone(training=True)
+    clone.algorithm.train(iterations=1)
+    threads = [agent.algorithm.prefetcher.thread, clone.algorithm.prefetcher.thread]
+    assert all(thread is not None and thread.is_alive() for thread in threads)
+    del agent, clone
+    gc.collect()
+    for thread in threads: thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_DQN_with_asynchronous_learner_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+    '''
+    Test used to make sure that an agent whose model is trained by a background
+    learner thread is 'learning' a best response against an agent that only plays rock.
+    '''
+    from play_against_fixed_opponent import learn_against_fix_opponent, simulate
+
+    dqn_config_dict['asynchronous_training'] = True
+    dqn_config_dict['inference_sync_interval'] = 20
+    dqn_config_dict['learning_rate'] = 1.0e-4
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'asynchronous_DQN')
+    learner = agent.algorithm.learner
+    assert agent.training and learner is not None
+    simulate(RPSTask, agent, rockAgent, agent_position=0, episodes=225, training=True)
+    learner.synchronize()
+    statistics = learner.statistics()
+    assert statistics['gradient_steps'] >= learner.replay_ratio * statistics['environment_steps'] > 0
+    assert statistics['model_syncs'] > 0
+    learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
+                               agent_position=0,  # Doesn't matter in RPS
+                               task=RPSTask,
+                               total_episodes=50, training_percentage=0.1,
+                               reward_tolerance=2.,
+                               maximum_average_reward=10.0,
+                               evaluation_method='cumulative')
+    learner.close()
+
+
+def test_DQN_asynchronous_learner_is_paused_while_agents_are_cloned(RPSTask, dqn_config_dict):
+    import time
+    dqn_config_dict['asynchronous_training'] = True
+    dqn_config_dict['min_memory'] = 5
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'asynchronous_DQN')
+    learner = agent.algorithm.learner
+    for _ in range(5): RPSTask.run_episode([agent, rockAgent], training=True)
+    assert learner.thread is not None
+    with agent.algorithm.training_paused():
+        weights = [p.clone() for p in agent.algorithm.model.parameters()]
+        time.sleep(0.2)
+        assert all(torch.equal(p, w) for p, w in zip(agent.algorithm.model.parameters(), weights))
+    assert learner.thread.is_alive()
+    clone = agent.clone(training=False)
+    assert clone.algorithm.learner.thread is None
+    agent.close()
+
+
+def test_double_dueling_DQN_loss_matches_separate_forward_passes():
+    import torch
+    from regym.rl_algorithms.DQN.dqn_loss import compute_loss
+    from regym.rl_algorithms.networks import CategoricalDuelingDQNet, FCBody
+
+    B, state_dim, action_dim, gamma = 32, 4, 3, 0.9
+    model = CategoricalDuelingDQNet(FCBody(state_dim), action_dim)
+    target_model = CategoricalDuelingDQNet(FCBody(state_dim), action_dim)
+    states, next_states = torch.randn(B, state_dim), torch.randn(B, state_dim)
+    actions, rewards = torch.randint(action_dim, (B,)), torch.randn(B, 1)
+    non_terminals, discount_exponents = (torch.rand(B, 1) > 0.2).float(), torch.randint(1, 4, (B,))
+
+    Q_s_a = model(states)['Q'].gather(1, actions.view(-1, 1))
+    succs_actions = model(next_states)['Q'].argmax(dim=1, keepdim=True)
+    target = target_model(next_states)['Q'].gather(1, succs_actions).detach()
+    td_error = rewards + non_terminals * gamma ** discount_exponents.view(-1, 1).float() * target - Q_s_a
+    expected_huber = torch.nn.functional.huber_loss(td_error, torch.zeros_like(td_error), delta=0.5)
+
+    for huber_delta, expected_loss in [(None, 0.5 * td_error.pow(2).mean()), (0.5, expected_huber)]:
+        loss, td_errors = compute_loss(states, actions, next_states, rewards, non_terminals, model, target_model,
+                                       gamma=gamma, discount_exponents=discount_exponents, use_double=True,
+                                       use_dueling=True, huber_delta=huber_delta)
+        assert torch.allclose(loss, expected_loss, atol=1e-6)
+        assert torch.allclose(td_errors, td_error.detach(), atol=1e-6)
+
+
+def test_soft_and_hard_target_updates(monkeypatch):
+    import torch
+    from regym.rl_algorithms.networks import CategoricalDQNet, FCBody, hard_update, soft_update
+
+    for has_foreach_operations in [True, False]:
+        if not has_foreach_operations:
+            for operation in ['_foreach_lerp_', '_foreach_copy_']: monkeypatch.delattr(torch, operation, raising=False)
+        model, target_model = CategoricalDQNet(FCBody(4), 3), CategoricalDQNet(FCBody(4), 3)
+        expected = [0.9 * tp + 0.1 * p for tp, p in zip(target_model.parameters(), model.parameters())]
+        soft_update(target_model, model, tau=0.1)
+        assert all(torch.allclose(tp, e) for tp, e in zip(target_model.parameters(), expected))
+        hard_update(target_model, model)
+        assert all(torch.equal(tp, p) for tp, p in zip(target_model.parameters(), model.parameters()))
+
+
+def test_hard_target_updates_happen_once_per_interval_whatever_the_iterations_per_call(RPSTask, dqn_config_dict,
+                                                                                         monkeypatch):
+    import regym.rl_algorithms.DQN.deep_q_network as deep_q_network
+    algorithm = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN').algorithm
+    synced_at = []
+    monkeypatch.setattr(deep_q_network, 'hard_update', lambda *_: synced_at.append(algorithm.target_update_count))
+    monkeypatch.setattr(algorithm, 'optimize_model', lambda: None)
+    # i.e nbrTrainIteration = 8 iterations for each of 3 environment copies
+    for _ in range(50): algorithm.train(iterations=24)
+    interval = algorithm.target_update_interval
+    assert len(synced_at) == (50 * 24) // interval
+    assert all(count // interval == i + 1 for i, count in enumerate(synced_at))
+
+
+def test_DQN_with_soft_target_updates_learns_to_beat_rock_in_RPS(RPSTask, dqn_config_dict):
+    '''
+    Test used to make sure that agent is 'learning' by learning a best response
+    against an agent that only plays rock in rock paper scissors.
+    i.e from random, learns to play only (or mostly) paper
+    '''
+    import numpy as np
+    import random
+    from play_against_fixed_opponent import learn_against_fix_opponent
+
+    # Seeded, so that the (slower) soft target updates can't fail to converge by chance
+    torch.manual_seed(0)
+    np.random.seed(0)
+    random.seed(0)
+    dqn_config_dict['target_update'] = 'soft'
+    dqn_config_dict['tau'] = 1.0e-3
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'soft_target_update_DQN')
+    assert agent.training and agent.algorithm.target_update == 'soft'
+    learn_against_fix_opponent(agent, fixed_opponent=rockAgent,
+                               agent_position=0,  # Doesn't matter in RPS
+                               task=RPSTask,
+                               total_episodes=250, training_percentage=0.9,
+                               reward_tolerance=2.,
+                               maximum_average_reward=10.0,
+                               evaluation_method='cumulative')
+
+
+def test_dqn_takes_batched_actions_on_vectorized_environments(CartPoleTask, dqn_config_dict):
+    import numpy as np
+
+    dqn_config_dict['min_memory'] = 64
+    dqn_config_dict['batch_size'] = 32
+    agent = build_DQN_Agent(CartPoleTask, dqn_config_dict, 'vectorized_DQN')
+    observations = np.stack([CartPoleTask.env.observation_space.sample() for _ in range(8)])
+    legal_action_masks = np.zeros((8, CartPoleTask.action_dim), dtype=bool)
+    legal_action_masks[:, 1] = True
+    actions = agent.take_actions(observations, legal_action_masks)
+    assert actions.shape == (8,) and np.all(actions == 1) and agent.nbr_steps == 8
+
+    trajectories = CartPoleTask.run_vectorized_episodes(agent, number_of_environments=4, episodes=10, training=True)
+    assert len(trajectories) == 10 and all(t[-1][-1] for t in trajectories)
+    assert len(agent.algorithm.replayBuffer) == agent.nbr_steps - 8
+    assert agent.algorithm.target_update_count > 0
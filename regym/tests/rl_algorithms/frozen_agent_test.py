@@ -0,0 +1,73 @@
+import pickle
+
+import numpy as np
+import torch
+
+from regym.rl_algorithms.agents import build_DQN_Agent, build_PPO_Agent, build_A2C_Agent, build_Reinforce_Agent
+from regym.rl_algorithms.agents import FrozenAgent, freeze_if_supported, build_TabularQ_Agent
+from regym.rl_algorithms import rockAgent, AgentHook
+from regym.util.play_matches import play_multiple_matches
+
+from test_fixtures import RPSTask, dqn_config_dict, ppo_config_dict, a2c_config_dict, reinforce_config_dict
+from test_fixtures import ppo_rnn_config_dict, tabular_q_learning_config_dict
+
+
+def test_frozen_dqn_agent_acts_like_its_greedy_policy(RPSTask, dqn_config_dict):
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN')
+    agent.training = False
+    frozen_agent = agent.freeze()
+    assert isinstance(frozen_agent, FrozenAgent) and not frozen_agent.training
+
+    for _ in range(20):
+        observation = RPSTask.env.observation_space.sample()[0]
+        assert frozen_agent.take_action(observation) == agent.take_action(observation, legal_actions=[0, 1, 2])
+        # Illegal actions are never taken
+        assert frozen_agent.take_action(observation, legal_actions=[2]) == 2
+
+    # Later updates of the agent don't affect the frozen policy
+    observation = RPSTask.env.observation_space.sample()[0]
+    action = frozen_agent.take_action(observation)
+    with torch.no_grad():
+        for p in agent.algorithm.model.parameters(): p.normal_()
+    assert frozen_agent.take_action(observation) == action
+
+    unpickled_agent = pickle.loads(pickle.dumps(frozen_agent))
+    assert unpickled_agent.take_action(observation) == action
+
+
+def test_frozen_policy_gradient_agents_play_matches(RPSTask, ppo_config_dict, a2c_config_dict, reinforce_config_dict):
+    agents = [build_PPO_Agent(RPSTask, ppo_config_dict, 'PPO'),
+              build_A2C_Agent(RPSTask, a2c_config_dict, 'A2C'),
+              build_Reinforce_Agent(RPSTask, reinforce_config_dict, 'Reinforce')]
+    for agent in agents:
+        frozen_agent = agent.freeze()
+        actions = [frozen_agent.take_action(RPSTask.env.observation_space.sample()[0]) for _ in range(50)]
+        assert set(actions) <= {0, 1, 2}
+        assert all(frozen_agent.take_action(RPSTask.env.observation_space.sample()[0], legal_actions=[1]) == 1
+                   for _ in range(10))
+        winrates = play_multiple_matches(RPSTask, [frozen_agent.clone(training=False), rockAgent], n_matches=5)
+        assert np.isclose(sum(winrates), 1.)
+
+
+def test_quantized_frozen_dqn_agent_agrees_with_its_policy_and_can_be_hooked(RPSTask, dqn_config_dict):
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN')
+    frozen_agent, quantized_agent = agent.freeze(), agent.freeze(quantize=True)
+    assert isinstance(quantized_agent, FrozenAgent)
+
+    observations = [RPSTask.env.observation_space.sample()[0] for _ in range(200)]
+    agreement = np.mean([frozen_agent.take_action(o) == quantized_agent.take_action(o) for o in observations])
+    assert agreement > 0.9
+    assert all(quantized_agent.take_action(o, legal_actions=[1]) == 1 for o in observations[:10])
+
+    assert len(pickle.dumps(quantized_agent)) < len(pickle.dumps(frozen_agent))
+    unhooked_agent = AgentHook.unhook(AgentHook(agent, quantize=True))
+    assert isinstance(unhooked_agent, FrozenAgent)
+    assert all(unhooked_agent.take_action(o) == quantized_agent.take_action(o) for o in observations[:20])
+
+
+def test_agents_which_cannot_be_frozen_are_hooked_as_they_are(RPSTask, ppo_rnn_config_dict, tabular_q_learning_config_dict):
+    recurrent_agent = build_PPO_Agent(RPSTask, ppo_rnn_config_dict, 'RPPO')
+    tabular_agent = build_TabularQ_Agent(RPSTask, tabular_q_learning_config_dict, 'TQL')
+    for agent in [recurrent_agent, tabular_agent, rockAgent]:
+        assert freeze_if_supported(agent, quantize=True) is None
+        assert AgentHook(agent, quantize=True).agent is agent
@@ -0,0 +1,31 @@
+import threading
+
+from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.rl_algorithms.inference_server import InferenceServer
+from regym.rl_algorithms import rockAgent
+
+from test_fixtures import RPSTask, dqn_config_dict
+
+
+def test_inference_server_batches_requests_from_many_episode_loops(RPSTask, dqn_config_dict):
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN')
+    frozen_agent = agent.freeze()
+    server = InferenceServer.from_agent(agent, max_batch_size=8, max_latency=5.0e-3)
+
+    observation = RPSTask.env.observation_space.sample()[0]
+    proxy = server.proxy('DQN_proxy')
+    assert proxy.take_action(observation) == frozen_agent.take_action(observation)
+    assert proxy.take_action(observation, legal_actions=[1]) == 1
+
+    trajectories = []
+    def run_episodes(task):
+        for _ in range(10): trajectories.append(task.run_episode([server.proxy('DQN_proxy'), rockAgent], training=False))
+    threads = [threading.Thread(target=run_episodes, args=(RPSTask.clone(),)) for _ in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    server.close()
+
+    statistics = server.statistics()
+    assert len(trajectories) == 80
+    assert statistics['requests_served'] == 2 + sum(map(len, trajectories))
+    assert statistics['mean_batch_size'] > 1
@@ -155,3 +155,103 @@ def play_against_fixed_agent(agent, fixed_agent_action, agent_position,
                                reward_tolerance=1.,
                                maximum_average_reward=max_reward,
                                evaluation_method='last')
+
+
+def test_ppo_computes_advantages_and_returns_in_place(RPSTask, ppo_config_dict):
+    import torch
+    for use_gae in [False, True]:
+        ppo_config_dict['use_gae'] = use_gae
+        ppo_config_dict['horizon'] = horizon = 16
+        agent = build_PPO_Agent(RPSTask, ppo_config_dict, 'PPO')
+        kwargs, storage = agent.algorithm.kwargs, agent.algorithm.storage
+        rewards, dones, values = torch.randn(horizon), torch.rand(horizon) < 0.2, torch.randn(horizon + 1)
+        for t in range(horizon + 1):
+            storage.add({'v': values[t].view(1, 1)})
+            if t < horizon: storage.add({'r': float(rewards[t]), 'non_terminal': 1 - int(dones[t])})
+        agent.algorithm.compute_advantages_and_returns()
+
+        advantages, returns = torch.zeros(horizon), torch.zeros(horizon)
+        next_return, next_advantage = values[horizon], 0.
+        for i in reversed(range(horizon)):
+            non_terminal = 1. - float(dones[i])
+            next_return = rewards[i] + kwargs['discount'] * non_terminal * next_return
+            if use_gae:
+                td_error = rewards[i] + kwargs['discount'] * non_terminal * values[i + 1] - values[i]
+                next_advantage = td_error + kwargs['gae_tau'] * kwargs['discount'] * non_terminal * next_advantage
+            else:
+                next_advantage = next_return - values[i]
+            advantages[i], returns[i] = next_advantage, next_return
+        assert torch.allclose(storage.flat('ret').view(-1), returns, atol=1e-5)
+        assert torch.allclose(storage.flat('adv').view(-1), advantages, atol=1e-5)
+
+
+def test_categorical_head_computes_per_sample_log_probs_and_batched_masks():
+    import torch
+    from regym.rl_algorithms.networks import CategoricalActorCriticNet
+    torch.manual_seed(0)
+    batch_size, state_dim, action_dim = 64, 4, 5
+    model = CategoricalActorCriticNet(state_dim, action_dim)
+    states = torch.randn(batch_size, state_dim)
+    actions = torch.randint(action_dim, (batch_size, 1))
+
+    prediction = model(states, actions)
+    dist = torch.distributions.Categorical(logits=model.policy_logits(states))
+    assert prediction['a'].shape == (batch_size, 1)
+    assert torch.allclose(prediction['log_pi_a'], dist.log_prob(actions.squeeze(-1)).unsqueeze(-1), atol=1e-6)
+    assert torch.allclose(prediction['ent'], dist.entropy().unsqueeze(-1), atol=1e-6)
+
+    # Sampled actions have one entry per element of the batch
+    assert model(states)['a'].shape == (batch_size, 1)
+
+    # Boolean mask tensors restrict each element of the batch to its own legal actions
+    legal_action_mask = torch.zeros(batch_size, action_dim, dtype=torch.bool)
+    legal_action_mask[torch.arange(batch_size), torch.arange(batch_size) % action_dim] = True
+    sampled_actions = model(states, legal_actions=legal_action_mask)['a'].squeeze(-1)
+    assert (sampled_actions == torch.arange(batch_size) % action_dim).all()
+
+    # Lists of legal actions are shared by the whole batch, and their masks are cached
+    assert set(model(states, legal_actions=[1, 3])['a'].view(-1).tolist()) <= {1, 3}
+    model(states, legal_actions=[1, 3])
+    assert len(model.legal_action_masks) == 1
+
+
+def test_lstm_body_processes_packed_sequences_like_cell_by_cell():
+    import copy
+    import torch
+    import torch.nn.functional as F
+    from torch.nn.utils.rnn import pack_sequence
+    from regym.rl_algorithms.networks import LSTMBody
+    torch.manual_seed(0)
+    body = LSTMBody(4, hidden_units=(8, 8), gate=F.leaky_relu)
+    sequences = [torch.randn(length, 4) for length in [5, 2, 7]]
+    initial_states = ([torch.randn(3, 8), torch.randn(3, 8)], [torch.randn(3, 8), torch.randn(3, 8)])
+
+    state_dict_keys = list(body.state_dict().keys())
+    packed_outputs, (hs, cs) = body((pack_sequence(sequences, enforce_sorted=False), initial_states))
+    # Processing sequences leaves the module untouched, so that copies compute the same outputs
+    assert list(body.state_dict().keys()) == state_dict_keys
+    copied_outputs, _ = copy.deepcopy(body)((pack_sequence(sequences, enforce_sorted=False), initial_states))
+    assert torch.equal(copied_outputs.data, packed_outputs.data)
+    for i, sequence in enumerate(sequences):
+        states = ([h[i:i+1] for h in initial_states[0]], [c[i:i+1] for c in initial_states[1]])
+        for x in sequence:
+            output, states = body((x.unsqueeze(0), states))
+        assert all(torch.allclose(h[i], final_h[0], atol=1e-5) for h, final_h in zip(hs, states[0]))
+        assert all(torch.allclose(c[i], final_c[0], atol=1e-5) for c, final_c in zip(cs, states[1]))
+    # Gradients reach the weights shared with the cells used to act
+    packed_outputs.data.sum().backward()
+    assert all(p.grad is not None for p in body.parameters())
+
+
+def test_recurrent_ppo_stores_only_sequence_start_states(RPSTask, ppo_rnn_config_dict):
+    ppo_rnn_config_dict['horizon'] = 64
+    ppo_rnn_config_dict['sequence_length'] = 8
+    agent = build_PPO_Agent(RPSTask, ppo_rnn_config_dict, 'RNN_PPO')
+    trajectory = RPSTask.run_episode([agent, rockAgent], training=True)
+    # RPS episodes are 10 steps long: sequences restart at every multiple of 8 steps and every new episode
+    assert len(trajectory) == 10
+    starts = [t for t, _ in agent.algorithm.storage.sequence_start_rnn_states]
+    assert starts == [0, 8]
+    for _ in range(6): RPSTask.run_episode([agent, rockAgent], training=True)
+    # A rollout of 64 steps was used to train, and the storage was reset
+    assert agent.algorithm.storage.sizes['s'] == 6
@@ -0,0 +1,66 @@
+import copy
+import pickle
+
+import numpy as np
+import torch
+
+from regym.rl_algorithms.agents import build_DQN_Agent
+from regym.rl_algorithms.networks import PreprocessFunction, RunningMeanStd
+
+from test_fixtures import RPSTask, dqn_config_dict
+
+
+def test_running_mean_std_matches_statistics_of_whole_stream():
+    stream = np.random.randn(1000, 5) * 3. + 2.
+    running_statistics = RunningMeanStd(5, epsilon=0.)
+    running_statistics.update(stream[:1])
+    for start in range(1, 1000, 37): running_statistics.update(stream[start:start+37])
+    assert running_statistics.count == 1000
+    assert np.allclose(running_statistics.mean, stream.mean(axis=0))
+    assert np.allclose(running_statistics.var, stream.var(axis=0))
+
+
+def test_batched_preprocessing_matches_single_observations():
+    preprocess = PreprocessFunction(6, normalize=True)
+    observations = [[np.random.randn(3) * 10, np.random.randn(3)] for _ in range(50)]
+    batch = preprocess.batch(observations, update_statistics=True)
+    assert batch.shape == (50, 6) and batch.dtype == torch.float32
+    assert torch.allclose(batch, torch.cat([preprocess(o) for o in observations]))
+    assert np.allclose(preprocess.running_statistics.mean,
+                       np.mean([np.concatenate(o) for o in observations], axis=0))
+    assert batch.abs().max() <= preprocess.clip
+
+    # Returned batches don't share memory with the reused buffer
+    preprocess.batch(observations[::-1])
+    assert torch.allclose(batch, torch.cat([preprocess(o) for o in observations]))
+
+
+def test_memoized_observation_is_recalled_and_not_checkpointed():
+    preprocess = PreprocessFunction(6, normalize=True)
+    observation, other_observation = [np.ones(3), np.zeros(3)], [np.ones(3), np.zeros(3)]
+    x = preprocess(observation, update_statistics=True, memoize=True)
+    assert preprocess.recall(observation) is x
+    assert preprocess.recall(other_observation) is not x
+    assert preprocess.running_statistics.count > 1
+
+    for restored in [pickle.loads(pickle.dumps(preprocess)), copy.deepcopy(preprocess)]:
+        assert restored.memo is None
+        assert np.allclose(restored.running_statistics.mean, preprocess.running_statistics.mean)
+        assert torch.allclose(restored(observation), x)
+
+
+def test_dqn_agent_normalizes_each_observation_once(RPSTask, dqn_config_dict):
+    dqn_config_dict['normalize_observations'] = True
+    agent = build_DQN_Agent(RPSTask, dqn_config_dict, 'DQN')
+    observations = RPSTask.env.reset()
+    for _ in range(10):
+        action = agent.take_action(observations[0], legal_actions=[0, 1, 2])
+        succ_observations, rewards, done, _ = RPSTask.env.step([action, 0])
+        agent.handle_experience(observations[0], action, rewards[0], succ_observations[0], done)
+        observations = succ_observations
+    statistics = agent.preprocessing_function.running_statistics
+    assert np.isclose(statistics.count, 10, atol=1e-3)
+    # Frozen agents act with a snapshot of the normalization statistics
+    frozen_agent = agent.freeze()
+    agent.take_action(observations[0], legal_actions=[0, 1, 2])
+    assert np.isclose(frozen_agent.preprocess.running_statistics.count, 10, atol=1e-3)
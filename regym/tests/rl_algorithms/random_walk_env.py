@@ -34,7 +34,7 @@ class RandomWalkEnv(gym.Env):
         '''
         self.winner = -1
         self.done = False
-        self.current_positions = self.starting_positions
+        self.current_positions = copy(self.starting_positions)
         return [np.array(copy(self.current_positions)), np.array(copy(self.current_positions))]
 
     def clone(self):
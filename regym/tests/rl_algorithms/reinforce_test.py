@@ -1,6 +1,9 @@
 from test_fixtures import reinforce_config_dict, CartPoleTask
 from utils import can_act_in_environment
 
+import numpy as np
+import torch
+
 from regym.rl_algorithms.agents import build_Reinforce_Agent
 from regym.rl_loops.singleagent_loops.rl_loop import run_episode
 
@@ -17,3 +20,42 @@ def test_learns_to_solve_cartpole(CartPoleTask, reinforce_config_dict):
     for _ in progress_bar:
         trajectory = run_episode(CartPoleTask.env, agent, training=True)
         progress_bar.set_description(f'{agent.name} in {CartPoleTask.env.spec.id}. Episode length: {len(trajectory)}')
+
+
+def test_rewards_to_go_are_computed_within_each_episode(CartPoleTask, reinforce_config_dict):
+    algorithm = build_Reinforce_Agent(CartPoleTask, reinforce_config_dict, 'Test-Reinforce').algorithm
+    rewards = np.array([1., 2., 3., 10., 20.], dtype=np.float32)
+    rewards_to_go = algorithm.compute_rewards_to_go(rewards, episode_ends=[3, 5])
+    np.testing.assert_allclose(rewards_to_go, [6., 5., 3., 30., 20.])
+
+
+def test_reinforce_recomputing_log_probabilities_on_update_trains_on_stored_episodes(CartPoleTask, reinforce_config_dict):
+    config = dict(reinforce_config_dict, episodes_before_update=3, recompute_on_update=True)
+    agent = build_Reinforce_Agent(CartPoleTask, config, 'Test-Reinforce')
+    parameters = [p.clone() for p in agent.algorithm.model.parameters()]
+
+    trajectory = CartPoleTask.run_episode([agent], training=True)
+    assert agent.algorithm.number_of_stored_experiences == len(trajectory)
+    assert not agent.current_prediction['action_log_probability'].requires_grad
+    assert all(torch.equal(p, q) for p, q in zip(parameters, agent.algorithm.model.parameters()))
+
+    for _ in range(2): CartPoleTask.run_episode([agent], training=True)
+    assert agent.algorithm.number_of_stored_experiences == 0 and agent.algorithm.episode_ends == []
+    assert any(not torch.equal(p, q) for p, q in zip(parameters, agent.algorithm.model.parameters()))
+
+
+def test_reinforce_recomputes_log_probabilities_under_the_stored_legal_action_masks(CartPoleTask, reinforce_config_dict):
+    config = dict(reinforce_config_dict, recompute_on_update=True)
+    agent = build_Reinforce_Agent(CartPoleTask, config, 'Test-Reinforce')
+    observation = CartPoleTask.env.observation_space.sample()
+    assert agent.take_action(observation, legal_actions=[1]) == 1
+    agent.handle_experience(observation, 1, 1., observation, done=False)
+    agent.take_action(observation)
+    agent.handle_experience(observation, 0, 1., observation, done=False)
+    assert agent.algorithm.legal_action_masks[:2].tolist() == [[False, True], [True, True]]
+
+    states = torch.from_numpy(agent.algorithm.states[:2])
+    log_probabilities = agent.algorithm.model.log_probabilities(states, torch.tensor([1, 0]),
+                                                                torch.from_numpy(agent.algorithm.legal_action_masks[:2]))
+    # Only legal action at the first observation
+    assert log_probabilities[0] == 0.
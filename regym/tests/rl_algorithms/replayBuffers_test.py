@@ -1,5 +1,11 @@
-from regym.rl_algorithms.replay_buffers import PrioritizedReplayBuffer, EXP
+import copy
+
+from regym.rl_algorithms.replay_buffers import PrioritizedReplayBuffer, ColumnarReplayBuffer, EXP
+from regym.rl_algorithms.replay_buffers import SumTree, ColumnarPrioritizedReplayBuffer
+from regym.rl_algorithms.replay_buffers import MemoryMappedReplayBuffer, EpisodicReplayBuffer, NStepAccumulator
+from regym.rl_algorithms.replay_buffers import SharedMemoryReplayBuffer, RolloutBuffer, BatchPrefetcher
 import numpy as np
+import torch
 
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
@@ -62,5 +68,280 @@ def test_prioritizedReplayBuffer_instantiation():
     plt.show()
 
 
+def generate_experience(i, state_dim=4):
+    state = torch.ones((1, state_dim)) * i
+    next_state = torch.ones((1, state_dim)) * (i + 1)
+    return EXP(state, torch.LongTensor([i % 3]), next_state, torch.ones(1) * i, i % 2 == 0)
+
+
+def test_columnar_replay_buffer_samples_batched_tensors():
+    capacity, batch_size, state_dim = 10, 32, 4
+    replay_buffer = ColumnarReplayBuffer(capacity=capacity)
+    for i in range(capacity):
+        replay_buffer.push(generate_experience(i, state_dim))
+
+    batch = replay_buffer.sample(batch_size)
+    assert batch.state.shape == (batch_size, state_dim) and batch.state.dtype == torch.float32
+    assert batch.next_state.shape == (batch_size, state_dim)
+    assert batch.action.shape == (batch_size,) and batch.action.dtype == torch.int64
+    assert batch.reward.shape == (batch_size,) and batch.reward.dtype == torch.float32
+    assert batch.done.shape == (batch_size,) and batch.done.dtype == torch.bool
+    # Every field of a sampled row must belong to the same transition
+    assert torch.all(batch.state[:, 0] == batch.reward)
+    assert torch.all(batch.next_state[:, 0] == batch.reward + 1)
+    assert torch.all(batch.action == batch.reward.long() % 3)
+    assert torch.all(batch.done == (batch.reward.long() % 2 == 0))
+
+
+def test_columnar_replay_buffer_overwrites_oldest_experiences():
+    capacity = 5
+    replay_buffer = ColumnarReplayBuffer(capacity=capacity)
+    for i in range(capacity + 3):
+        replay_buffer.push(generate_experience(i))
+
+    assert len(replay_buffer) == capacity
+    assert replay_buffer.position == 3
+    stored_rewards = set(replay_buffer.columns['reward'].tolist())
+    assert stored_rewards == set(range(3, capacity + 3))
+
+
+def test_columnar_replay_buffer_save_and_load(tmpdir):
+    replay_buffer = ColumnarReplayBuffer(capacity=5)
+    for i in range(3):
+        replay_buffer.push(generate_experience(i))
+    path = str(tmpdir.join('replay_buffer'))
+    replay_buffer.save(path)
+
+    loaded_replay_buffer = ColumnarReplayBuffer(capacity=5)
+    loaded_replay_buffer.load(path)
+    assert len(loaded_replay_buffer) == 3 and loaded_replay_buffer.position == 3
+    for key in replay_buffer.columns:
+        assert torch.equal(replay_buffer.columns[key], loaded_replay_buffer.columns[key])
+
+
+def test_sum_tree_batched_retrieval_and_updates():
+    capacity = 13
+    priorities = np.random.uniform(size=capacity)
+    sum_tree = SumTree(capacity)
+    sum_tree.update(np.arange(capacity), priorities)
+    assert np.isclose(sum_tree.total(), priorities.sum())
+    assert np.isclose(sum_tree.min(), priorities.min())
+
+    values = np.random.uniform(high=priorities.sum(), size=1000)
+    expected_indices = np.searchsorted(np.cumsum(priorities), values)
+    assert np.all(sum_tree.retrieve(values) == expected_indices)
+
+    # Repeated indices within a single batched update: last one wins
+    sum_tree.update([2, 2, 5], [3., 4., 1e-3])
+    priorities[2], priorities[5] = 4., 1e-3
+    assert np.isclose(sum_tree.total(), priorities.sum())
+    assert np.isclose(sum_tree.min(), priorities.min())
+
+
+def test_columnar_prioritized_replay_buffer_samples_proportionally_to_priority():
+    capacity, batch_size = 4, 10000
+    replay_buffer = ColumnarPrioritizedReplayBuffer(capacity=capacity, alpha=1.0)
+    for i in range(capacity):
+        replay_buffer.add(generate_experience(i), priority=float(i + 1))
+
+    batch, importance_sampling_weights = replay_buffer.sample(batch_size)
+    assert torch.all(batch.state[:, 0] == batch.idx.float())
+    sampling_frequencies = np.bincount(batch.idx.numpy(), minlength=capacity) / batch_size
+    assert np.allclose(sampling_frequencies, np.arange(1, capacity + 1) / 10., atol=1e-2)
+    # Least likely experiences have the (normalized) maximum weight
+    assert importance_sampling_weights.max() == 1.
+    assert torch.allclose(importance_sampling_weights, 1. / (batch.idx.float() + 1))
+
+    replay_buffer.update(np.arange(capacity), np.ones(capacity))
+    _, importance_sampling_weights = replay_buffer.sample(batch_size)
+    assert torch.all(importance_sampling_weights == 1.)
+
+
+def test_memory_mapped_replay_buffer_reopens_last_checkpoint(tmpdir):
+    capacity, directory = 8, str(tmpdir.join('replay_buffer'))
+    replay_buffer = MemoryMappedReplayBuffer(capacity=capacity, directory=directory)
+    for i in range(5):
+        replay_buffer.push(generate_experience(i))
+    replay_buffer.save()
+    # Wraps around the ring buffer: dirty segment spans its end and its beginning
+    for i in range(5, 10):
+        replay_buffer.push(generate_experience(i))
+    assert replay_buffer._dirty_segments() == [(5, 3), (0, 2)]
+    replay_buffer.save()
+    assert replay_buffer._dirty_segments() == [(2, 0)]
+    # Not checkpointed, lost on reopening
+    replay_buffer.push(generate_experience(10))
+    replay_buffer.close()
+
+    reopened_replay_buffer = MemoryMappedReplayBuffer(capacity=capacity, directory=directory)
+    assert len(reopened_replay_buffer) == capacity and reopened_replay_buffer.position == 2
+    assert set(reopened_replay_buffer.columns['reward'][3:].tolist()) == set(range(3, 8))
+    assert set(reopened_replay_buffer.columns['reward'][:2].tolist()) == {8., 9.}
+    # Row overwritten after the checkpoint is rolled back to its checkpointed experience
+    assert reopened_replay_buffer.columns['reward'][2].item() == 2.
+    assert torch.all(reopened_replay_buffer.columns['state'][2] == 2.)
+    batch = reopened_replay_buffer.sample(16)
+    assert torch.all(batch.state[:, 0] == batch.reward)
+
+
+def test_memory_mapped_replay_buffer_deep_copies_do_not_write_to_its_files(tmpdir):
+    capacity, directory = 8, str(tmpdir.join('replay_buffer'))
+    replay_buffer = MemoryMappedReplayBuffer(capacity=capacity, directory=directory)
+    for i in range(3):
+        replay_buffer.push(generate_experience(i))
+    copied_replay_buffer = copy.deepcopy(replay_buffer)
+    assert not isinstance(copied_replay_buffer, MemoryMappedReplayBuffer) and len(copied_replay_buffer) == 3
+
+    copied_replay_buffer.push(generate_experience(10))
+    assert copied_replay_buffer.columns['reward'][:4].tolist() == [0., 1., 2., 10.]
+    assert replay_buffer.columns['reward'][:4].tolist() == [0., 1., 2., 0.]
+
+
+def push_episodes(replay_buffer, number_of_episodes, episode_length):
+    for episode in range(number_of_episodes):
+        for t in range(episode_length):
+            observation = 10 * episode + t
+            replay_buffer.push(EXP(torch.ones((1, 2)) * observation, torch.LongTensor([t]),
+                                   torch.ones((1, 2)) * (observation + 1), torch.ones(1) * observation,
+                                   t == episode_length - 1))
+
+
+def test_episodic_replay_buffer_stores_each_observation_once():
+    number_of_episodes, episode_length = 3, 4
+    replay_buffer = EpisodicReplayBuffer(capacity=100)
+    push_episodes(replay_buffer, number_of_episodes, episode_length)
+
+    assert len(replay_buffer) == number_of_episodes * episode_length
+    # One observation per step, plus the first observation of each episode
+    assert replay_buffer.filled_slots == number_of_episodes * (episode_length + 1)
+    batch = replay_buffer.sample(64)
+    assert torch.all(batch.state[:, 0] == batch.reward)
+    assert torch.all(batch.next_state[:, 0] == batch.reward + 1)
+    assert torch.all(batch.done == (batch.action == episode_length - 1))
+
+
+def test_episodic_replay_buffer_stacks_frames_within_episodes():
+    replay_buffer = EpisodicReplayBuffer(capacity=7, frame_stack=3)
+    push_episodes(replay_buffer, number_of_episodes=3, episode_length=2)
+    # Slots: [21, 22, 2, 10, 11, 12, 20]. Only the terminal observation of the first episode remains
+    assert len(replay_buffer) == 4
+    batch = replay_buffer.gather(torch.LongTensor([6, 0, 3, 4]))
+    assert batch.state[:, ::2].tolist() == [[20, 20, 20], [20, 20, 21], [10, 10, 10], [10, 10, 11]]
+    assert batch.next_state[:, ::2].tolist() == [[20, 20, 21], [20, 21, 22], [10, 10, 11], [10, 11, 12]]
+
+
+def test_n_step_accumulator_builds_n_step_returns():
+    n, gamma = 3, 0.5
+    accumulator = NStepAccumulator(n=n, gamma=gamma)
+    episode_length = 5
+    emitted = []
+    for t in range(episode_length):
+        experience = EXP(torch.ones((1, 2)) * t, torch.LongTensor([t]), torch.ones((1, 2)) * (t + 1),
+                         torch.ones(1) * (t + 1), t == episode_length - 1)
+        emitted.append(accumulator.push(experience))
+
+    # Nothing is emitted until n rewards are known, then all pending experiences are flushed on done
+    assert [len(experiences) for experiences in emitted] == [0, 0, 1, 1, 3]
+    n_step_experiences = [experience for experiences in emitted for experience in experiences]
+    assert [int(experience.state[0, 0]) for experience in n_step_experiences] == [0, 1, 2, 3, 4]
+    assert [int(experience.next_state[0, 0]) for experience in n_step_experiences] == [3, 4, 5, 5, 5]
+    assert [experience.discount_exponent for experience in n_step_experiences] == [3, 3, 3, 2, 1]
+    assert [experience.done for experience in n_step_experiences] == [False, False, True, True, True]
+    expected_returns = [1 + 2 * 0.5 + 3 * 0.25, 2 + 3 * 0.5 + 4 * 0.25, 3 + 4 * 0.5 + 5 * 0.25, 4 + 5 * 0.5, 5]
+    assert np.allclose([float(experience.reward) for experience in n_step_experiences], expected_returns)
+    assert accumulator.count == 0
+
+    replay_buffer = ColumnarReplayBuffer(capacity=5)
+    for experience in n_step_experiences: replay_buffer.push(experience)
+    assert replay_buffer.columns['discount_exponent'].tolist() == [3, 3, 3, 2, 1]
+
+
+def push_experiences(replay_buffer, first, last):
+    for i in range(first, last):
+        replay_buffer.push(generate_experience(i))
+
+
+def test_shared_memory_replay_buffer_gathers_experiences_from_several_processes():
+    from torch.multiprocessing import Process
+    number_of_processes, experiences_per_process = 3, 20
+    replay_buffer = SharedMemoryReplayBuffer(capacity=100, experience=generate_experience(0))
+    processes = [Process(target=push_experiences,
+                         args=(replay_buffer, i * experiences_per_process, (i + 1) * experiences_per_process))
+                 for i in range(number_of_processes)]
+    for process in processes: process.start()
+    for process in processes: process.join()
+
+    total_experiences = number_of_processes * experiences_per_process
+    assert len(replay_buffer) == total_experiences and replay_buffer.position == total_experiences
+    stored_rewards = replay_buffer.columns['reward'][:total_experiences].tolist()
+    assert sorted(stored_rewards) == list(range(total_experiences))
+    batch = replay_buffer.sample(64)
+    assert torch.all(batch.state[:, 0] == batch.reward)
+
+
+def test_shared_memory_replay_buffer_deep_copies_are_independent():
+    replay_buffer = SharedMemoryReplayBuffer(capacity=10, experience=generate_experience(0))
+    push_experiences(replay_buffer, 0, 3)
+    copied_replay_buffer = copy.deepcopy(replay_buffer)
+    assert len(copied_replay_buffer) == 3 and copied_replay_buffer.columns['reward'].is_shared()
+
+    push_experiences(copied_replay_buffer, 10, 12)
+    assert len(replay_buffer) == 3 and len(copied_replay_buffer) == 5
+    assert replay_buffer.columns['reward'][:5].tolist() == [0., 1., 2., 0., 0.]
+    assert copy.deepcopy(replay_buffer, memo={id(replay_buffer): replay_buffer}) is replay_buffer
+
+
+def test_rollout_buffer_writes_in_place_and_exposes_flat_views():
+    horizon, num_envs, state_dim = 4, 2, 3
+    rollout_buffer = RolloutBuffer(horizon, num_envs=num_envs)
+    rollout_buffer.add_key('rnn_states')
+    for t in range(horizon + 1):
+        rollout_buffer.add({'s': torch.ones((num_envs, state_dim)) * t, 'v': torch.ones((num_envs, 1)) * t,
+                            'ent': torch.zeros((num_envs, 1)), 'rnn_states': t})
+        if t < horizon: rollout_buffer.add({'r': t, 'non_terminal': 1})
+
+    states = rollout_buffer.columns['s']
+    assert states.shape == (horizon + 1, num_envs, state_dim) and 'ent' not in rollout_buffer.columns
+    assert rollout_buffer.columns['r'].shape == (horizon + 1, num_envs)
+    assert rollout_buffer.rnn_states == list(range(horizon + 1))
+    flat_states = rollout_buffer.flat('s')
+    assert flat_states.shape == (horizon * num_envs, state_dim)
+    assert flat_states.data_ptr() == states.data_ptr()
+    assert flat_states[:, 0].tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+    assert rollout_buffer.flat('r').tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+
+    rollout_buffer.reset()
+    rollout_buffer.add({'s': torch.ones((num_envs, state_dim)) * 7})
+    assert rollout_buffer.columns['s'] is states and states[0, 0, 0] == 7
+    assert rollout_buffer.rnn_states == []
+    # Tensors attached to a graph (or on GPU) are copied in too
+    rollout_buffer.add({'v': torch.ones((num_envs, 1), requires_grad=True) * 5})
+    assert rollout_buffer.columns['v'][0, 0, 0] == 5
+
+
+def test_batch_prefetcher_serves_batches_sampled_after_last_invalidation():
+    replay_buffer = ColumnarReplayBuffer(capacity=10)
+    for i in range(10):
+        replay_buffer.push(generate_experience(0))
+
+    def sample_fn():
+        with prefetcher.lock:
+            return replay_buffer.sample(4)
+    prefetcher = BatchPrefetcher(sample_fn, depth=3)
+    assert torch.all(prefetcher.get().reward == 0)
+
+    with prefetcher.lock:
+        for i in range(10):
+            replay_buffer.push(generate_experience(1))
+    prefetcher.invalidate()
+    for _ in range(5):
+        assert torch.all(prefetcher.get().reward == 1)
+    prefetcher.close()
+
+    statistics = prefetcher.statistics()
+    assert statistics['batches_served'] == 6
+    assert 0 <= statistics['mean_queue_depth'] <= 3 and 0 <= statistics['sample_bound_fraction'] <= 1
+    assert statistics['mean_wait_time'] >= 0
+
 if __name__ == "__main__":
     test_prioritizedReplayBuffer_instantiation()
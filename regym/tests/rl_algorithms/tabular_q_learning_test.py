@@ -1,4 +1,12 @@
+import gc
+import multiprocessing
+import pickle
+
+import numpy as np
+import pytest
+
 from regym.rl_algorithms import rockAgent
+from regym.rl_algorithms.TQL import HashedQTable, SharedQTable, QTableSnapshot, gather_q_values, scatter_q_values
 from regym.rl_algorithms.agents import build_TabularQ_Agent
 
 from test_fixtures import tabular_q_learning_config_dict, RPSTask, RPSTaskSingleRepetition
@@ -56,3 +64,181 @@ def test_learns_to_beat_rock_in_RPS(RPSTaskSingleRepetition, tabular_q_learning_
                                reward_tolerance=0.,
                                maximum_average_reward=1.0,
                                evaluation_method='cumulative')
+
+
+def test_hashed_q_table_reads_zeros_for_unvisited_states_and_keeps_values_when_growing():
+    q_table = HashedQTable(action_space_size=3, initial_capacity=4)
+    assert q_table[123, 1] == 0. and list(q_table[123, :]) == [0., 0., 0.]
+    assert len(q_table) == 0 and 123 not in q_table
+
+    keys = np.random.choice(np.arange(-10**12, 10**12, 7919), size=2000, replace=False)
+    for i, key in enumerate(keys): q_table[key, i % 3] = float(i)
+    q_table[keys[0], 0] += 10.
+    assert len(q_table) == len(keys) and q_table.shape == (len(keys), 3)
+    assert q_table[keys[0], 0] == 10.
+    assert all(q_table[key, i % 3] == float(i) for i, key in enumerate(keys[1:], start=1))
+    assert len(q_table.keys) <= 8 * len(keys)
+
+
+def test_hashed_q_table_spreads_keys_which_only_differ_in_their_high_bits():
+    q_table = HashedQTable(action_space_size=3)
+    keys = [i << 40 for i in range(3000)]
+    for key in keys: q_table[key, 0] = 1.
+    # Distance of every key from its home slot, which grows quadratically with the number of colliding keys
+    occupied_slots = np.flatnonzero(q_table.occupied)
+    home_slots = [((int(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> q_table.shift
+                  for key in q_table.keys[occupied_slots]]
+    assert np.mean((occupied_slots - home_slots) & q_table.mask) < 2.
+    assert all(q_table[key, 0] == 1. for key in keys)
+
+
+def test_hashed_q_table_rejects_state_hashes_which_do_not_fit_in_64_bits():
+    q_table = HashedQTable(action_space_size=3)
+    with pytest.raises(ValueError, match='64 bit'):
+        q_table[2**64, 0] = 1.
+    assert q_table[2**64, 0] == 0. and len(q_table) == 0
+
+
+def test_tabular_q_learning_with_hashed_q_table_only_stores_visited_states(RPSTask, tabular_q_learning_config_dict):
+    tabular_q_learning_config_dict['q_table_backend'] = 'hashed'
+    agent = build_TabularQ_Agent(RPSTask, tabular_q_learning_config_dict, 'TQL')
+    assert isinstance(agent.algorithm.Q_table, HashedQTable)
+    trajectory = RPSTask.run_episode([agent, rockAgent], training=True)
+    visited_states = {RPSTask.hash_function(o[0]) for (o, a, r, succ_o, done) in trajectory}
+    assert set(agent.algorithm.Q_table.keys[agent.algorithm.Q_table.occupied]) == visited_states
+
+
+def test_repeated_update_q_learning_batched_updates_compose_repeated_state_action_pairs(RPSTask, tabular_q_learning_config_dict):
+    tabular_q_learning_config_dict['use_repeated_update_q_learning'] = True
+    for backend in ['dense', 'hashed']:
+        tabular_q_learning_config_dict['q_table_backend'] = backend
+        algorithm = build_TabularQ_Agent(RPSTask, tabular_q_learning_config_dict, 'TQL_RUQL').algorithm
+        algorithm.hashing_function = lambda s: s  # States are given already hashed
+        algorithm.Q_table[7, :] = [1., 2., 3.]
+        algorithm.Q_table[8, :] = [0.5, 0., -1.]
+        states, actions, rewards, succ_states = [7, 8, 7, 7], [0, 2, 0, 1], [1., -1., 0., 2.], [8, 7, 7, 8]
+
+        # Expected: sequential updates, with policies and targets computed before any update
+        expected = np.array([algorithm.Q_table[7, :], algorithm.Q_table[8, :]], dtype=np.float64)
+        policies = algorithm.boltzman_exploratory_policies([7, 8])
+        targets = [r + algorithm.discount_factor * expected[s - 7].max() for r, s in zip(rewards, succ_states)]
+        for s, a, target in zip(states, actions, targets):
+            x = (1 - algorithm.learning_rate)**(1 / policies[s - 7][a])
+            expected[s - 7, a] = x * expected[s - 7, a] + (1 - x) * target
+
+        algorithm.update_q_tables(states, actions, rewards, succ_states)
+        np.testing.assert_allclose([algorithm.Q_table[7, :], algorithm.Q_table[8, :]], expected)
+
+
+def test_repeated_update_q_learning_batched_policies_match_single_state_policies(RPSTask, tabular_q_learning_config_dict):
+    tabular_q_learning_config_dict['use_repeated_update_q_learning'] = True
+    algorithm = build_TabularQ_Agent(RPSTask, tabular_q_learning_config_dict, 'TQL_RUQL').algorithm
+    algorithm.Q_table[:] = np.random.normal(scale=100., size=algorithm.Q_table.shape)
+    observations = [RPSTask.env.observation_space.sample()[0] for _ in range(20)]
+    policies = algorithm.boltzman_exploratory_policies(observations)
+    assert np.all(np.isfinite(policies)) and np.allclose(policies.sum(axis=1), 1.)
+    for observation, policy in zip(observations, policies):
+        np.testing.assert_allclose(algorithm.boltzman_exploratory_policy_from_state(algorithm.hashing_function(observation)), policy)
+
+
+def _update_shared_q_table(pickled_q_table, state):
+    q_table = pickle.loads(pickled_q_table)
+    for _ in range(100): q_table[state, 0] += 1.
+
+
+def test_shared_q_table_is_updated_by_every_process_attached_to_it():
+    q_table = SharedQTable(state_space_size=10, action_space_size=3)
+    attached_q_table = pickle.loads(pickle.dumps(q_table.handle()))
+    attached_q_table[1, 2] = 5.
+    assert q_table[1, 2] == 5.
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_update_shared_q_table, args=(pickle.dumps(q_table.handle()), state))
+                 for state in [3, 4]]
+    for process in processes: process.start()
+    for process in processes: process.join()
+    assert all(process.exitcode == 0 for process in processes)
+    assert q_table[3, 0] == 100. and q_table[4, 0] == 100.
+
+
+def test_pickled_shared_q_table_keeps_its_values_once_the_original_is_collected():
+    q_table = SharedQTable(state_space_size=10, action_space_size=3)
+    q_table[4, 1] = 3.
+    pickled_q_table = pickle.dumps(q_table)
+    del q_table
+    gc.collect()
+
+    unpickled_q_table = pickle.loads(pickled_q_table)
+    assert isinstance(unpickled_q_table, SharedQTable) and unpickled_q_table[4, 1] == 3.
+    unpickled_q_table[4, 1] = 1.
+    assert pickle.loads(pickled_q_table)[4, 1] == 3.
+
+
+def test_shared_q_table_snapshots_are_read_only_copies():
+    q_table = SharedQTable(state_space_size=10, action_space_size=3)
+    q_table[2, :] = [1., 2., 3.]
+    snapshot = q_table.snapshot()
+
+    q_table[2, 1] = -1.
+    scatter_q_values(q_table, [5, 6], [0, 0], [7., 8.])
+    assert q_table[2, 1] == -1. and q_table[5, 0] == 7.
+    assert list(snapshot[2, :]) == [1., 2., 3.] and snapshot[5, 0] == 0.
+    np.testing.assert_array_equal(gather_q_values(snapshot, [2, 5, 6]), [[1., 2., 3.], [0., 0., 0.], [0., 0., 0.]])
+    with pytest.raises(TypeError): snapshot[2, 1] = 0.
+
+    # Snapshots sent to other processes are full copies
+    copied_q_table = pickle.loads(pickle.dumps(snapshot))
+    assert isinstance(copied_q_table, np.ndarray)
+    np.testing.assert_array_equal(copied_q_table, snapshot.to_numpy())
+
+
+def test_shared_q_table_snapshots_only_copy_the_pages_written_since_the_previous_snapshot():
+    q_table = SharedQTable(state_space_size=1000, action_space_size=3)
+    page_nbytes = q_table.rows_per_page * q_table[0, :].nbytes
+    assert q_table.snapshot().nbytes == 0
+    q_table[2, 0] = 1.
+    first_snapshot = q_table.snapshot()
+    assert first_snapshot.nbytes == page_nbytes
+
+    q_table[q_table.rows_per_page, 0] = 2.
+    second_snapshot = q_table.snapshot()
+    assert second_snapshot.pages[0] is first_snapshot.pages[0]
+    assert second_snapshot.pages[1] is not first_snapshot.pages[1]
+    assert first_snapshot[q_table.rows_per_page, 0] == 0. and second_snapshot[q_table.rows_per_page, 0] == 2.
+    assert second_snapshot[2, 0] == 1.
+
+    # Once all snapshots are collected, the next one copies every page which was ever written to
+    del first_snapshot, second_snapshot
+    gc.collect()
+    assert q_table.snapshot().nbytes == 2 * page_nbytes
+
+
+def test_shared_q_table_snapshots_detect_writes_made_by_other_processes():
+    q_table = SharedQTable(state_space_size=1000, action_space_size=3)
+    snapshot = q_table.snapshot()
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_update_shared_q_table, args=(pickle.dumps(q_table.handle()), state))
+                 for state in [3, 700]]
+    for process in processes: process.start()
+    for process in processes: process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    updated_snapshot = q_table.snapshot()
+    assert snapshot[3, 0] == 0. and snapshot[700, 0] == 0.
+    assert updated_snapshot[3, 0] == 100. and updated_snapshot[700, 0] == 100.
+    assert updated_snapshot.nbytes == 2 * q_table.rows_per_page * q_table[0, :].nbytes
+    # Snapshots taken through handles are full copies
+    assert isinstance(q_table.handle().snapshot(), np.ndarray)
+
+
+def test_tabular_agents_with_shared_q_table_share_it_while_training_and_snapshot_it_otherwise(RPSTask, tabular_q_learning_config_dict):
+    tabular_q_learning_config_dict['q_table_backend'] = 'shared'
+    agent = build_TabularQ_Agent(RPSTask, tabular_q_learning_config_dict, 'TQL')
+    training_clone, frozen_clone = agent.clone(training=True), agent.clone(training=False)
+    assert training_clone.algorithm.Q_table is agent.algorithm.Q_table
+    assert isinstance(frozen_clone.algorithm.Q_table, QTableSnapshot)
+
+    for _ in range(5): RPSTask.run_episode([training_clone, rockAgent], training=True)
+    assert np.any(agent.algorithm.Q_table.values != 0.)
+    np.testing.assert_array_equal(frozen_clone.algorithm.Q_table.to_numpy(), 0.)
+    frozen_clone.take_action(RPSTask.env.observation_space.sample()[0], legal_actions=[0, 1, 2])
@@ -117,3 +117,10 @@ def test_can_detect_convergence_to_threshold_best_response(RPS_task):
     psro.match_outcome_rolling_window = random_match_outcome_window
 
     assert psro.has_policy_converged()
+
+
+def test_quantized_menagerie_fully_copies_agents_which_cannot_be_frozen(RPS_task):
+    psro = PSRONashResponse(task=RPS_task, benchmarking_episodes=2, quantize_menagerie=True)
+    psro.add_agent_to_menagerie(rockAgent)
+    assert len(psro.menagerie) == 1 and psro.menagerie[0] is not rockAgent
+    assert psro.menagerie[0].support_vector == rockAgent.support_vector
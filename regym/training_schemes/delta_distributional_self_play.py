@@ -9,17 +9,20 @@ allows to use distributions which aren't uniform.
 class DeltaDistributionalSelfPlay():
 
 
-    def __init__(self, delta, distribution):
+    def __init__(self, delta, distribution, quantize_menagerie=False):
         '''
         :param delta: determines the percentage of the menagerie that will be
                       considered by the opponent_sampling_distribution:
                       - delta = 0 (all history),
                       - delta = 1 (only latest agent, Naive Self Play)
         :param distribution: Distribution to be used over the filtered set of agents.
+        :param quantize_menagerie: Whether to hook int8 quantized, frozen, snapshots of the
+                                   agents added to the menagerie (see AgentHook).
         '''
         self.name = f'd={delta},{distribution.__name__}'
         self.delta = delta
         self.distribution = distribution
+        self.quantize_menagerie = quantize_menagerie
 
     def opponent_sampling_distribution(self, menagerie, training_agent):
         '''
@@ -45,4 +48,5 @@ class DeltaDistributionalSelfPlay():
         :returns: menagerie to be used in the next training episode.
         '''
 
-        return menagerie + [AgentHook(training_agent.clone(training=False), save_path=candidate_save_path)]
+        return menagerie + [AgentHook(training_agent.clone(training=False), save_path=candidate_save_path,
+                                      quantize=self.quantize_menagerie)]
@@ -13,6 +13,7 @@ from itertools import product
 import numpy as np
 
 from regym.rl_algorithms import AgentHook
+from regym.rl_algorithms.agents import freeze_if_supported
 from regym.game_theory import compute_nash_averaging
 from regym.util import play_multiple_matches
 from regym.util import extract_winner
@@ -27,7 +28,8 @@ class PSRONashResponse():
                  meta_game_solver: Callable = lambda winrate_matrix: compute_nash_averaging(winrate_matrix, perform_logodds_transformation=True)[0],
                  threshold_best_response: float = 0.7,
                  benchmarking_episodes: int = 10,
-                 match_outcome_rolling_window_size: int = 10):
+                 match_outcome_rolling_window_size: int = 10,
+                 quantize_menagerie: bool = False):
         '''
         :param task: Multiagent task 
         :param meta_game_solver: Function which takes a meta-game and returns a probability
@@ -42,6 +44,10 @@ class PSRONashResponse():
         :param match_outcome_rolling_window_size: Number of episodes that will be used to
                                                   decide whether the currently training agent
                                                   has converged to a best response.
+        :param quantize_menagerie: Whether to store int8 quantized, frozen, snapshots of
+                                   the agents added to the menagerie (see `agent.freeze(quantize=True)`),
+                                   instead of full copies. Agents which can't be frozen
+                                   (see `freeze_if_supported`) are fully copied.
         '''
         self.name = f'PSRO(M=maxentNash,O=BestResponse(wr={threshold_best_response},ws={match_outcome_rolling_window_size})'
         self.logger = logging.getLogger(self.name)
@@ -54,6 +60,7 @@ class PSRONashResponse():
         self.meta_game_solver = meta_game_solver
         self.meta_game, self.meta_game_solution = None, None
         self.menagerie = []
+        self.quantize_menagerie = quantize_menagerie
 
         self.threshold_best_response = threshold_best_response
         self.match_outcome_rolling_window = []
@@ -159,7 +166,8 @@ class PSRONashResponse():
     def add_agent_to_menagerie(self, training_agent, candidate_save_path=None):
         if candidate_save_path is not None:
             AgentHook(training_agent, save_path=candidate_save_path)
-        self.menagerie.append(training_agent.clone(training=False))
+        frozen_agent = freeze_if_supported(training_agent, quantize=True) if self.quantize_menagerie else None
+        self.menagerie.append(frozen_agent if frozen_agent is not None else training_agent.clone(training=False))
 
     def create_new_iteration_statistics(self, last_iteration_statistics):
         return self.IterationStatistics(len(self.statistics), last_iteration_statistics.total_elapsed_episodes,